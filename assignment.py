@@ -0,0 +1,91 @@
+"""Распределение игровых мастеров по сеансам.
+
+Сеанс — интервал [начало, конец) в минутах от начала дня. Мастер не может вести
+два пересекающихся сеанса; несколько броней одного сеанса ведёт один мастер.
+Нагрузка мастера — сумма минут его сеансов за день, и при выборе предпочтение
+отдаётся наименее загруженному.
+
+Все функции чистые: на вход — сеансы дня и список мастеров, на выход — план.
+Сеансов в день сотни, поэтому достаточно сортировки и куч: O(n log n + n log k).
+"""
+import heapq
+
+
+def minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def day_load(rows):
+    # rows — (schedule_id, начало, конец, employee_id) активных броней дня;
+    # сеанс с несколькими бронями учитывается один раз
+    load, seen = {}, set()
+    for schedule_id, start, end, employee_id in rows:
+        if employee_id is None or (employee_id, schedule_id) in seen:
+            continue
+        seen.add((employee_id, schedule_id))
+        load[employee_id] = load.get(employee_id, 0) + end - start
+    return load
+
+
+def rank_candidates(schedule_id, start, end, rows, employees):
+    # Мастера, свободные в [start, end), от наименее загруженного. Если у сеанса
+    # уже есть мастер (по другой брони), он идёт первым — сеанс ведёт один человек
+    busy, current = set(), None
+    for other_id, other_start, other_end, employee_id in rows:
+        if employee_id is None:
+            continue
+        if other_id == schedule_id:
+            current = employee_id
+        elif other_start < end and other_end > start:
+            busy.add(employee_id)
+
+    load = day_load(rows)
+    candidates = sorted((e for e in employees if e not in busy), key=lambda e: (load.get(e, 0), e))
+    if current in candidates:
+        candidates.remove(current)
+        candidates.insert(0, current)
+    return candidates
+
+
+def plan_day(slots, employees, current=None, fixed=None):
+    # slots — (schedule_id, начало, конец); current — {schedule_id: мастер} до
+    # пересчёта. Сеансы обходятся по времени начала, каждый получает свободного
+    # мастера с наименьшей нагрузкой (при равной нагрузке остаётся прежний).
+    # Так пересекающиеся сеансы занимают минимум мастеров; сеансы, на которые
+    # мастеров не хватило, попадают в unassigned. fixed — {schedule_id: мастер}
+    # сеансов, которые не пересчитываются (например, начатых накануне): их
+    # мастер занят, пока сеанс идёт.
+    # -> (план {schedule_id: мастер}, unassigned, нагрузка {мастер: минуты})
+    current = current or {}
+    fixed = fixed or {}
+    load = {e: 0 for e in employees}
+    free = set(employees)
+    free_heap = [(0, e) for e in employees]
+    heapq.heapify(free_heap)
+    busy = []
+    plan, unassigned = {}, []
+
+    for schedule_id, start, end in sorted(slots, key=lambda s: (s[1], s[2], s[0])):
+        while busy and busy[0][0] <= start:
+            _, employee_id = heapq.heappop(busy)
+            free.add(employee_id)
+            heapq.heappush(free_heap, (load[employee_id], employee_id))
+        # Записи о мастерах, которые с тех пор заняты или набрали нагрузку, устарели
+        while free_heap and (free_heap[0][1] not in free or free_heap[0][0] != load[free_heap[0][1]]):
+            heapq.heappop(free_heap)
+        if not free_heap:
+            unassigned.append(schedule_id)
+            continue
+
+        chosen = free_heap[0][1]
+        previous = current.get(schedule_id)
+        if fixed.get(schedule_id) in free:
+            chosen = fixed[schedule_id]
+        elif previous in free and load[previous] == load[chosen]:
+            chosen = previous
+        free.discard(chosen)
+        load[chosen] += end - start
+        heapq.heappush(busy, (end, chosen))
+        plan[schedule_id] = chosen
+
+    return plan, unassigned, load
@@ -0,0 +1,75 @@
+"""Сетка свободного времени комнат в виде битовых масок.
+
+День делится на клетки по step минут от открытия. Занятость комнаты за день —
+целое число, в котором бит i установлен, если клетка i пересекается с каким-то
+сеансом. Из занятости получается маска начал: бит i установлен, если квест
+длительностью duration может начаться в клетке i и целиком уложиться в
+свободное время до закрытия.
+
+Маски дня кодируются bytes_per_day байтами little-endian (бит i — байт i // 8,
+бит i % 8), дни комнаты идут подряд. Месяц для двадцати комнат — несколько КБ.
+
+OccupancyCache хранит занятость по дням. Запись расписания сбрасывает день;
+поколение дня не даёт положить в кэш данные, прочитанные до сброса.
+"""
+from collections import OrderedDict
+
+
+def cell_count(opening, closing, step):
+    return (closing - opening + step - 1) // step
+
+
+def occupancy_mask(sessions, opening, closing, step):
+    # sessions — (начало, конец) в минутах
+    cells = cell_count(opening, closing, step)
+    mask = 0
+    for start, end in sessions:
+        first = max((start - opening) // step, 0)
+        last = min((end - opening + step - 1) // step, cells)
+        if last > first:
+            mask |= ((1 << (last - first)) - 1) << first
+    return mask
+
+
+def start_mask(occupied, duration, opening, closing, step, earliest=None):
+    # Клетки, с которых квест помещается целиком; earliest — не раньше этой минуты
+    cells = cell_count(opening, closing, step)
+    free = ~occupied & ((1 << cells) - 1)
+    starts = free
+    for shift in range(1, (duration + step - 1) // step):
+        starts &= free >> shift
+    # Сеанс должен закончиться до закрытия
+    last_start = (closing - duration - opening) // step
+    starts &= (1 << (last_start + 1)) - 1 if last_start >= 0 else 0
+    if earliest is not None and earliest > opening:
+        starts &= ~((1 << ((earliest - opening + step - 1) // step)) - 1)
+    return starts
+
+
+class OccupancyCache:
+    def __init__(self, max_days=400):
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._generations = {}
+
+    def generation(self, day):
+        return self._generations.get(day, 0)
+
+    def get(self, day):
+        masks = self._days.get(day)
+        if masks is not None:
+            self._days.move_to_end(day)
+        return masks
+
+    def put(self, day, masks, generation):
+        # День сбросили, пока шло чтение из базы, — данные могли устареть
+        if generation != self.generation(day):
+            return
+        self._days[day] = masks
+        self._days.move_to_end(day)
+        while len(self._days) > self.max_days:
+            self._days.popitem(last=False)
+
+    def invalidate(self, day):
+        self._days.pop(day, None)
+        self._generations[day] = self.generation(day) + 1
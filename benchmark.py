@@ -0,0 +1,334 @@
+"""Нагрузочное тестирование API Black Rooms.
+
+Заполняет базу заданным объёмом данных и прогоняет смесь сценариев
+(обновление админки, оформление брони, всплеск логинов) против приложения
+в том же процессе или через локальный uvicorn. Результат — JSON
+с p50/p95/p99 и пропускной способностью по каждому маршруту.
+
+Пример:
+    python benchmark.py --db bench.db --bookings 200000 --mode uvicorn \\
+        --concurrency 8 --iterations 500 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from generate_data import GENERATED_PASSWORD
+
+DEFAULT_MIX = "admin_refresh=1,booking_checkout=3,login_burst=2"
+
+
+# Заполнение базы
+
+def seed_database(db_path, quests, rooms, clients, schedules, bookings, seed):
+    os.environ["BLACKROOMS_DATABASE_URL"] = f"sqlite:///{db_path}"
+    import generate_data
+
+    return asyncio.run(generate_data.generate(
+        quests=quests, rooms=rooms, clients=clients, schedules=schedules, bookings=bookings,
+        reviews=bookings // 10, seed=seed,
+    ))
+
+
+# Транспорт
+
+class InProcessTransport:
+    """Запросы к приложению без сети, через TestClient."""
+
+    def __init__(self):
+        from fastapi.testclient import TestClient
+        import main
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.base_url = ""
+
+    def session(self):
+        return self.client
+
+    def close(self):
+        self.client.__exit__(None, None, None)
+
+
+class HttpTransport:
+    def __init__(self, base_url, process=None):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.process = process
+        self._local = threading.local()
+        self._requests = requests
+
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self._requests.Session()
+        return self._local.session
+
+    def close(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+
+def start_uvicorn(db_path, port):
+    env = dict(os.environ, BLACKROOMS_DATABASE_URL=f"sqlite:///{db_path}")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("uvicorn не запустился за 30 секунд")
+
+
+# Сценарии
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def request(self, transport, method, route, path, **kwargs):
+        session = transport.session()
+        started = time.perf_counter()
+        try:
+            response = session.request(method, transport.base_url + path, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+
+        key = f"{method} {route}"
+        with self._lock:
+            self.samples.setdefault(key, []).append(elapsed)
+            if not ok:
+                self.errors[key] = self.errors.get(key, 0) + 1
+        return response.json() if ok else None
+
+
+def login(transport, recorder, username, scope):
+    # POST /token, как TokenAuth.login в клиенте; -> ответ с токенами или None
+    return recorder.request(transport, "POST", "/token", "/token",
+                            data={"username": username, "password": GENERATED_PASSWORD, "scope": scope})
+
+
+class TokenCache:
+    """Access-токены по логину: как клиентское приложение, сценарий входит один
+    раз и заново — только незадолго до истечения токена."""
+
+    def __init__(self, margin=30):
+        self.margin = margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def headers(self, transport, recorder, username, scope):
+        with self._lock:
+            cached = self._tokens.get(username)
+        if cached is None or time.monotonic() >= cached[1]:
+            token = login(transport, recorder, username, scope)
+            if token is None:
+                return None
+            cached = (token["access_token"], time.monotonic() + token["expires_in"] - self.margin)
+            with self._lock:
+                self._tokens[username] = cached
+        return {"Authorization": f"Bearer {cached[0]}"}
+
+
+tokens = TokenCache()
+
+
+def admin_refresh(transport, recorder, rng, volumes):
+    # Повторяет AdminBookingsWindow.load_bookings и AdminServicesWindow.load_services
+    headers = tokens.headers(transport, recorder, "admin", "employee")
+    if headers is None:
+        return
+    for path in ("/bookings/", "/clients/", "/schedules/", "/quests/", "/rooms/", "/employees/", "/services/"):
+        recorder.request(transport, "GET", path, path, headers=headers)
+
+
+def booking_checkout(transport, recorder, rng, volumes):
+    # Повторяет BookingWindow: справочники, подбор комнаты и времени, бронь.
+    # Время берётся из подбора, поэтому бронь не упирается в занятую комнату;
+    # мастера назначает сервер
+    client_id = rng.randint(1, volumes["clients"])
+    headers = tokens.headers(transport, recorder, f"client{client_id}", "client")
+    if headers is None:
+        return
+    recorder.request(transport, "GET", "/quests/", "/quests/", headers=headers)
+    recorder.request(transport, "GET", "/rooms/", "/rooms/", headers=headers)
+    recorder.request(transport, "GET", "/services/", "/services/", headers=headers)
+
+    quest_id = rng.randint(1, volumes["quests"])
+    slot_date = (date.today() + timedelta(days=rng.randint(30, 365))).isoformat()
+    participants = rng.randint(1, 4)
+    suggestions = recorder.request(transport, "GET", "/rooms/suggestions", "/rooms/suggestions", headers=headers,
+                                   params={"quest_id": quest_id, "date": slot_date, "time": "18:00",
+                                           "participants": participants})
+    if not suggestions:
+        return
+
+    best = suggestions[0]
+    booking = {"client_id": client_id, "status": "На рассмотрение", "participants_count": participants}
+    if best["schedule_id"] is not None:
+        recorder.request(transport, "POST", "/bookings/", "/bookings/", headers=headers,
+                         json={**booking, "schedule_id": best["schedule_id"]})
+    else:
+        recorder.request(transport, "POST", "/bookings/new-session", "/bookings/new-session", headers=headers,
+                         json={**booking, "quest_id": quest_id, "room_id": best["room_id"], "date": slot_date,
+                               "start_time": best["start_time"]})
+
+
+def login_burst(transport, recorder, rng, volumes):
+    for _ in range(5):
+        login(transport, recorder, f"client{rng.randint(1, volumes['clients'])}", "client")
+
+
+SCENARIOS = {
+    "admin_refresh": admin_refresh,
+    "booking_checkout": booking_checkout,
+    "login_burst": login_burst,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# Отчёт
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Ближайший ранг: наименьшее значение, не меньше которого fraction всех значений;
+    # round убирает погрешность вроде 0.07 * 100 = 7.000000000000001
+    index = max(0, min(len(sorted_values) - 1, math.ceil(round(fraction * len(sorted_values), 9)) - 1))
+    return sorted_values[index]
+
+
+def build_report(recorder, elapsed, config, volumes):
+    routes = {}
+    total = 0
+    for key, samples in sorted(recorder.samples.items()):
+        values = sorted(samples)
+        total += len(values)
+        routes[key] = {
+            "count": len(values),
+            "errors": recorder.errors.get(key, 0),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+            "throughput_rps": round(len(values) / elapsed, 3) if elapsed else 0.0,
+        }
+    return {
+        "config": config,
+        "volumes": volumes,
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(recorder.errors.values()),
+        "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+        "routes": routes,
+    }
+
+
+def run(transport, mix, iterations, concurrency, seed, volumes):
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    def worker(worker_id, count):
+        rng = random.Random(seed * 1000 + worker_id)
+        for _ in range(count):
+            SCENARIOS[rng.choices(names, weights)[0]](transport, recorder, rng, volumes)
+
+    per_worker = [iterations // concurrency + (1 if i < iterations % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    if concurrency == 1:
+        worker(0, iterations)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker, i, n) for i, n in enumerate(per_worker)]:
+                future.result()
+    return recorder, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование API Black Rooms")
+    parser.add_argument("--db", default="blackrooms_bench.db", help="Файл SQLite для прогона")
+    parser.add_argument("--skip-seed", action="store_true", help="Использовать уже заполненную базу")
+    parser.add_argument("--quests", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=20000)
+    parser.add_argument("--schedules", type=int, default=100000)
+    parser.add_argument("--bookings", type=int, default=100000)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "url"], default="inprocess")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Адрес сервера для режима url")
+    parser.add_argument("--port", type=int, default=8765, help="Порт для режима uvicorn")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--iterations", type=int, default=200, help="Количество сценариев")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    volumes = {"quests": args.quests, "rooms": args.rooms, "clients": args.clients,
+               "schedules": args.schedules, "bookings": args.bookings}
+    os.environ["BLACKROOMS_DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        counts = seed_database(db_path, seed=args.seed, **volumes)
+        print(f"База заполнена за {time.perf_counter() - started:.1f} с: {counts}", file=sys.stderr)
+
+    if args.mode == "inprocess":
+        if args.concurrency != 1:
+            print("Режим inprocess выполняется в один поток", file=sys.stderr)
+            args.concurrency = 1
+        transport = InProcessTransport()
+    elif args.mode == "uvicorn":
+        transport = HttpTransport(f"http://127.0.0.1:{args.port}", start_uvicorn(db_path, args.port))
+    else:
+        transport = HttpTransport(args.url)
+
+    try:
+        recorder, elapsed = run(transport, args.mix, args.iterations, args.concurrency, args.seed, volumes)
+    finally:
+        transport.close()
+
+    config = {"mode": args.mode, "mix": args.mix, "iterations": args.iterations,
+              "concurrency": args.concurrency, "seed": args.seed, "db": db_path}
+    report = json.dumps(build_report(recorder, elapsed, config, volumes), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
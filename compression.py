@@ -0,0 +1,95 @@
+"""Сжатие ответов API с согласованием по Accept-Encoding.
+
+Поддерживаются brotli (если установлен пакет brotli) и gzip. Ответы меньше
+minimum_size и уже сжатые ответы отправляются как есть.
+"""
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него остаётся gzip
+    brotli = None
+
+
+def parse_accept_encoding(value):
+    encodings = {}
+    for part in value.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(accept_encoding):
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_quality = None, 0.0
+    for name in candidates:
+        quality = accepted.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        body = []
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            payload = b"".join(body)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(payload) >= self.minimum_size and "content-encoding" not in headers:
+                payload = self.compress(payload, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(payload))
+                headers.add_vary_header("Accept-Encoding")
+            start_message["headers"] = headers.raw
+            await send(start_message)
+            await send({"type": "http.response.body", "body": payload})
+
+        await self.app(scope, receive, send_compressed)
+
+    def compress(self, payload, encoding):
+        if encoding == "br":
+            return brotli.compress(payload, quality=self.brotli_quality)
+        return gzip.compress(payload, compresslevel=self.gzip_level, mtime=0)
@@ -0,0 +1,116 @@
+"""Нормализованное хранилище сущностей клиента.
+
+Строки каждого ресурса хранятся один раз, по первичному ключу. Окна держат
+только списки id и берут данные отсюда, поэтому одна и та же бронь или клиент
+не копируются в каждую вкладку. Вторичные индексы (брони по расписанию,
+расписания по комнате и дате и т.п.) обновляются вместе с данными и заменяют
+линейные поиски по спискам.
+"""
+
+
+class EntityStore:
+    def __init__(self, primary_keys):
+        self._primary_keys = dict(primary_keys)
+        self._rows = {resource: {} for resource in self._primary_keys}
+        self._indexes = {resource: {} for resource in self._primary_keys}
+        self._listeners = []
+
+    def define_index(self, resource, name, key_func):
+        index = {}
+        for row_id, row in self._rows[resource].items():
+            index.setdefault(key_func(row), set()).add(row_id)
+        self._indexes[resource][name] = (key_func, index)
+
+    def subscribe(self, callback):
+        # callback(resource, ids): ids — изменённые id или None при полной замене
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def primary_key(self, resource):
+        return self._primary_keys[resource]
+
+    def get(self, resource, row_id, default=None):
+        return self._rows[resource].get(row_id, default)
+
+    def get_many(self, resource, ids):
+        table = self._rows[resource]
+        return [table[row_id] for row_id in ids if row_id in table]
+
+    def all(self, resource):
+        return list(self._rows[resource].values())
+
+    def lookup(self, resource, index_name, key):
+        _, index = self._indexes[resource][index_name]
+        return self.get_many(resource, sorted(index.get(key, ())))
+
+    def missing(self, resource, ids, fields=()):
+        # id, которых нет в хранилище или у которых не загружены нужные поля
+        table = self._rows[resource]
+        result = []
+        for row_id in dict.fromkeys(ids):
+            if row_id is None:
+                continue
+            row = table.get(row_id)
+            if row is None or any(field not in row for field in fields):
+                result.append(row_id)
+        return result
+
+    def upsert(self, resource, rows, notify=True):
+        table = self._rows[resource]
+        primary_key = self._primary_keys[resource]
+        changed = []
+        for row in rows:
+            row_id = row[primary_key]
+            existing = table.get(row_id)
+            if existing is None:
+                existing = table[row_id] = dict(row)
+            else:
+                # Частичные строки (?fields=) дополняют уже загруженные
+                self._unindex(resource, row_id, existing)
+                existing.update(row)
+            self._index(resource, row_id, existing)
+            changed.append(row_id)
+        if notify:
+            self._notify(resource, changed)
+        return changed
+
+    def replace(self, resource, rows):
+        # Полный список с сервера: всё, чего в нём нет, удалено
+        self._rows[resource] = {}
+        for _, index in self._indexes[resource].values():
+            index.clear()
+        ids = self.upsert(resource, rows, notify=False)
+        self._notify(resource, None)
+        return ids
+
+    def remove(self, resource, ids):
+        table = self._rows[resource]
+        removed = []
+        for row_id in ids:
+            row = table.pop(row_id, None)
+            if row is not None:
+                self._unindex(resource, row_id, row)
+                removed.append(row_id)
+        if removed:
+            self._notify(resource, removed)
+        return removed
+
+    def _index(self, resource, row_id, row):
+        for key_func, index in self._indexes[resource].values():
+            index.setdefault(key_func(row), set()).add(row_id)
+
+    def _unindex(self, resource, row_id, row):
+        for key_func, index in self._indexes[resource].values():
+            key = key_func(row)
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(row_id)
+                if not ids:
+                    del index[key]
+
+    def _notify(self, resource, ids):
+        for callback in self._listeners:
+            callback(resource, ids)
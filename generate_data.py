@@ -0,0 +1,275 @@
+"""Генератор больших согласованных наборов данных для Black Rooms.
+
+Использует таблицы из main.py и заполняет базу детерминированно (по --seed):
+расписания в каждой комнате не пересекаются, брони не превышают вместимость
+комнаты, игровой мастер не ведёт пересекающиеся сеансы, оплаты совпадают
+с ценой квеста, отзывы оставляют клиенты, которые проходили квест. Все
+таблицы перед генерацией очищаются.
+
+Пример:
+    python generate_data.py --db big.db --clients 50000 --schedules 300000 --bookings 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, time as dtime
+
+from sqlalchemy.dialects import sqlite
+
+from assignment import minutes, plan_day
+
+GENERATED_PASSWORD = "client123"
+OPENING_HOUR = 10
+CLOSING_HOUR = 23
+SLOT_GAP_MINUTES = 15
+
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+              "Новиков", "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров"]
+FIRST_NAMES = ["Алексей", "Дмитрий", "Иван", "Сергей", "Андрей", "Максим", "Елена", "Анна",
+               "Ольга", "Мария", "Наталья", "Татьяна", "Михаил", "Екатерина", "Павел", "Юлия"]
+MIDDLE_NAMES = ["Александрович", "Сергеевич", "Иванович", "Владимирович", "Петрович", "Михайлович"]
+QUEST_WORDS = ["Проклятый", "Забытый", "Тайный", "Последний", "Тёмный", "Затерянный", "Безумный", "Ледяной"]
+QUEST_PLACES = ["замок", "бункер", "госпиталь", "особняк", "маяк", "корабль", "лабиринт", "музей"]
+REVIEW_TEXTS = ["Отличный квест, очень атмосферно!", "Сложновато, но интересно", "Хороший квест для новичков",
+                "Загадки логичные, актёры супер", "Пришли бы ещё раз", "Немного не хватило времени"]
+SERVICES = [("Фотосессия", "Профессиональные фото с квеста", 500),
+            ("Видеосъемка", "Запись прохождения квеста", 800),
+            ("Дополнительный актер", "Актер для усиления погружения", 1000),
+            ("Чаепитие", "Чай и сладости после игры", 300)]
+BOOKING_STATUSES = ["Подтвержден", "Завершен", "Отменен", "На рассмотрение"]
+PAYMENT_METHODS = ["Карта", "Наличные"]
+BOOKING_SERVICE_SHARE = 0.3
+
+
+def person_name(rng):
+    return f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(MIDDLE_NAMES)}"
+
+
+def build_rows(quests, rooms, clients, employees, schedules, bookings, reviews, services, seed,
+               start_date, password_hash):
+    rng = random.Random(seed)
+    rows = {}
+
+    rows["position"] = [
+        {"position_id": 1, "title": "Администратор", "access_level": 3},
+        {"position_id": 2, "title": "Игровой мастер", "access_level": 2},
+        {"position_id": 3, "title": "Уборщик", "access_level": 1},
+    ]
+    rows["employee"] = [
+        {"employee_id": i, "full_name": person_name(rng),
+         "position_id": 1 if i == 1 else (3 if i % 10 == 0 else 2),
+         "login": "admin" if i == 1 else f"employee{i}", "password": password_hash}
+        for i in range(1, employees + 1)
+    ]
+    game_masters = [e["employee_id"] for e in rows["employee"] if e["position_id"] == 2] or [1]
+
+    rows["client"] = [
+        {"client_id": i, "full_name": person_name(rng), "phone": f"+79{rng.randint(0, 999999999):09d}",
+         "email": f"client{i}@example.com",
+         "birth_date": date(1960, 1, 1) + timedelta(days=rng.randint(0, 16000)),
+         "login": f"client{i}", "password": password_hash}
+        for i in range(1, clients + 1)
+    ]
+
+    rows["quest"] = [
+        {"quest_id": i, "title": f"{rng.choice(QUEST_WORDS)} {rng.choice(QUEST_PLACES)} {i}",
+         "description": f"Сюжетный квест №{i}", "difficulty": rng.randint(1, 5),
+         "duration": rng.choice([45, 60, 75, 90]), "price": rng.choice([2000, 2500, 3000, 3500, 4000])}
+        for i in range(1, quests + 1)
+    ]
+    quest_by_id = {q["quest_id"]: q for q in rows["quest"]}
+
+    rows["room"] = [
+        {"room_id": i, "title": f"Комната {i}", "type": rng.choice(["Стандарт", "Премиум"]),
+         "capacity": rng.randint(2, 8), "is_available": rng.random() > 0.05}
+        for i in range(1, rooms + 1)
+    ]
+    capacity = {r["room_id"]: r["capacity"] for r in rows["room"]}
+
+    # Слоты в каждой комнате идут подряд с перерывом, поэтому не пересекаются
+    rows["schedule"] = []
+    room_clock = {r["room_id"]: datetime.combine(start_date, dtime(OPENING_HOUR)) for r in rows["room"]}
+    room_ids = [r["room_id"] for r in rows["room"]]
+    schedule_id = 0
+    while schedule_id < schedules and room_ids:
+        for room_id in room_ids:
+            if schedule_id >= schedules:
+                break
+            quest_row = quest_by_id[rng.randint(1, quests)]
+            starts = room_clock[room_id]
+            ends = starts + timedelta(minutes=quest_row["duration"])
+            if ends > datetime.combine(starts.date(), dtime(CLOSING_HOUR)):
+                starts = datetime.combine(starts.date() + timedelta(days=1), dtime(OPENING_HOUR))
+                ends = starts + timedelta(minutes=quest_row["duration"])
+            schedule_id += 1
+            rows["schedule"].append({
+                "schedule_id": schedule_id, "quest_id": quest_row["quest_id"], "room_id": room_id,
+                "date": starts.date(), "start_time": starts.time(), "end_time": ends.time(),
+                "starts_at": starts, "ends_at": ends,
+            })
+            room_clock[room_id] = ends + timedelta(minutes=SLOT_GAP_MINUTES)
+
+    # Брони: суммарное число участников на слот не больше вместимости комнаты
+    rows["booking"] = []
+    rows["payment"] = []
+    free_places = {s["schedule_id"]: capacity[s["room_id"]] for s in rows["schedule"]}
+    schedule_by_id = {s["schedule_id"]: s for s in rows["schedule"]}
+    candidates = list(free_places)
+    rng.shuffle(candidates)
+    booking_id = 0
+    while booking_id < bookings:
+        progressed = False
+        for slot_id in candidates:
+            if booking_id >= bookings:
+                break
+            if free_places[slot_id] <= 0:
+                continue
+            progressed = True
+            participants = rng.randint(1, free_places[slot_id])
+            free_places[slot_id] -= participants
+            booking_id += 1
+            status = rng.choice(BOOKING_STATUSES)
+            slot = schedule_by_id[slot_id]
+            rows["booking"].append({
+                "booking_id": booking_id, "client_id": rng.randint(1, clients), "schedule_id": slot_id,
+                "employee_id": None, "status": status, "participants_count": participants,
+            })
+            if status in ("Подтвержден", "Завершен"):
+                rows["payment"].append({
+                    "payment_id": len(rows["payment"]) + 1, "booking_id": booking_id,
+                    "payment_method": rng.choice(PAYMENT_METHODS),
+                    "amount": quest_by_id[slot["quest_id"]]["price"],
+                    "payment_date": slot["date"] - timedelta(days=rng.randint(0, 14)),
+                })
+        if not progressed:
+            break
+
+    # Мастера — по дням через plan_day: один мастер на сеанс, без пересечений.
+    # Сеансы, на которые мастеров не хватило, остаются без мастера
+    booked_by_date = {}
+    for b in rows["booking"]:
+        slot = schedule_by_id[b["schedule_id"]]
+        booked_by_date.setdefault(slot["date"], set()).add(slot["schedule_id"])
+    master_of = {}
+    for slot_ids in booked_by_date.values():
+        slots = [(i, minutes(schedule_by_id[i]["start_time"]), minutes(schedule_by_id[i]["end_time"]))
+                 for i in slot_ids]
+        master_of.update(plan_day(slots, game_masters)[0])
+    for b in rows["booking"]:
+        b["employee_id"] = master_of.get(b["schedule_id"])
+
+    completed = [b for b in rows["booking"] if b["status"] == "Завершен"]
+    rng.shuffle(completed)
+    rows["review"] = [
+        {"review_id": i, "client_id": b["client_id"], "quest_id": schedule_by_id[b["schedule_id"]]["quest_id"],
+         "text": rng.choice(REVIEW_TEXTS), "rating": rng.randint(3, 5)}
+        for i, b in enumerate(completed[:reviews], start=1)
+    ]
+
+    rows["service"] = []
+    for i in range(1, services + 1):
+        title, description, price = SERVICES[(i - 1) % len(SERVICES)]
+        rows["service"].append({"service_id": i, "title": title, "description": description, "price": price})
+
+    # Часть броней с одной-двумя услугами по цене каталога
+    rows["booking_service"] = []
+    for b in rows["booking"]:
+        if not rows["service"] or rng.random() >= BOOKING_SERVICE_SHARE:
+            continue
+        for s in rng.sample(rows["service"], min(rng.randint(1, 2), len(rows["service"]))):
+            rows["booking_service"].append({
+                "booking_service_id": len(rows["booking_service"]) + 1, "booking_id": b["booking_id"],
+                "service_id": s["service_id"], "quantity": 1, "price": s["price"],
+            })
+
+    return rows
+
+
+async def insert_rows(database, tables, rows, chunk_size):
+    dialect = sqlite.dialect(paramstyle="named")
+    async with database.connection() as connection:
+        for table in reversed(tables):
+            await connection.execute(table.delete())
+
+        for table in tables:
+            table_rows = rows.get(table.name, [])
+            if not table_rows:
+                continue
+            # execute_many в databases компилирует и выполняет строки по одной,
+            # поэтому пачку отдаём драйверу целиком, внутри транзакции databases
+            # Вставляем только заданные колонки: суммы брони заполнят умолчания и триггеры
+            columns = [c for c in table.columns if c.name in table_rows[0]]
+            sql = str(table.insert().compile(dialect=dialect, column_keys=[c.name for c in columns]))
+            processors = {c.name: c.type.dialect_impl(dialect).bind_processor(dialect) for c in columns}
+            processors = {name: p for name, p in processors.items() if p}
+            for i in range(0, len(table_rows), chunk_size):
+                chunk = [
+                    {c.name: processors[c.name](row.get(c.name)) if c.name in processors else row.get(c.name)
+                     for c in columns}
+                    for row in table_rows[i:i + chunk_size]
+                ]
+                async with connection.transaction():
+                    await connection.raw_connection.executemany(sql, chunk)
+
+
+async def generate(quests=100, rooms=20, clients=10000, employees=30, schedules=50000, bookings=40000,
+                   reviews=10000, services=40, seed=42, start_date=None, chunk_size=20000, log=None):
+    import main
+
+    started = time.perf_counter()
+    password_hash = main.pwd_context.hash(GENERATED_PASSWORD)
+    rows = build_rows(quests, rooms, clients, employees, schedules, bookings, reviews, services, seed,
+                      start_date or date.today(), password_hash)
+    if log:
+        log(f"Данные построены за {time.perf_counter() - started:.1f} с")
+
+    started = time.perf_counter()
+    connected = main.database.is_connected
+    if not connected:
+        await main.database.connect()
+    try:
+        await main.ensure_schema()
+        await insert_rows(main.database, main.metadata.sorted_tables, rows, chunk_size)
+    finally:
+        if not connected:
+            await main.database.disconnect()
+    if log:
+        log(f"Данные записаны за {time.perf_counter() - started:.1f} с")
+
+    return {name: len(table_rows) for name, table_rows in rows.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация больших наборов данных для Black Rooms")
+    # По умолчанию — отдельный файл, чтобы не затереть рабочую базу blackrooms.db
+    parser.add_argument("--db", default="blackrooms_generated.db", help="Файл SQLite, который будет перезаписан")
+    parser.add_argument("--quests", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--employees", type=int, default=30)
+    parser.add_argument("--schedules", type=int, default=50000)
+    parser.add_argument("--bookings", type=int, default=40000)
+    parser.add_argument("--reviews", type=int, default=10000)
+    parser.add_argument("--services", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start-date", type=date.fromisoformat, help="Первый день расписания (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Строк на одну транзакцию")
+    args = parser.parse_args()
+
+    os.environ["BLACKROOMS_DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    log = lambda message: print(message, file=sys.stderr)
+    counts = asyncio.run(generate(
+        quests=args.quests, rooms=args.rooms, clients=args.clients, employees=args.employees,
+        schedules=args.schedules, bookings=args.bookings, reviews=args.reviews, services=args.services,
+        seed=args.seed, start_date=args.start_date, chunk_size=args.chunk_size, log=log,
+    ))
+    for name, count in counts.items():
+        print(f"{name}: {count}")
+    print(f"Пароль всех сгенерированных учётных записей: {GENERATED_PASSWORD}")
+
+
+if __name__ == "__main__":
+    main()
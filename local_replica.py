@@ -0,0 +1,426 @@
+"""Локальная реплика данных API для клиента.
+
+LocalReplica хранит копии строк всех ресурсов в файле SQLite и очередь
+записей, которые не удалось отправить. ReplicaSync догоняет сервер по журналу
+изменений (GET /changes/) и отправляет очередь, когда связь появляется.
+
+Запись без связи с сервером сразу применяется к реплике. Новые строки до
+отправки получают отрицательные временные id; после создания на сервере эти
+id заменяются настоящими, в том числе в ссылках из следующих записей очереди.
+Правка или удаление отправляются, только если строка на сервере не менялась
+с момента правки (сравнение с сохранённой копией без вычисляемых колонок,
+которые сервер пересчитывает сам). Иначе запись считается конфликтом: она
+снимается с очереди, и в реплику возвращается серверная версия.
+"""
+import json
+import sqlite3
+import threading
+
+import requests
+
+# Сколько id читать из реплики одним запросом IN (...)
+ID_CHUNK_SIZE = 500
+
+
+class LocalReplica:
+    def __init__(self, path, primary_keys, derived_fields=None, range_fields=None):
+        self.primary_keys = dict(primary_keys)
+        # {ресурс: колонки}, которые сервер пересчитывает сам (триггерами);
+        # их изменение на сервере не считается конфликтом
+        self.derived_fields = dict(derived_fields or {})
+        # {ресурс: поле}, по которому строки читаются диапазоном (rows_between);
+        # по полю строится индекс, чтобы не разбирать JSON всех строк ресурса
+        self.range_fields = dict(range_fields or {})
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS replica_row ("
+                " resource TEXT NOT NULL,"
+                " row_id INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (resource, row_id)) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS replica_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pending_write ("
+                " write_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " method TEXT NOT NULL,"
+                " resource TEXT NOT NULL,"
+                " row_id INTEGER NOT NULL,"
+                " payload TEXT,"
+                " base TEXT)"
+            )
+            for resource, field in self.range_fields.items():
+                # Частичный индекс по выражению: запрос должен повторять его дословно
+                self._connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self._range_index(resource)} ON replica_row"
+                    f" ({self._json_field(field)}, row_id) WHERE resource = {self._literal(resource)}"
+                )
+
+    # Курсор журнала изменений сервера; None — реплика ещё не загружена
+
+    @property
+    def cursor(self):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM replica_state WHERE key = 'cursor'").fetchone()
+        return int(row[0]) if row else None
+
+    @cursor.setter
+    def cursor(self, value):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO replica_state (key, value) VALUES ('cursor', ?)", (str(value),)
+            )
+
+    @property
+    def ready(self):
+        return self.cursor is not None
+
+    # Чтение
+
+    def rows(self, resource, fields=None, ids=None):
+        with self._lock:
+            if ids is None:
+                cursor = self._connection.execute(
+                    "SELECT data FROM replica_row WHERE resource = ? ORDER BY row_id", (resource,)
+                )
+                data = [row[0] for row in cursor]
+            else:
+                ids = sorted(set(i for i in ids if i is not None))
+                data = []
+                for start in range(0, len(ids), ID_CHUNK_SIZE):
+                    chunk = ids[start:start + ID_CHUNK_SIZE]
+                    cursor = self._connection.execute(
+                        "SELECT data FROM replica_row WHERE resource = ? AND row_id IN"
+                        f" ({', '.join('?' * len(chunk))}) ORDER BY row_id",
+                        (resource, *chunk),
+                    )
+                    data.extend(row[0] for row in cursor)
+
+        rows = [json.loads(item) for item in data]
+        if fields:
+            rows = [{field: row[field] for field in fields if field in row} for row in rows]
+        return rows
+
+    def rows_between(self, resource, first, last, **equal):
+        # Строки, у которых поле из range_fields в [first, last]; equal — ещё
+        # условия «поле = значение» (None — без условия)
+        field = self.range_fields[resource]
+        # Без статистики планировщик выбирает первичный ключ (все строки ресурса)
+        query = (f"SELECT data FROM replica_row INDEXED BY {self._range_index(resource)}"
+                 f" WHERE resource = {self._literal(resource)}"
+                 f" AND {self._json_field(field)} BETWEEN ? AND ?")
+        params = [first, last]
+        for name, value in equal.items():
+            if value is not None:
+                query += f" AND {self._json_field(name)} = ?"
+                params.append(value)
+        with self._lock:
+            data = [row[0] for row in self._connection.execute(query + " ORDER BY row_id", params)]
+        return [json.loads(item) for item in data]
+
+    @staticmethod
+    def _json_field(field):
+        return f"json_extract(data, '$.{field}')"
+
+    @staticmethod
+    def _literal(value):
+        return "'" + value.replace("'", "''") + "'"
+
+    @staticmethod
+    def _range_index(resource):
+        return "ix_replica_" + "".join(c if c.isalnum() else "_" for c in resource) + "_range"
+
+    def get(self, resource, row_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM replica_row WHERE resource = ? AND row_id = ?", (resource, row_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Изменение данных
+
+    def replace(self, resource, rows):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM replica_row WHERE resource = ?", (resource,))
+            self._upsert(resource, rows)
+
+    def upsert(self, resource, rows):
+        with self._lock, self._connection:
+            self._upsert(resource, rows)
+
+    def delete(self, resource, ids):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM replica_row WHERE resource = ? AND row_id = ?", [(resource, i) for i in ids]
+            )
+
+    def has_pending(self, resource=None, row_id=None):
+        query, params = "SELECT 1 FROM pending_write", ()
+        if resource is not None:
+            query, params = query + " WHERE resource = ? AND row_id = ?", (resource, row_id)
+        with self._lock:
+            return self._connection.execute(query + " LIMIT 1", params).fetchone() is not None
+
+    def _upsert(self, resource, rows):
+        primary_key = self.primary_keys[resource]
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO replica_row (resource, row_id, data) VALUES (?, ?, ?)",
+            [(resource, row[primary_key], json.dumps(row, ensure_ascii=False)) for row in rows],
+        )
+
+    # Очередь записей
+
+    def enqueue(self, method, resource, row_id, payload=None):
+        # Применяет запись к реплике и ставит её в очередь; возвращает то же,
+        # что вернул бы сервер: строку для post/put, True для delete
+        primary_key = self.primary_keys[resource]
+        with self._lock, self._connection:
+            if method == "post":
+                temp_id = min(0, self._connection.execute(
+                    "SELECT COALESCE(MIN(row_id), 0) FROM replica_row WHERE resource = ?", (resource,)
+                ).fetchone()[0]) - 1
+                row = {**payload, primary_key: temp_id}
+                self._upsert(resource, [row])
+                self._add_pending("post", resource, temp_id, payload, None)
+                return row
+
+            base = self.get(resource, row_id)
+            if method == "put":
+                row = {**(base or {}), **payload, primary_key: row_id}
+                self._upsert(resource, [row])
+                if row_id < 0:
+                    # Строка ещё не создана на сервере: правим её запись создания
+                    self._connection.execute(
+                        "UPDATE pending_write SET payload = ? WHERE method = 'post' AND resource = ? AND row_id = ?",
+                        (json.dumps({k: v for k, v in row.items() if k != primary_key}, ensure_ascii=False),
+                         resource, row_id),
+                    )
+                else:
+                    self._add_pending("put", resource, row_id, payload, base)
+                return row
+
+            self._connection.execute(
+                "DELETE FROM replica_row WHERE resource = ? AND row_id = ?", (resource, row_id)
+            )
+            if row_id < 0:
+                self._connection.execute(
+                    "DELETE FROM pending_write WHERE resource = ? AND row_id = ?", (resource, row_id)
+                )
+            else:
+                self._add_pending("delete", resource, row_id, None, base)
+            return True
+
+    def pending(self):
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT write_id, method, resource, row_id, payload, base FROM pending_write ORDER BY write_id"
+            )
+            return [
+                {"write_id": write_id, "method": method, "resource": resource, "row_id": row_id,
+                 "payload": json.loads(payload) if payload else None, "base": json.loads(base) if base else None}
+                for write_id, method, resource, row_id, payload, base in cursor
+            ]
+
+    def complete(self, write_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM pending_write WHERE write_id = ?", (write_id,))
+
+    def remap(self, resource, temp_id, real_id):
+        # Временный id созданной строки заменяется настоящим во всей очереди
+        primary_key = self.primary_keys[resource]
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM replica_row WHERE resource = ? AND row_id = ?", (resource, temp_id)
+            )
+            self._connection.execute(
+                "UPDATE pending_write SET row_id = ? WHERE resource = ? AND row_id = ?",
+                (real_id, resource, temp_id),
+            )
+            cursor = self._connection.execute(
+                "SELECT write_id, payload FROM pending_write WHERE payload IS NOT NULL"
+            )
+            for write_id, payload in cursor.fetchall():
+                data = json.loads(payload)
+                if data.get(primary_key) == temp_id:
+                    data[primary_key] = real_id
+                    self._connection.execute(
+                        "UPDATE pending_write SET payload = ? WHERE write_id = ?",
+                        (json.dumps(data, ensure_ascii=False), write_id),
+                    )
+
+    def _add_pending(self, method, resource, row_id, payload, base):
+        self._connection.execute(
+            "INSERT INTO pending_write (method, resource, row_id, payload, base) VALUES (?, ?, ?, ?, ?)",
+            (method, resource, row_id,
+             json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+             json.dumps(base, ensure_ascii=False) if base is not None else None),
+        )
+
+
+class ReplicaSync:
+    def __init__(self, replica, session, base_url, timeout=5, page_size=1000):
+        self.replica = replica
+        self.session = session
+        self.base_url = base_url
+        self.timeout = timeout
+        self.page_size = page_size
+        self._sync_lock = threading.Lock()
+
+    def write(self, method, path, payload=None):
+        # Запись на сервер; без связи — в очередь реплики. Пока очередь не
+        # отправлена, новые записи тоже идут в неё, чтобы не нарушить порядок.
+        parts = path.strip("/").split("/")
+        resource = parts[0]
+        # /clients/register/ — создание, а не запись с id
+        row_id = int(parts[1]) if len(parts) > 1 and parts[1].lstrip("-").isdigit() else None
+
+        # Пароли в очередь на диске не пишем: такие записи только онлайн
+        queueable = not (payload and "password" in payload)
+        if queueable and self.replica.has_pending():
+            return self.replica.enqueue(method, resource, row_id, payload)
+
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", json=payload,
+                                            timeout=self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if not queueable:
+                raise
+            return self.replica.enqueue(method, resource, row_id, payload)
+
+        response.raise_for_status()
+        if method == "delete":
+            self.replica.delete(resource, [row_id])
+            return True
+        row = response.json()
+        self.replica.upsert(resource, [row])
+        return row
+
+    def sync(self):
+        # Вызывается из фонового потока. Возвращает изменения для общего
+        # хранилища клиента: {"online", "reloaded", "changes", "conflicts"}
+        result = {"online": True, "reloaded": False, "changes": {}, "conflicts": []}
+        with self._sync_lock:
+            try:
+                self._replay(result)
+                if self.replica.ready:
+                    self._pull(result)
+                else:
+                    self._bootstrap(result)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                result["online"] = False
+            except requests.exceptions.RequestException as e:
+                print(f"Error syncing replica: {e}")
+                result["online"] = False
+        return result
+
+    def _get(self, path, params=None):
+        response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _bootstrap(self, result):
+        # Курсор берётся до загрузки: изменения во время загрузки придут повторно
+        latest = self._get("/changes/", {"limit": 0})["latest"]
+        for resource in self.replica.primary_keys:
+            self.replica.replace(resource, self._get(f"/{resource}/"))
+        self.replica.cursor = latest
+        result["reloaded"] = True
+
+    def _pull(self, result):
+        while True:
+            cursor = self.replica.cursor
+            data = self._get("/changes/", {"since": cursor, "limit": self.page_size})
+            if data["latest"] < cursor:
+                self._bootstrap(result)
+                return
+
+            for resource, change in data["changes"].items():
+                # Строки с неотправленными правками не перетираем
+                upserts = [row for row in change["upserts"]
+                           if not self.replica.has_pending(resource, row[self.replica.primary_keys[resource]])]
+                deletes = [i for i in change["deletes"] if not self.replica.has_pending(resource, i)]
+                self.replica.upsert(resource, upserts)
+                self.replica.delete(resource, deletes)
+                self._record(result, resource, upserts, deletes)
+
+            self.replica.cursor = data["next"]
+            if data["next"] >= data["latest"]:
+                return
+
+    def _replay(self, result):
+        # Очередь перечитывается после каждой записи: remap меняет id
+        # в следующих записях. Ошибка сети оставляет запись в очереди.
+        while True:
+            pending = self.replica.pending()
+            if not pending:
+                return
+            self._replay_one(pending[0], result)
+
+    def _replay_one(self, write, result):
+        method, resource, row_id = write["method"], write["resource"], write["row_id"]
+        primary_key = self.replica.primary_keys[resource]
+        path = f"/{resource}/" if method == "post" else f"/{resource}/{row_id}"
+
+        if method != "post" and write["base"] is not None:
+            server_rows = self._get(f"/{resource}/", {"ids": str(row_id)})
+            server_row = server_rows[0] if server_rows else None
+            if server_row is None and method == "delete":
+                self.replica.complete(write["write_id"])
+                return
+            derived = self.replica.derived_fields.get(resource, ())
+            if server_row is None or any(server_row.get(k) != v for k, v in write["base"].items()
+                                         if k not in derived):
+                self._reject(write, server_row, "строка изменена на сервере", result)
+                return
+
+        response = self.session.request(method, f"{self.base_url}{path}", json=write["payload"],
+                                        timeout=self.timeout)
+        # 401 — истёк вход, а не отказ в записи: правка остаётся в очереди до нового входа
+        if response.status_code >= 500 or response.status_code == 401:
+            response.raise_for_status()
+        if response.status_code >= 400:
+            server_rows = [] if method == "post" else self._get(f"/{resource}/", {"ids": str(row_id)})
+            self._reject(write, server_rows[0] if server_rows else None,
+                         f"сервер отклонил запись ({response.status_code})", result)
+            return
+
+        if method == "post":
+            row = response.json()
+            self.replica.remap(resource, row_id, row[primary_key])
+            self.replica.upsert(resource, [row])
+            self._record(result, resource, [row], [row_id])
+        elif method == "put":
+            row = response.json()
+            self.replica.upsert(resource, [row])
+            self._record(result, resource, [row], [])
+        self.replica.complete(write["write_id"])
+
+    def _reject(self, write, server_row, reason, result):
+        # Побеждает сервер: локальная правка откатывается к его версии
+        resource, row_id = write["resource"], write["row_id"]
+        self.replica.complete(write["write_id"])
+        if server_row is None:
+            self.replica.delete(resource, [row_id])
+            self._record(result, resource, [], [row_id])
+        else:
+            self.replica.upsert(resource, [server_row])
+            self._record(result, resource, [server_row], [])
+        result["conflicts"].append({**write, "reason": reason})
+
+        if write["method"] == "post":
+            # Новые строки, ссылающиеся на несозданную, тоже не отправятся
+            primary_key = self.replica.primary_keys[resource]
+            for other in self.replica.pending():
+                if other["method"] == "post" and (other["payload"] or {}).get(primary_key) == row_id:
+                    self._reject(other, None, "ссылается на отклонённую запись", result)
+
+    @staticmethod
+    def _record(result, resource, upserts, deletes):
+        change = result["changes"].setdefault(resource, {"upserts": [], "deletes": []})
+        change["upserts"].extend(upserts)
+        change["deletes"].extend(deletes)
@@ -1,20 +1,56 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
+import time as time_module
+IMPORT_STARTED = time_module.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field
 from typing import List, Optional
+import asyncio
+import base64
+import bisect
+import json
 import databases
 import sqlalchemy
-from datetime import date, time
-from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+from datetime import date, datetime, time, timedelta, timezone
+from enum import Enum
+import os
+import secrets
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from jose import JWTError, jwt
+from assignment import minutes, plan_day, rank_candidates
+from availability import OccupancyCache, cell_count, occupancy_mask, start_mask
+from compression import CompressionMiddleware
+from password_policy import load_context
+from room_planner import suggest
+from shared_state import create_shared_state
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используется стандартный json
+    orjson = None
+
+# Схема и стоимость хеширования — из файла политики (python main.py calibrate)
+pwd_context = load_context()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # Database setup
-DATABASE_URL = "sqlite:///./blackrooms.db"
+DATABASE_URL = os.environ.get("BLACKROOMS_DATABASE_URL", "sqlite:///./blackrooms.db")
 database = databases.Database(DATABASE_URL)
 metadata = sqlalchemy.MetaData()
 
+def transaction():
+    # database.transaction() в databases 0.5 открывает корневую транзакцию на
+    # новом соединении, если задача уже делала запросы, а database.* этой задачи
+    # идут через прежнее соединение — мимо транзакции. Транзакция на соединении
+    # задачи охватывает все её запросы
+    return database.connection().transaction()
+
+# Количество воркеров выставляет команда serve; общее состояние между ними
+WORKERS = int(os.environ.get("BLACKROOMS_WORKERS", "1"))
+shared_state = create_shared_state(os.environ.get("BLACKROOMS_SHARED_STATE", "local"))
+
 # Define all tables
 position = sqlalchemy.Table(
     "position",
@@ -76,6 +112,38 @@ schedule = sqlalchemy.Table(
     sqlalchemy.Column("date", sqlalchemy.Date),
     sqlalchemy.Column("start_time", sqlalchemy.Time),
     sqlalchemy.Column("end_time", sqlalchemy.Time),
+    # Начало и конец сеанса одним значением (см. schedule_span); сеанс, у
+    # которого end_time не позже start_time, заканчивается на следующий день
+    sqlalchemy.Column("starts_at", sqlalchemy.DateTime),
+    sqlalchemy.Column("ends_at", sqlalchemy.DateTime),
+)
+
+# Диапазонные выборки расписания (GET /schedules/?from=&to=&room_id=)
+schedule_room_date_index = sqlalchemy.Index(
+    "ix_schedule_room_date_start", schedule.c.room_id, schedule.c.date, schedule.c.start_time
+)
+
+# Пересечения по времени и выборки «с такого-то момента»: сеанс короче суток,
+# поэтому пересечение с [a, b) — диапазон starts_at в (a - 1 день, b) по индексу
+schedule_room_starts_index = sqlalchemy.Index(
+    "ix_schedule_room_starts", schedule.c.room_id, schedule.c.starts_at, schedule.c.ends_at
+)
+
+# Шаблоны повторяющегося расписания: квест в комнате по дням недели
+# (0 — понедельник) в заданное время, с date_from по date_to включительно.
+# Клиентам не синхронизируются: созданные по шаблону расписания попадают
+# в журнал изменений как обычные строки schedule.
+schedule_template = sqlalchemy.Table(
+    "schedule_template",
+    metadata,
+    sqlalchemy.Column("template_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("quest_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("quest.quest_id")),
+    sqlalchemy.Column("room_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("room.room_id")),
+    sqlalchemy.Column("weekdays", sqlalchemy.String(32)),
+    sqlalchemy.Column("start_times", sqlalchemy.String(255)),
+    sqlalchemy.Column("date_from", sqlalchemy.Date),
+    sqlalchemy.Column("date_to", sqlalchemy.Date),
+    info={"change_log": False},
 )
 
 booking = sqlalchemy.Table(
@@ -87,6 +155,88 @@ booking = sqlalchemy.Table(
     sqlalchemy.Column("employee_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("employee.employee_id")),
     sqlalchemy.Column("status", sqlalchemy.String(255)),
     sqlalchemy.Column("participants_count", sqlalchemy.Integer),
+    # День сеанса брони — копия date(schedule.starts_at), её ведут триггеры
+    # (см. booking_status_triggers), чтобы выборки по статусу и дню шли по индексу
+    sqlalchemy.Column("schedule_date", sqlalchemy.Date),
+    # Деньги брони ведут триггеры (см. booking_totals_triggers): цена квеста на
+    # момент брони, к оплате (квест и услуги), оплачено и остаток
+    sqlalchemy.Column("quest_price", sqlalchemy.Integer),
+    sqlalchemy.Column("total_due", sqlalchemy.Integer, nullable=False, server_default=sqlalchemy.text("0")),
+    sqlalchemy.Column("total_paid", sqlalchemy.Integer, nullable=False, server_default=sqlalchemy.text("0")),
+    sqlalchemy.Column("balance", sqlalchemy.Integer, nullable=False, server_default=sqlalchemy.text("0")),
+)
+
+class BookingStatus(str, Enum):
+    PENDING = "На рассмотрение"
+    CONFIRMED = "Подтвержден"
+    COMPLETED = "Завершен"
+    CANCELLED = "Отменен"
+    WAITLIST = "Лист ожидания"
+
+# Допустимые смены статуса; записать тот же статус можно всегда.
+# Завершённая и отменённая брони больше не меняют статус
+BOOKING_TRANSITIONS = {
+    BookingStatus.PENDING: (BookingStatus.CONFIRMED, BookingStatus.CANCELLED),
+    BookingStatus.CONFIRMED: (BookingStatus.COMPLETED, BookingStatus.CANCELLED),
+    BookingStatus.WAITLIST: (BookingStatus.PENDING, BookingStatus.CANCELLED),
+    BookingStatus.COMPLETED: (),
+    BookingStatus.CANCELLED: (),
+}
+# С этими статусами бронь можно создать; в лист ожидания её ставит сервер.
+# Клиент создаёт бронь только на рассмотрение
+INITIAL_STATUSES = (BookingStatus.PENDING, BookingStatus.CONFIRMED)
+CLIENT_INITIAL_STATUSES = (BookingStatus.PENDING,)
+# Подтверждает и завершает бронь только сотрудник
+STAFF_STATUSES = (BookingStatus.CONFIRMED, BookingStatus.COMPLETED)
+
+# Статусы, которые писали прежние версии клиента и начальные данные
+LEGACY_STATUSES = {
+    "Подтверждено": BookingStatus.CONFIRMED,
+    "Оплачено": BookingStatus.CONFIRMED,
+    "Забронировано": BookingStatus.PENDING,
+    "Завершено": BookingStatus.COMPLETED,
+    "Отменено": BookingStatus.CANCELLED,
+}
+
+CANCELLED_STATUS = BookingStatus.CANCELLED.value
+WAITLIST_STATUS = BookingStatus.WAITLIST.value
+# Статус брони, поднятой из листа ожидания: дальше её подтверждает администратор
+PROMOTED_STATUS = BookingStatus.PENDING.value
+# Брони, которые не занимают места и ничего не должны
+INACTIVE_STATUSES = (CANCELLED_STATUS, WAITLIST_STATUS)
+
+# Проверка вместимости слота суммирует участников броней одного расписания
+booking_schedule_index = sqlalchemy.Index(
+    "ix_booking_schedule_status", booking.c.schedule_id, booking.c.status, booking.c.participants_count
+)
+
+# История бронирований клиента: его брони находятся по индексу, без обхода всей таблицы
+booking_client_index = sqlalchemy.Index("ix_booking_client", booking.c.client_id, booking.c.schedule_id)
+
+# Сеансы мастера: проверка пересечений идёт по его броням, а не по всей таблице
+booking_employee_index = sqlalchemy.Index(
+    "ix_booking_employee_schedule", booking.c.employee_id, booking.c.schedule_id, booking.c.status
+)
+
+# Неоплаченные брони: в частичный индекс попадают только строки с долгом,
+# поэтому выборка не зависит от размера истории
+booking_outstanding_index = sqlalchemy.Index(
+    "ix_booking_outstanding", booking.c.booking_id, booking.c.balance, sqlite_where=booking.c.balance > 0
+)
+
+# Брони в статусе за период (GET /bookings/status-counts?from=&to=)
+booking_status_date_index = sqlalchemy.Index(
+    "ix_booking_status_date", booking.c.status, booking.c.schedule_date
+)
+
+# Число броней в каждом статусе. Строки ведут триггеры на booking, так что
+# сводка для администратора не обходит брони
+booking_status_count = sqlalchemy.Table(
+    "booking_status_count",
+    metadata,
+    sqlalchemy.Column("status", sqlalchemy.String(255), primary_key=True),
+    sqlalchemy.Column("bookings", sqlalchemy.Integer, nullable=False),
+    info={"change_log": False},
 )
 
 payment = sqlalchemy.Table(
@@ -99,6 +249,9 @@ payment = sqlalchemy.Table(
     sqlalchemy.Column("payment_date", sqlalchemy.Date),
 )
 
+# Сумма оплат брони считается по индексу, не читая строки таблицы
+payment_booking_index = sqlalchemy.Index("ix_payment_booking_amount", payment.c.booking_id, payment.c.amount)
+
 review = sqlalchemy.Table(
     "review",
     metadata,
@@ -109,6 +262,7 @@ review = sqlalchemy.Table(
     sqlalchemy.Column("rating", sqlalchemy.Integer),
 )
 
+# Каталог услуг; к броням услуги привязываются через booking_service
 service = sqlalchemy.Table(
     "service",
     metadata,
@@ -116,27 +270,290 @@ service = sqlalchemy.Table(
     sqlalchemy.Column("title", sqlalchemy.String(255)),
     sqlalchemy.Column("description", sqlalchemy.Text),
     sqlalchemy.Column("price", sqlalchemy.Integer),
-    sqlalchemy.Column("booking_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("booking.booking_id")),
 )
 
-engine = sqlalchemy.create_engine(DATABASE_URL)
-metadata.create_all(engine)
+# Услуги брони: количество и цена за единицу на момент добавления, так что
+# смена цены в каталоге не меняет уже оформленные брони. Уникальный ключ
+# (booking_id, service_id) — индекс для услуг брони, второй индекс — для броней услуги
+booking_service = sqlalchemy.Table(
+    "booking_service",
+    metadata,
+    sqlalchemy.Column("booking_service_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("booking_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("booking.booking_id"), nullable=False),
+    sqlalchemy.Column("service_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("service.service_id"), nullable=False),
+    sqlalchemy.Column("quantity", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("price", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.UniqueConstraint("booking_id", "service_id"),
+)
+
+booking_service_service_index = sqlalchemy.Index(
+    "ix_booking_service_service", booking_service.c.service_id, booking_service.c.booking_id
+)
+
+# Журнал изменений для синхронизации клиентов (GET /changes/). Его пишут
+# триггеры SQLite, так что в него попадает любая запись в таблицы. На строку
+# хранится одна запись с последней операцией: повторные правки журнал не растят.
+change_log = sqlalchemy.Table(
+    "change_log",
+    metadata,
+    sqlalchemy.Column("change_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("table_name", sqlalchemy.String(64), nullable=False),
+    sqlalchemy.Column("row_id", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("operation", sqlalchemy.String(16), nullable=False),
+    sqlalchemy.UniqueConstraint("table_name", "row_id"),
+    sqlite_autoincrement=True,
+)
+
+def change_log_triggers(tables=None):
+    statements = []
+    for table in tables or metadata.sorted_tables:
+        if table is change_log or not table.info.get("change_log", True):
+            continue
+        primary_key = list(table.primary_key.columns)[0].name
+        for event, row, operation in (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"),
+                                      ("DELETE", "OLD", "delete")):
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table.name}_{event.lower()}_change_log"
+                f" AFTER {event} ON {table.name} BEGIN"
+                f" INSERT OR REPLACE INTO change_log (table_name, row_id, operation)"
+                f" VALUES ('{table.name}', {row}.{primary_key}, '{operation}'); END"
+            )
+    return statements
+
+CHANGE_LOG_TRIGGERS = change_log_triggers()
+
+# Суммы брони пересчитываются триггерами в том же операторе, что и запись
+# брони, услуги или оплаты, — по индексам одной брони, без обхода таблиц.
+# К оплате — цена квеста, зафиксированная при создании или переносе брони,
+# плюс услуги по ценам из booking_service; отменённые брони и лист ожидания
+# ничего не должны
+QUEST_PRICE_OF_SLOT = ("(SELECT quest.price FROM schedule JOIN quest ON quest.quest_id = schedule.quest_id"
+                       " WHERE schedule.schedule_id = {schedule_ref})")
+
+def booking_totals_update(booking_ref, quest_price="quest_price"):
+    inactive = ", ".join("'" + status.replace("'", "''") + "'" for status in INACTIVE_STATUSES)
+    due = (f"(CASE WHEN status IN ({inactive}) THEN 0 ELSE COALESCE({quest_price}, 0)"
+           f" + (SELECT COALESCE(SUM(quantity * price), 0) FROM booking_service WHERE booking_id = {booking_ref}) END)")
+    paid = f"(SELECT COALESCE(SUM(amount), 0) FROM payment WHERE booking_id = {booking_ref})"
+    return (f"UPDATE booking SET quest_price = {quest_price}, total_due = {due}, total_paid = {paid},"
+            f" balance = {due} - {paid} WHERE booking_id = {booking_ref};")
+
+def booking_totals_triggers():
+    captured = QUEST_PRICE_OF_SLOT.format(schedule_ref="NEW.schedule_id")
+    triggers = [
+        ("booking_totals_insert", "AFTER INSERT ON booking", booking_totals_update("NEW.booking_id", captured)),
+        ("booking_totals_move", "AFTER UPDATE OF schedule_id ON booking WHEN NEW.schedule_id IS NOT OLD.schedule_id",
+         booking_totals_update("NEW.booking_id", captured)),
+        ("booking_totals_status", "AFTER UPDATE OF status ON booking WHEN NEW.status IS NOT OLD.status",
+         booking_totals_update("NEW.booking_id")),
+    ]
+    for table in ("payment", "booking_service"):
+        triggers += [
+            (f"{table}_totals_insert", f"AFTER INSERT ON {table}", booking_totals_update("NEW.booking_id")),
+            (f"{table}_totals_update", f"AFTER UPDATE ON {table}", booking_totals_update("NEW.booking_id")),
+            # Строку перенесли на другую бронь — пересчитать и прежнюю
+            (f"{table}_totals_move", f"AFTER UPDATE OF booking_id ON {table} WHEN NEW.booking_id IS NOT OLD.booking_id",
+             booking_totals_update("OLD.booking_id")),
+            (f"{table}_totals_delete", f"AFTER DELETE ON {table}", booking_totals_update("OLD.booking_id")),
+        ]
+    return [f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END" for name, event, body in triggers]
+
+BOOKING_TOTALS_TRIGGERS = booking_totals_triggers()
+
+# Счётчики статусов и день сеанса брони. Строка счётчика появляется при первой
+# брони в статусе; INSERT ... WHERE NOT EXISTS, а не OR IGNORE, потому что
+# OR REPLACE внешнего оператора переопределил бы OR IGNORE и обнулил бы счётчик
+def booking_status_count_change(row, delta):
+    statement = f"UPDATE booking_status_count SET bookings = bookings {delta} WHERE status = {row}.status;"
+    if delta.startswith("+"):
+        statement = (f"INSERT INTO booking_status_count (status, bookings) SELECT {row}.status, 0"
+                     f" WHERE {row}.status IS NOT NULL AND NOT EXISTS"
+                     f" (SELECT 1 FROM booking_status_count WHERE status = {row}.status); " + statement)
+    return statement
+
+def booking_status_triggers():
+    slot_date = ("UPDATE booking SET schedule_date = (SELECT date(starts_at) FROM schedule"
+                 " WHERE schedule_id = NEW.schedule_id) WHERE booking_id = NEW.booking_id;")
+    triggers = [
+        ("booking_status_insert", "AFTER INSERT ON booking", booking_status_count_change("NEW", "+ 1")),
+        ("booking_status_update", "AFTER UPDATE OF status ON booking WHEN NEW.status IS NOT OLD.status",
+         booking_status_count_change("OLD", "- 1") + " " + booking_status_count_change("NEW", "+ 1")),
+        ("booking_status_delete", "AFTER DELETE ON booking", booking_status_count_change("OLD", "- 1")),
+        ("booking_date_insert", "AFTER INSERT ON booking", slot_date),
+        ("booking_date_move", "AFTER UPDATE OF schedule_id ON booking WHEN NEW.schedule_id IS NOT OLD.schedule_id",
+         slot_date),
+        # Сеанс перенесли на другой день — брони переезжают вместе с ним
+        ("schedule_booking_date", "AFTER UPDATE OF starts_at ON schedule"
+         " WHEN date(NEW.starts_at) IS NOT date(OLD.starts_at)",
+         "UPDATE booking SET schedule_date = date(NEW.starts_at) WHERE schedule_id = NEW.schedule_id;"),
+    ]
+    return [f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END" for name, event, body in triggers]
+
+BOOKING_STATUS_TRIGGERS = booking_status_triggers()
+
+# Версия схемы хранится в PRAGMA user_version самой базы. Миграции:
+# номер версии -> список DDL/SQL, который переводит базу из предыдущей версии.
+SCHEMA_VERSION = 11
+MIGRATIONS = {
+    # Таблицы, появившиеся позже, получают триггеры в своих миграциях
+    2: [CreateTable(change_log, if_not_exists=True),
+        *change_log_triggers([table for table in metadata.sorted_tables if table is not booking_service])],
+    3: [CreateIndex(schedule_room_date_index, if_not_exists=True)],
+    4: [CreateTable(schedule_template, if_not_exists=True)],
+    5: [CreateIndex(booking_schedule_index, if_not_exists=True)],
+    6: [CreateIndex(booking_client_index, if_not_exists=True),
+        CreateIndex(payment_booking_index, if_not_exists=True)],
+    7: [CreateIndex(booking_employee_index, if_not_exists=True)],
+    8: ["ALTER TABLE schedule ADD COLUMN starts_at DATETIME",
+        "ALTER TABLE schedule ADD COLUMN ends_at DATETIME",
+        # Тот же формат, в котором SQLAlchemy хранит DateTime: 'YYYY-MM-DD HH:MM:SS.ffffff'
+        "UPDATE schedule SET starts_at = date || ' ' || start_time,"
+        " ends_at = CASE WHEN end_time <= start_time THEN date(date, '+1 day') ELSE date END || ' ' || end_time",
+        CreateIndex(schedule_room_starts_index, if_not_exists=True)],
+    # service.booking_id входит во внешний ключ, и SQLite не удаляет такой
+    # столбец: таблица пересоздаётся, а привязки переносятся в booking_service.
+    # Переименование идёт первым, пока на service никто не ссылается
+    9: ["ALTER TABLE service RENAME TO service_old",
+        CreateTable(service),
+        "INSERT INTO service (service_id, title, description, price)"
+        " SELECT service_id, title, description, price FROM service_old",
+        CreateTable(booking_service, if_not_exists=True),
+        CreateIndex(booking_service_service_index, if_not_exists=True),
+        "INSERT INTO booking_service (booking_id, service_id, quantity, price)"
+        " SELECT service_old.booking_id, service_old.service_id, 1, service_old.price FROM service_old"
+        " JOIN booking ON booking.booking_id = service_old.booking_id",
+        "DROP TABLE service_old",
+        *change_log_triggers([service, booking_service])],
+    10: ["ALTER TABLE booking ADD COLUMN quest_price INTEGER",
+         "ALTER TABLE booking ADD COLUMN total_due INTEGER NOT NULL DEFAULT 0",
+         "ALTER TABLE booking ADD COLUMN total_paid INTEGER NOT NULL DEFAULT 0",
+         "ALTER TABLE booking ADD COLUMN balance INTEGER NOT NULL DEFAULT 0",
+         # Для старых броней цена квеста — текущая
+         booking_totals_update("booking.booking_id", QUEST_PRICE_OF_SLOT.format(schedule_ref="booking.schedule_id")),
+         CreateIndex(booking_outstanding_index, if_not_exists=True),
+         *BOOKING_TOTALS_TRIGGERS],
+    # Статусы приводятся к BookingStatus до того, как появятся счётчики;
+    # неизвестные становятся «На рассмотрение». Суммы пересчитают триггеры 10
+    11: ["UPDATE booking SET status = CASE status "
+         + " ".join(f"WHEN '{old}' THEN '{new.value}'" for old, new in LEGACY_STATUSES.items())
+         + f" ELSE '{BookingStatus.PENDING.value}' END WHERE status IS NULL OR status NOT IN ("
+         + ", ".join(f"'{status.value}'" for status in BookingStatus) + ")",
+         "ALTER TABLE booking ADD COLUMN schedule_date DATE",
+         "UPDATE booking SET schedule_date = (SELECT date(starts_at) FROM schedule"
+         " WHERE schedule.schedule_id = booking.schedule_id)",
+         CreateIndex(booking_status_date_index, if_not_exists=True),
+         CreateTable(booking_status_count, if_not_exists=True),
+         "INSERT INTO booking_status_count (status, bookings) SELECT status, COUNT(*) FROM booking GROUP BY status",
+         *BOOKING_STATUS_TRIGGERS],
+}
+
+async def execute_ddl(statement):
+    # databases не компилирует CREATE INDEX сам, поэтому DDL передаём готовым SQL
+    if not isinstance(statement, str):
+        statement = str(statement.compile(dialect=sqlite.dialect()))
+    await database.execute(statement)
+
+async def ensure_schema():
+    version = await database.fetch_val("PRAGMA user_version")
+    if version >= SCHEMA_VERSION:
+        return False
+
+    async with transaction():
+        if version == 0:
+            has_tables = await database.fetch_val(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'position'"
+            )
+            if not has_tables:
+                # Пустая база: сразу создаём актуальную схему
+                for table in metadata.sorted_tables:
+                    await execute_ddl(CreateTable(table, if_not_exists=True))
+                    for index in table.indexes:
+                        await execute_ddl(CreateIndex(index, if_not_exists=True))
+                for statement in CHANGE_LOG_TRIGGERS + BOOKING_TOTALS_TRIGGERS + BOOKING_STATUS_TRIGGERS:
+                    await execute_ddl(statement)
+                version = SCHEMA_VERSION
+            else:
+                # База создана до появления версий схемы
+                version = 1
+
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            for statement in MIGRATIONS.get(target, []):
+                await execute_ddl(statement)
+
+        await database.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return True
 
 app = FastAPI()
 
+if os.environ.get("BLACKROOMS_COMPRESSION", "1") == "1":
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get("BLACKROOMS_COMPRESSION_MIN_SIZE", "1024")),
+        gzip_level=int(os.environ.get("BLACKROOMS_GZIP_LEVEL", "6")),
+        brotli_quality=int(os.environ.get("BLACKROOMS_BROTLI_QUALITY", "5")),
+    )
+app.state.startup_timings = {}
+
 @app.on_event("startup")
 async def startup():
+    timings = app.state.startup_timings
+    timings["import_ms"] = round((time_module.perf_counter() - IMPORT_STARTED) * 1000, 2)
+
+    started = time_module.perf_counter()
     await database.connect()
-    await insert_initial_data()
+    timings["connect_ms"] = round((time_module.perf_counter() - started) * 1000, 2)
+
+    started = time_module.perf_counter()
+    timings["schema_migrated"] = await ensure_schema()
+    timings["schema_ms"] = round((time_module.perf_counter() - started) * 1000, 2)
+
+    started = time_module.perf_counter()
+    if WORKERS > 1:
+        # Несколько процессов пишут в один файл: WAL не блокирует читателей
+        await database.execute("PRAGMA journal_mode=WAL")
+    await shared_state.start()
+    timings["shared_state_ms"] = round((time_module.perf_counter() - started) * 1000, 2)
+
+    print("Startup: " + ", ".join(f"{name}={value}" for name, value in timings.items()))
 
 @app.on_event("shutdown")
 async def shutdown():
+    await shared_state.stop()
     await database.disconnect()
 
+@app.get("/status/startup")
+async def read_startup_timings():
+    return app.state.startup_timings
+
+async def hash_passwords(passwords):
+    # bcrypt отпускает GIL, поэтому хеши считаются параллельно в пуле потоков
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*[loop.run_in_executor(None, pwd_context.hash, p) for p in passwords])
+
+async def verify_password(table, primary_key, row, password):
+    # Проверка в пуле потоков, чтобы хеш не блокировал цикл событий. Хеш со
+    # старой схемой или стоимостью после успешной проверки пересчитывается
+    loop = asyncio.get_running_loop()
+    try:
+        valid, new_hash = await loop.run_in_executor(None, pwd_context.verify_and_update, password, row["password"])
+    except ValueError as e:
+        # Схема хеша не входит в текущую политику (например, argon2 без argon2-cffi)
+        print(f"Cannot verify password hash of {table.name} #{row[primary_key.name]}: {e}")
+        return False
+    if valid and new_hash is not None:
+        await database.execute(
+            table.update().where(primary_key == row[primary_key.name]).values(password=new_hash))
+    return valid
+
 async def insert_initial_data():
     # Проверяем, есть ли уже данные в таблицах
-    positions = await database.fetch_all(position.select())
-    if not positions:
+    has_positions = await database.fetch_val("SELECT COUNT(*) FROM position")
+    if not has_positions:
+        (admin_hash, master1_hash, master2_hash,
+         client1_hash, client2_hash, client3_hash) = await hash_passwords(
+            ["admin123", "master123", "master456", "client123", "client456", "client789"]
+        )
+
         # Добавляем начальные данные
         await database.execute_many(
             position.insert(),
@@ -152,11 +569,11 @@ async def insert_initial_data():
             employee.insert(),
             [
                 {"employee_id": 1, "full_name": "Иванов Иван Иванович", "position_id": 1,
-                 "login": "admin", "password": pwd_context.hash("admin123")},
+                 "login": "admin", "password": admin_hash},
                 {"employee_id": 2, "full_name": "Петров Петр Петрович", "position_id": 2,
-                 "login": "master1", "password": pwd_context.hash("master123")},
+                 "login": "master1", "password": master1_hash},
                 {"employee_id": 3, "full_name": "Сидорова Анна Михайловна", "position_id": 2,
-                 "login": "master2", "password": pwd_context.hash("master456")},
+                 "login": "master2", "password": master2_hash},
             ]
         )
 
@@ -166,13 +583,13 @@ async def insert_initial_data():
             [
                 {"client_id": 1, "full_name": "Смирнов Алексей Владимирович", "phone": "+79161234567",
                  "email": "smirnov@mail.ru", "birth_date": date(1990, 5, 15),
-                 "login": "smirnov", "password": pwd_context.hash("client123")},
+                 "login": "smirnov", "password": client1_hash},
                 {"client_id": 2, "full_name": "Кузнецова Елена Сергеевна", "phone": "+79269876543",
                  "email": "kuznetsova@gmail.com", "birth_date": date(1985, 8, 22),
-                 "login": "kuznetsova", "password": pwd_context.hash("client456")},
+                 "login": "kuznetsova", "password": client2_hash},
                 {"client_id": 3, "full_name": "Попов Дмитрий Александрович", "phone": "+79031112233",
                  "email": "popov@yandex.ru", "birth_date": date(1995, 3, 10),
-                 "login": "popov", "password": pwd_context.hash("client789")},
+                 "login": "popov", "password": client3_hash},
             ]
         )
 
@@ -196,19 +613,19 @@ async def insert_initial_data():
 
         await database.execute_many(
             schedule.insert(),
-            [
+            [schedule_values(row) for row in [
                 {"schedule_id": 1, "quest_id": 1, "room_id": 1, "date": date(2023, 12, 15), "start_time": time(18, 0), "end_time": time(19, 0)},
                 {"schedule_id": 2, "quest_id": 2, "room_id": 2, "date": date(2023, 12, 15), "start_time": time(19, 30), "end_time": time(20, 45)},
                 {"schedule_id": 3, "quest_id": 3, "room_id": 1, "date": date(2023, 12, 16), "start_time": time(17, 0), "end_time": time(17, 45)},
-            ]
+            ]]
         )
 
         await database.execute_many(
             booking.insert(),
             [
-                {"booking_id": 1, "client_id": 1, "schedule_id": 1, "employee_id": 2, "status": "Подтверждено", "participants_count": 4},
-                {"booking_id": 2, "client_id": 2, "schedule_id": 2, "employee_id": 3, "status": "Оплачено", "participants_count": 5},
-                {"booking_id": 3, "client_id": 3, "schedule_id": 3, "employee_id": 2, "status": "Забронировано", "participants_count": 3},
+                {"booking_id": 1, "client_id": 1, "schedule_id": 1, "employee_id": 2, "status": "Подтвержден", "participants_count": 4},
+                {"booking_id": 2, "client_id": 2, "schedule_id": 2, "employee_id": 3, "status": "Подтвержден", "participants_count": 5},
+                {"booking_id": 3, "client_id": 3, "schedule_id": 3, "employee_id": 2, "status": "На рассмотрение", "participants_count": 3},
             ]
         )
 
@@ -233,9 +650,18 @@ async def insert_initial_data():
         await database.execute_many(
             service.insert(),
             [
-                {"service_id": 1, "title": "Фотосессия", "description": "Профессиональные фото с квеста", "price": 500, "booking_id": 1},
-                {"service_id": 2, "title": "Видеосъемка", "description": "Запись прохождения квеста", "price": 800, "booking_id": 2},
-                {"service_id": 3, "title": "Дополнительный актер", "description": "Актер для усиления погружения", "price": 1000, "booking_id": 3},
+                {"service_id": 1, "title": "Фотосессия", "description": "Профессиональные фото с квеста", "price": 500},
+                {"service_id": 2, "title": "Видеосъемка", "description": "Запись прохождения квеста", "price": 800},
+                {"service_id": 3, "title": "Дополнительный актер", "description": "Актер для усиления погружения", "price": 1000},
+            ]
+        )
+
+        await database.execute_many(
+            booking_service.insert(),
+            [
+                {"booking_service_id": 1, "booking_id": 1, "service_id": 1, "quantity": 1, "price": 500},
+                {"booking_service_id": 2, "booking_id": 2, "service_id": 2, "quantity": 1, "price": 800},
+                {"booking_service_id": 3, "booking_id": 3, "service_id": 3, "quantity": 1, "price": 1000},
             ]
         )
 
@@ -318,6 +744,18 @@ class Room(RoomBase):
     class Config:
         from_attributes = True
 
+class RoomSuggestion(BaseModel):
+    room_id: int
+    room_title: str
+    capacity: int
+    # Существующий сеанс того же квеста, к которому можно присоединиться
+    schedule_id: Optional[int]
+    start_time: time
+    end_time: time
+    shift_minutes: int
+    wasted_seats: int
+    dead_minutes: int
+
 class ScheduleBase(BaseModel):
     quest_id: int
     room_id: int
@@ -330,26 +768,97 @@ class ScheduleCreate(ScheduleBase):
 
 class Schedule(ScheduleBase):
     schedule_id: int
+    starts_at: Optional[datetime]
+    ends_at: Optional[datetime]
 
     class Config:
         from_attributes = True
 
+class ScheduleTemplateBase(BaseModel):
+    quest_id: int
+    room_id: int
+    weekdays: List[int]
+    start_times: List[time]
+    date_from: date
+    date_to: date
+
+class ScheduleTemplateCreate(ScheduleTemplateBase):
+    pass
+
+class ScheduleTemplate(ScheduleTemplateBase):
+    template_id: int
+
+class ScheduleTemplateResult(ScheduleTemplate):
+    created: int
+    skipped: int
+
 class BookingBase(BaseModel):
     client_id: int
     schedule_id: int
-    employee_id: int
-    status: str
+    # Без мастера сервер назначит свободного сам
+    employee_id: Optional[int] = None
+    status: BookingStatus
     participants_count: int
 
+    class Config:
+        # В базу и в ответы статус идёт строкой
+        use_enum_values = True
+
 class BookingCreate(BookingBase):
     pass
 
 class Booking(BookingBase):
     booking_id: int
+    schedule_date: Optional[date] = None
+    # Суммы ведёт база: цена квеста на момент брони, к оплате, оплачено, остаток
+    quest_price: Optional[int] = None
+    total_due: int = 0
+    total_paid: int = 0
+    balance: int = 0
 
     class Config:
         from_attributes = True
 
+class ClientBooking(BaseModel):
+    booking_id: int
+    status: str
+    participants_count: int
+    schedule_id: Optional[int]
+    date: Optional[date]
+    start_time: Optional[time]
+    end_time: Optional[time]
+    quest_id: Optional[int]
+    quest_title: Optional[str]
+    price: Optional[int]
+    room_id: Optional[int]
+    room_title: Optional[str]
+    total_due: int
+    paid: int
+    balance: int
+
+class SessionBookingCreate(BaseModel):
+    # Бронь на новый сеанс: сервер создаёт сеанс длиной в квест и бронь на него
+    client_id: int
+    quest_id: int
+    room_id: int
+    date: date
+    start_time: time
+    participants_count: int
+    status: BookingStatus = BookingStatus.PENDING
+
+    class Config:
+        use_enum_values = True
+
+class BookingStatusCount(BaseModel):
+    status: BookingStatus
+    bookings: int
+
+class ClientBookingPage(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    items: List[ClientBooking]
+
 class PaymentBase(BaseModel):
     booking_id: int
     payment_method: str
@@ -384,7 +893,6 @@ class ServiceBase(BaseModel):
     title: str
     description: str
     price: int
-    booking_id: int
 
 class ServiceCreate(ServiceBase):
     pass
@@ -395,8 +903,267 @@ class Service(ServiceBase):
     class Config:
         from_attributes = True
 
+class BookingService(BaseModel):
+    booking_service_id: int
+    booking_id: int
+    service_id: int
+    quantity: int
+    # Цена за единицу на момент добавления к брони
+    price: int
+
+class BookingServiceItem(BaseModel):
+    service_id: int
+    quantity: int = Field(1, ge=1)
+
+class BookingServiceChanges(BaseModel):
+    # Добавить или поменять количество; уже добавленная услуга сохраняет прежнюю цену
+    attach: List[BookingServiceItem] = []
+    # service_id услуг, которые нужно убрать из брони
+    detach: List[int] = []
+
+# Быстрая сериализация списков: строки из базы уже проверены схемой таблицы,
+# поэтому при BLACKROOMS_FAST_JSON=1 они сразу кодируются в JSON без
+# повторной валидации pydantic и jsonable_encoder. Схема ответа в OpenAPI
+# остаётся прежней: в ответ попадают ровно поля response_model.
+FAST_JSON = os.environ.get("BLACKROOMS_FAST_JSON", "0") == "1"
+
+def _json_default(value):
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def rows_to_json(rows, fields):
+    items = [{field: row[field] for field in fields} for row in rows]
+    if orjson is not None:
+        return orjson.dumps(items)
+    return json.dumps(items, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+def list_response(model, rows, fields=None):
+    # Урезанный набор полей не пройдёт проверку полной response_model,
+    # поэтому такие ответы всегда идут быстрым путём
+    if fields is None and not FAST_JSON:
+        return rows
+    return Response(rows_to_json(rows, fields or list(model.__fields__)), media_type="application/json")
+
+FIELDS_DESCRIPTION = "Список полей через запятую, например fields=booking_id,status"
+
+def parse_fields(model, fields):
+    if not fields:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in model.__fields__]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown) or fields}")
+    return names
+
+def select_fields(table, model, fields):
+    # Даже без fields читаем только поля модели ответа (без паролей и т.п.)
+    return sqlalchemy.select([table.c[name] for name in fields or model.__fields__])
+
+IDS_DESCRIPTION = "Идентификаторы через запятую, например ids=1,2,3"
+# Не больше параметров в одном IN (...), чем разрешает SQLite
+IDS_CHUNK_SIZE = 500
+
+def parse_ids(ids):
+    if ids is None:
+        return None
+    try:
+        return list(dict.fromkeys(int(value) for value in ids.split(",") if value.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+
+async def fetch_rows(table, model, fields=None, ids=None, where=None, order_by=()):
+    query = select_fields(table, model, fields).order_by(*order_by)
+    if where is not None:
+        query = query.where(where)
+    if ids is None:
+        return await database.fetch_all(query)
+
+    primary_key = list(table.primary_key.columns)[0]
+    rows = []
+    for start in range(0, len(ids), IDS_CHUNK_SIZE):
+        chunk = ids[start:start + IDS_CHUNK_SIZE]
+        rows.extend(await database.fetch_all(query.where(primary_key.in_(chunk))))
+    return rows
+
+# Аутентификация: POST /token проверяет пароль (bcrypt) один раз и выдаёт
+# подписанный короткоживущий access-токен и долгоживущий refresh-токен.
+# Дальше запросы проверяются только по подписи и сроку токена — без базы и bcrypt.
+# Все процессы сервера должны подписывать одним ключом: без
+# BLACKROOMS_SECRET_KEY ключ случайный, и токены не переживут перезапуск.
+SECRET_KEY = os.environ.get("BLACKROOMS_SECRET_KEY") or secrets.token_urlsafe(32)
+TOKEN_ALGORITHM = "HS256"
+ACCESS_TOKEN_MINUTES = int(os.environ.get("BLACKROOMS_ACCESS_TOKEN_MINUTES", "15"))
+REFRESH_TOKEN_DAYS = int(os.environ.get("BLACKROOMS_REFRESH_TOKEN_DAYS", "7"))
+# position.access_level, начиная с которого сотрудник управляет персоналом
+ADMIN_ACCESS_LEVEL = 3
+TOKEN_ROLES = ("client", "employee")
+
+class TokenUser(BaseModel):
+    role: str
+    user_id: int
+    access_level: int
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
+def credentials_error(detail="Недействительный токен"):
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+def create_token(subject, token_type, lifetime, **claims):
+    expires = datetime.now(timezone.utc) + lifetime
+    return jwt.encode({"sub": subject, "type": token_type, "exp": expires, **claims},
+                      SECRET_KEY, algorithm=TOKEN_ALGORITHM)
+
+def token_response(role, user_id, access_level):
+    subject = f"{role}:{user_id}"
+    return {
+        "access_token": create_token(subject, "access", timedelta(minutes=ACCESS_TOKEN_MINUTES),
+                                     level=access_level),
+        "refresh_token": create_token(subject, "refresh", timedelta(days=REFRESH_TOKEN_DAYS)),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_MINUTES * 60,
+        "role": role,
+        "user_id": user_id,
+        "access_level": access_level,
+    }
+
+def decode_token(token, token_type):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[TOKEN_ALGORITHM])
+        role, user_id = payload["sub"].split(":")
+        user_id = int(user_id)
+    except (JWTError, KeyError, ValueError):
+        raise credentials_error()
+    if payload.get("type") != token_type or role not in TOKEN_ROLES:
+        raise credentials_error()
+    return role, user_id, payload.get("level", 0)
+
+async def current_user(token: str = Depends(oauth2_scheme)):
+    role, user_id, access_level = decode_token(token, "access")
+    return TokenUser(role=role, user_id=user_id, access_level=access_level)
+
+def require_staff(access_level=1):
+    async def dependency(user: TokenUser = Depends(current_user)):
+        if user.role != "employee" or user.access_level < access_level:
+            raise HTTPException(status_code=403, detail="Недостаточно прав")
+        return user
+    return dependency
+
+staff_user = require_staff()
+admin_user = require_staff(ADMIN_ACCESS_LEVEL)
+
+def check_client_access(user, client_id):
+    # Клиент меняет только свои данные, сотрудники — любые
+    if user.role == "client" and user.user_id != client_id:
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+async def employee_access_level(employee_id):
+    return await database.fetch_val(
+        sqlalchemy.select([position.c.access_level])
+        .select_from(employee.join(position, position.c.position_id == employee.c.position_id))
+        .where(employee.c.employee_id == employee_id)
+    ) or 0
+
+async def authenticate(login, password, role=None):
+    if role in (None, "client"):
+        row = await database.fetch_one(client.select().where(client.c.login == login))
+        if row and await verify_password(client, client.c.client_id, row, password):
+            return "client", row["client_id"], 0
+    if role in (None, "employee"):
+        for row in await database.fetch_all(employee.select().where(employee.c.login == login)):
+            if await verify_password(employee, employee.c.employee_id, row, password):
+                return "employee", row["employee_id"], await employee_access_level(row["employee_id"])
+    raise credentials_error("Неверный логин или пароль")
+
+@app.post("/token")
+async def login_for_token(form: OAuth2PasswordRequestForm = Depends()):
+    # scope "client" или "employee" выбирает, где искать логин; без него — сначала клиенты
+    role = form.scopes[0] if form.scopes else None
+    if role is not None and role not in TOKEN_ROLES:
+        raise HTTPException(status_code=400, detail=f"Unknown scope: {role}")
+    return token_response(*await authenticate(form.username, form.password, role))
+
+@app.post("/token/refresh")
+async def refresh_access_token(data: RefreshRequest):
+    # Роль и уровень доступа перечитываются: уволенный сотрудник или удалённый
+    # клиент новый токен не получит. bcrypt здесь не нужен
+    role, user_id, _ = decode_token(data.refresh_token, "refresh")
+    if role == "client":
+        exists = await database.fetch_val(sqlalchemy.select([client.c.client_id]).where(client.c.client_id == user_id))
+        access_level = 0
+    else:
+        exists = await database.fetch_val(
+            sqlalchemy.select([employee.c.employee_id]).where(employee.c.employee_id == user_id))
+        access_level = await employee_access_level(user_id)
+    if exists is None:
+        raise credentials_error()
+    return token_response(role, user_id, access_level)
+
+@app.post("/auth/change-password")
+async def change_own_password(data: PasswordChange, user: TokenUser = Depends(current_user)):
+    table, primary_key = (client, client.c.client_id) if user.role == "client" else (employee, employee.c.employee_id)
+    row = await database.fetch_one(table.select().where(primary_key == user.user_id))
+    if not row or not await verify_password(table, primary_key, row, data.current_password):
+        raise HTTPException(status_code=401, detail="Неверный текущий пароль")
+    await database.execute(
+        table.update().where(primary_key == user.user_id).values(password=pwd_context.hash(data.new_password)))
+    return {"message": "Пароль успешно изменен"}
+
+# Синхронизация клиентов: изменения после курсора since. Для upsert
+# отдаются строки целиком (поля response_model), для delete — только id.
+CHANGE_RESOURCES = {
+    "position": ("positions", position, Position),
+    "employee": ("employees", employee, Employee),
+    "client": ("clients", client, Client),
+    "quest": ("quests", quest, Quest),
+    "room": ("rooms", room, Room),
+    "schedule": ("schedules", schedule, Schedule),
+    "booking": ("bookings", booking, Booking),
+    "payment": ("payments", payment, Payment),
+    "review": ("reviews", review, Review),
+    "service": ("services", service, Service),
+    "booking_service": ("booking-services", booking_service, BookingService),
+}
+CHANGES_LIMIT = 1000
+
+@app.get("/changes/", dependencies=[Depends(staff_user)])
+async def read_changes(since: int = Query(0, ge=0), limit: int = Query(CHANGES_LIMIT, ge=0, le=10000)):
+    latest = await database.fetch_val("SELECT COALESCE(MAX(change_id), 0) FROM change_log")
+    entries = await database.fetch_all(
+        "SELECT change_id, table_name, row_id, operation FROM change_log"
+        " WHERE change_id > :since ORDER BY change_id LIMIT :limit",
+        {"since": since, "limit": limit},
+    )
+
+    upserts, deletes = {}, {}
+    for entry in entries:
+        target = upserts if entry["operation"] == "upsert" else deletes
+        target.setdefault(entry["table_name"], []).append(entry["row_id"])
+
+    changes = {}
+    for table_name, (resource, table, model) in CHANGE_RESOURCES.items():
+        if table_name not in upserts and table_name not in deletes:
+            continue
+        rows = await fetch_rows(table, model, ids=upserts[table_name]) if table_name in upserts else []
+        changes[resource] = {
+            "upserts": [{name: row[name] for name in model.__fields__} for row in rows],
+            "deletes": deletes.get(table_name, []),
+        }
+
+    # latest меньше since — база на сервере заменена, клиенту нужна полная загрузка
+    return {
+        "next": entries[-1]["change_id"] if entries else since,
+        "latest": latest,
+        "changes": changes,
+    }
+
 # Position routes
-@app.post("/positions/", response_model=Position)
+@app.post("/positions/", response_model=Position, dependencies=[Depends(admin_user)])
 async def create_position(position: PositionCreate):
     query = position.insert().values(
         title=position.title,
@@ -406,9 +1173,11 @@ async def create_position(position: PositionCreate):
     return {**position.dict(), "position_id": last_record_id}
 
 @app.get("/positions/", response_model=List[Position])
-async def read_positions():
-    query = position.select()
-    return await database.fetch_all(query)
+async def read_positions(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                         ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Position, fields)
+    rows = await fetch_rows(position, Position, columns, parse_ids(ids))
+    return list_response(Position, rows, columns)
 
 @app.get("/positions/{position_id}", response_model=Position)
 async def read_position(position_id: int):
@@ -418,7 +1187,7 @@ async def read_position(position_id: int):
         raise HTTPException(status_code=404, detail="Position not found")
     return result
 
-@app.put("/positions/{position_id}", response_model=Position)
+@app.put("/positions/{position_id}", response_model=Position, dependencies=[Depends(admin_user)])
 async def update_position(position_id: int, position_data: PositionCreate):
     query = (
         position.update()
@@ -428,14 +1197,14 @@ async def update_position(position_id: int, position_data: PositionCreate):
     await database.execute(query)
     return {**position_data.dict(), "position_id": position_id}
 
-@app.delete("/positions/{position_id}")
+@app.delete("/positions/{position_id}", dependencies=[Depends(admin_user)])
 async def delete_position(position_id: int):
     query = position.delete().where(position.c.position_id == position_id)
     await database.execute(query)
     return {"message": "Position deleted successfully"}
 
 # Employee routes
-@app.post("/employees/", response_model=Employee)
+@app.post("/employees/", response_model=Employee, dependencies=[Depends(admin_user)])
 async def create_employee(employee_data: EmployeeCreate):
     # 1. Хешируем пароль перед сохранением
     hashed_password = pwd_context.hash(employee_data.password)
@@ -462,12 +1231,14 @@ async def create_employee(employee_data: EmployeeCreate):
     # 5. Возвращаем данные, исключая пароль
     return {**dict(created_employee), "password": None}
 
-@app.get("/employees/", response_model=List[Employee])
-async def read_employees():
-    query = employee.select()
-    return await database.fetch_all(query)
+@app.get("/employees/", response_model=List[Employee], dependencies=[Depends(staff_user)])
+async def read_employees(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                         ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Employee, fields)
+    rows = await fetch_rows(employee, Employee, columns, parse_ids(ids))
+    return list_response(Employee, rows, columns)
 
-@app.get("/employees/{employee_id}", response_model=Employee)
+@app.get("/employees/{employee_id}", response_model=Employee, dependencies=[Depends(staff_user)])
 async def read_employee(employee_id: int):
     query = employee.select().where(employee.c.employee_id == employee_id)
     result = await database.fetch_one(query)
@@ -475,7 +1246,7 @@ async def read_employee(employee_id: int):
         raise HTTPException(status_code=404, detail="Employee not found")
     return result
 
-@app.put("/employees/{employee_id}", response_model=Employee)
+@app.put("/employees/{employee_id}", response_model=Employee, dependencies=[Depends(admin_user)])
 async def update_employee(employee_id: int, employee_data: EmployeeCreate):
     # Получаем текущие данные сотрудника
     current_employee = await database.fetch_one(
@@ -505,7 +1276,7 @@ async def update_employee(employee_id: int, employee_data: EmployeeCreate):
     )
     return {**dict(updated_employee), "password": None}  # Явно убираем пароль
 
-@app.delete("/employees/{employee_id}")
+@app.delete("/employees/{employee_id}", dependencies=[Depends(admin_user)])
 async def delete_employee(employee_id: int):
     query = employee.delete().where(employee.c.employee_id == employee_id)
     await database.execute(query)
@@ -551,7 +1322,7 @@ async def login_client(credentials: ClientLogin):
     query = client.select().where(client.c.login == credentials.login)
     client_data = await database.fetch_one(query)
 
-    if not client_data or not pwd_context.verify(credentials.password, client_data["password"]):
+    if not client_data or not await verify_password(client, client.c.client_id, client_data, credentials.password):
         raise HTTPException(
             status_code=401,
             detail="Неверный логин или пароль",
@@ -561,12 +1332,15 @@ async def login_client(credentials: ClientLogin):
     return {"message": "Успешный вход", "client_id": client_data["client_id"]}
 
 
-@app.post("/clients/change-password/")
-async def change_client_password(client_id: int, old_password: str, new_password: str):
+@app.post("/clients/change-password/", deprecated=True)
+async def change_client_password(client_id: int, old_password: str, new_password: str,
+                                 user: TokenUser = Depends(current_user)):
+    # Пароли в строке запроса попадают в логи; используйте POST /auth/change-password
+    check_client_access(user, client_id)
     query = client.select().where(client.c.client_id == client_id)
     client_data = await database.fetch_one(query)
 
-    if not client_data or not pwd_context.verify(old_password, client_data["password"]):
+    if not client_data or not await verify_password(client, client.c.client_id, client_data, old_password):
         raise HTTPException(
             status_code=401,
             detail="Неверный текущий пароль",
@@ -582,13 +1356,16 @@ async def change_client_password(client_id: int, old_password: str, new_password
 
     return {"message": "Пароль успешно изменен"}
 
-@app.get("/clients/", response_model=List[Client])
-async def read_clients():
-    query = client.select()
-    return await database.fetch_all(query)
+@app.get("/clients/", response_model=List[Client], dependencies=[Depends(staff_user)])
+async def read_clients(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                       ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Client, fields)
+    rows = await fetch_rows(client, Client, columns, parse_ids(ids))
+    return list_response(Client, rows, columns)
 
 @app.get("/clients/{client_id}", response_model=Client)
-async def read_client(client_id: int):
+async def read_client(client_id: int, user: TokenUser = Depends(current_user)):
+    check_client_access(user, client_id)
     query = client.select().where(client.c.client_id == client_id)
     result = await database.fetch_one(query)
     if not result:
@@ -596,7 +1373,8 @@ async def read_client(client_id: int):
     return result
 
 @app.put("/clients/{client_id}", response_model=Client)
-async def update_client(client_id: int, client_data: ClientCreate):
+async def update_client(client_id: int, client_data: ClientCreate, user: TokenUser = Depends(current_user)):
+    check_client_access(user, client_id)
     # Получаем текущие данные клиента
     current_client = await database.fetch_one(
         client.select().where(client.c.client_id == client_id)
@@ -626,13 +1404,41 @@ async def update_client(client_id: int, client_data: ClientCreate):
     return {**dict(updated_client), "password": None}
 
 @app.delete("/clients/{client_id}")
-async def delete_client(client_id: int):
+async def delete_client(client_id: int, user: TokenUser = Depends(current_user)):
+    check_client_access(user, client_id)
     query = client.delete().where(client.c.client_id == client_id)
     await database.execute(query)
     return {"message": "Client deleted successfully"}
 
+@app.get("/clients/{client_id}/bookings", response_model=ClientBookingPage)
+async def read_client_bookings(client_id: int, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                               user: TokenUser = Depends(current_user)):
+    # Брони клиента с сеансом, квестом, комнатой и суммами — новые сначала
+    check_client_access(user, client_id)
+    query = (
+        sqlalchemy.select([
+            booking.c.booking_id, booking.c.status, booking.c.participants_count,
+            schedule.c.schedule_id, schedule.c.date, schedule.c.start_time, schedule.c.end_time,
+            quest.c.quest_id, quest.c.title.label("quest_title"), quest.c.price,
+            room.c.room_id, room.c.title.label("room_title"),
+            booking.c.total_due, booking.c.total_paid.label("paid"), booking.c.balance,
+        ])
+        .select_from(
+            booking.outerjoin(schedule, schedule.c.schedule_id == booking.c.schedule_id)
+            .outerjoin(quest, quest.c.quest_id == schedule.c.quest_id)
+            .outerjoin(room, room.c.room_id == schedule.c.room_id)
+        )
+        .where(booking.c.client_id == client_id)
+        .order_by(schedule.c.date.desc(), schedule.c.start_time.desc(), booking.c.booking_id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    total = await database.fetch_val(
+        sqlalchemy.select([sqlalchemy.func.count()]).select_from(booking).where(booking.c.client_id == client_id))
+    return {"total": total, "limit": limit, "offset": offset, "items": await database.fetch_all(query)}
+
 # Quest routes
-@app.post("/quests/", response_model=Quest)
+@app.post("/quests/", response_model=Quest, dependencies=[Depends(staff_user)])
 async def create_quest(quest_data: QuestCreate):
     query = quest.insert().values(
         title=quest_data.title,
@@ -652,9 +1458,11 @@ async def create_quest(quest_data: QuestCreate):
     return created_quest
 
 @app.get("/quests/", response_model=List[Quest])
-async def read_quests():
-    query = quest.select()
-    return await database.fetch_all(query)
+async def read_quests(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                      ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Quest, fields)
+    rows = await fetch_rows(quest, Quest, columns, parse_ids(ids))
+    return list_response(Quest, rows, columns)
 
 @app.get("/quests/{quest_id}", response_model=Quest)
 async def read_quest(quest_id: int):
@@ -664,7 +1472,7 @@ async def read_quest(quest_id: int):
         raise HTTPException(status_code=404, detail="Quest not found")
     return result
 
-@app.put("/quests/{quest_id}", response_model=Quest)
+@app.put("/quests/{quest_id}", response_model=Quest, dependencies=[Depends(staff_user)])
 async def update_quest(quest_id: int, quest_data: QuestCreate):
     query = (
         quest.update()
@@ -674,23 +1482,94 @@ async def update_quest(quest_id: int, quest_data: QuestCreate):
     await database.execute(query)
     return {**quest_data.dict(), "quest_id": quest_id}
 
-@app.delete("/quests/{quest_id}")
+@app.delete("/quests/{quest_id}", dependencies=[Depends(staff_user)])
 async def delete_quest(quest_id: int):
     query = quest.delete().where(quest.c.quest_id == quest_id)
     await database.execute(query)
     return {"message": "Quest deleted successfully"}
 
 # Room routes
-@app.post("/rooms/", response_model=Room)
+@app.post("/rooms/", response_model=Room, dependencies=[Depends(staff_user)])
 async def create_room(room: RoomCreate):
     query = room.insert().values(**room.dict())
     last_record_id = await database.execute(query)
     return {**room.dict(), "room_id": last_record_id}
 
 @app.get("/rooms/", response_model=List[Room])
-async def read_rooms():
-    query = room.select()
-    return await database.fetch_all(query)
+async def read_rooms(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                     ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Room, fields)
+    rows = await fetch_rows(room, Room, columns, parse_ids(ids))
+    return list_response(Room, rows, columns)
+
+# Рабочее время комнат для подбора; сеанс, как и в шаблонах, заканчивается до полуночи
+ROOMS_OPEN_MINUTES = 10 * 60
+ROOMS_CLOSE_MINUTES = 24 * 60 - 1
+SUGGESTION_STEP_MINUTES = 15
+
+@app.get("/rooms/suggestions", response_model=List[RoomSuggestion])
+async def suggest_rooms(quest_id: int, day: date = Query(..., alias="date"),
+                        preferred: time = Query(..., alias="time", description="Желаемое время начала"),
+                        participants: int = Query(..., ge=1), limit: int = Query(5, ge=1, le=50)):
+    # Лучшие комнаты и время для группы; вызывается на каждое изменение формы
+    # брони, поэтому всё считается по сеансам одного дня двумя запросами по индексам
+    durations = await database.fetch_one(
+        "SELECT (SELECT duration FROM quest WHERE quest_id = :quest_id) AS duration,"
+        " (SELECT MIN(duration) FROM quest WHERE duration > 0) AS min_duration",
+        {"quest_id": quest_id})
+    if durations["duration"] is None:
+        raise HTTPException(status_code=404, detail="Quest not found")
+
+    opening = ROOMS_OPEN_MINUTES
+    today = date.today()
+    if day < today:
+        return []
+    if day == today:
+        # Сегодня — не раньше ближайшего шага сетки после текущего времени
+        now = minutes(datetime.now())
+        opening = max(opening, now + (-now) % SUGGESTION_STEP_MINUTES)
+
+    rows = await database.fetch_all(
+        sqlalchemy.select([room.c.room_id, room.c.title, room.c.capacity])
+        .where(sqlalchemy.and_(room.c.is_available.is_(True), room.c.capacity >= participants))
+    )
+    if not rows:
+        return []
+    rooms = {row["room_id"]: row for row in rows}
+
+    booked = (
+        sqlalchemy.select([sqlalchemy.func.coalesce(sqlalchemy.func.sum(booking.c.participants_count), 0)])
+        .where(sqlalchemy.and_(booking.c.schedule_id == schedule.c.schedule_id,
+                               booking.c.status.notin_(INACTIVE_STATUSES)))
+        .scalar_subquery()
+    )
+    sessions = {}
+    for row in await database.fetch_all(
+        sqlalchemy.select([schedule.c.schedule_id, schedule.c.room_id, schedule.c.quest_id,
+                           schedule.c.starts_at, schedule.c.ends_at, booked.label("booked")])
+        .where(sqlalchemy.and_(schedule.c.room_id.in_(list(rooms)),
+                               schedule_overlaps(datetime.combine(day, time()),
+                                                 datetime.combine(day + timedelta(days=1), time()))))
+    ):
+        # Сеанс с прошлого дня начинается «до полуночи», то есть с отрицательной минуты
+        sessions.setdefault(row["room_id"], []).append(
+            (*span_minutes(row["starts_at"], row["ends_at"], day), row["schedule_id"], row["quest_id"], row["booked"]))
+
+    options = suggest({room_id: row["capacity"] for room_id, row in rooms.items()}, sessions, quest_id,
+                      durations["duration"], minutes(preferred), participants, durations["min_duration"],
+                      opening, ROOMS_CLOSE_MINUTES, SUGGESTION_STEP_MINUTES, limit)
+    return [{
+        "room_id": option["room_id"],
+        "room_title": rooms[option["room_id"]]["title"],
+        "capacity": rooms[option["room_id"]]["capacity"],
+        "schedule_id": option["schedule_id"],
+        # Сеанс, к которому можно присоединиться, может закончиться после полуночи
+        "start_time": clock_time(day, option["start"]),
+        "end_time": clock_time(day, option["end"]),
+        "shift_minutes": option["shift"],
+        "wasted_seats": option["wasted_seats"],
+        "dead_minutes": option["dead_minutes"],
+    } for option in options]
 
 @app.get("/rooms/{room_id}", response_model=Room)
 async def read_room(room_id: int):
@@ -700,7 +1579,7 @@ async def read_room(room_id: int):
         raise HTTPException(status_code=404, detail="Room not found")
     return result
 
-@app.put("/rooms/{room_id}", response_model=Room)
+@app.put("/rooms/{room_id}", response_model=Room, dependencies=[Depends(staff_user)])
 async def update_room(room_id: int, room_data: RoomCreate):
     query = (
         room.update()
@@ -710,23 +1589,217 @@ async def update_room(room_id: int, room_data: RoomCreate):
     await database.execute(query)
     return {**room_data.dict(), "room_id": room_id}
 
-@app.delete("/rooms/{room_id}")
+@app.delete("/rooms/{room_id}", dependencies=[Depends(staff_user)])
 async def delete_room(room_id: int):
     query = room.delete().where(room.c.room_id == room_id)
     await database.execute(query)
     return {"message": "Room deleted successfully"}
 
+# Availability routes
+# Занятость комнат по дням кэшируется в процессе; запись расписания сбрасывает
+# день во всех воркерах через shared_state
+AVAILABILITY_MAX_DAYS = 62
+OCCUPANCY_KEY_PREFIX = "occupancy:"
+occupancy_cache = OccupancyCache()
+
+def drop_occupancy(key):
+    if key.startswith(OCCUPANCY_KEY_PREFIX):
+        occupancy_cache.invalidate(date.fromisoformat(key[len(OCCUPANCY_KEY_PREFIX):]))
+
+shared_state.on_invalidate(drop_occupancy)
+
+async def invalidate_occupancy(days):
+    for day in set(days):
+        await shared_state.invalidate(f"{OCCUPANCY_KEY_PREFIX}{day.isoformat()}")
+
+async def day_occupancy(first, last):
+    # {день: {room_id: маска занятых клеток}}; недостающие дни — одним запросом по индексу
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    result = {day: occupancy_cache.get(day) for day in days}
+    missing = [day for day in days if result[day] is None]
+    if missing:
+        generations = {day: occupancy_cache.generation(day) for day in missing}
+        sessions = {day: {} for day in missing}
+        rows = await database.fetch_all(
+            sqlalchemy.select([schedule.c.room_id, schedule.c.starts_at, schedule.c.ends_at])
+            .where(sqlalchemy.and_(schedule.c.room_id.in_(sqlalchemy.select([room.c.room_id])),
+                                   schedule_overlaps(datetime.combine(missing[0], time()),
+                                                     datetime.combine(missing[-1] + timedelta(days=1), time()))))
+        )
+        for row in rows:
+            # Сеанс через полночь занимает время в обоих днях
+            for day in span_days(row["starts_at"], row["ends_at"]):
+                if day in sessions:
+                    sessions[day].setdefault(row["room_id"], []).append(
+                        span_minutes(row["starts_at"], row["ends_at"], day))
+        for day in missing:
+            result[day] = {
+                room_id: occupancy_mask(room_sessions, ROOMS_OPEN_MINUTES, ROOMS_CLOSE_MINUTES,
+                                        SUGGESTION_STEP_MINUTES)
+                for room_id, room_sessions in sessions[day].items()
+            }
+            occupancy_cache.put(day, result[day], generations[day])
+    return result
+
+@app.get("/availability/matrix")
+async def availability_matrix(quest_id: int,
+                              date_from: date = Query(..., alias="from", description="Первый день, включительно"),
+                              date_to: date = Query(..., alias="to", description="Последний день, включительно"),
+                              participants: int = Query(1, ge=1)):
+    # Для каждой подходящей комнаты — base64 масок начал квеста по дням (см. availability.py)
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="to is before from")
+    if (date_to - date_from).days >= AVAILABILITY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {AVAILABILITY_MAX_DAYS} days per request")
+    duration = await database.fetch_val(sqlalchemy.select([quest.c.duration]).where(quest.c.quest_id == quest_id))
+    if duration is None:
+        raise HTTPException(status_code=404, detail="Quest not found")
+
+    rooms = await database.fetch_all(
+        sqlalchemy.select([room.c.room_id, room.c.title, room.c.capacity])
+        .where(sqlalchemy.and_(room.c.is_available.is_(True), room.c.capacity >= participants))
+        .order_by(room.c.room_id)
+    )
+    occupancy = await day_occupancy(date_from, date_to)
+
+    cells = cell_count(ROOMS_OPEN_MINUTES, ROOMS_CLOSE_MINUTES, SUGGESTION_STEP_MINUTES)
+    bytes_per_day = (cells + 7) // 8
+    today, now = date.today(), minutes(datetime.now())
+    result = []
+    for room_row in rooms:
+        data = bytearray()
+        for day, day_masks in occupancy.items():
+            if day < today:
+                mask = 0
+            else:
+                mask = start_mask(day_masks.get(room_row["room_id"], 0), duration, ROOMS_OPEN_MINUTES,
+                                  ROOMS_CLOSE_MINUTES, SUGGESTION_STEP_MINUTES, now if day == today else None)
+            data += mask.to_bytes(bytes_per_day, "little")
+        result.append({"room_id": room_row["room_id"], "title": room_row["title"],
+                       "capacity": room_row["capacity"], "starts": base64.b64encode(bytes(data)).decode()})
+    return {
+        "from": date_from,
+        "to": date_to,
+        "opening": time(ROOMS_OPEN_MINUTES // 60, ROOMS_OPEN_MINUTES % 60),
+        "step_minutes": SUGGESTION_STEP_MINUTES,
+        "cells": cells,
+        "bytes_per_day": bytes_per_day,
+        "duration": duration,
+        "rooms": result,
+    }
+
 # Schedule routes
-@app.post("/schedules/", response_model=Schedule)
+# Конец сеанса не дальше следующего дня, поэтому сеанс длится не больше суток
+SCHEDULE_MAX_LENGTH = timedelta(days=1)
+
+def schedule_span(day, start_time, end_time):
+    # -> (starts_at, ends_at); конец не позже начала — сеанс переходит через полночь
+    starts_at = datetime.combine(day, start_time)
+    ends_at = datetime.combine(day, end_time)
+    if ends_at <= starts_at:
+        ends_at += timedelta(days=1)
+    return starts_at, ends_at
+
+def schedule_values(data):
+    # Строка schedule из date/start_time/end_time вместе с starts_at/ends_at
+    starts_at, ends_at = schedule_span(data["date"], data["start_time"], data["end_time"])
+    return {**data, "starts_at": starts_at, "ends_at": ends_at}
+
+def span_days(starts_at, ends_at):
+    # Дни, которые задевает сеанс [starts_at, ends_at)
+    last = (ends_at - timedelta(microseconds=1)).date()
+    return [starts_at.date() + timedelta(days=i) for i in range((last - starts_at.date()).days + 1)]
+
+def span_minutes(starts_at, ends_at, day):
+    # Начало и конец в минутах от полуночи day; у сеанса через полночь конец больше 24 * 60
+    midnight = datetime.combine(day, time())
+    return (int((starts_at - midnight).total_seconds()) // 60, int((ends_at - midnight).total_seconds()) // 60)
+
+def clock_time(day, value):
+    # Обратно к span_minutes: минуты от полуночи day -> время суток (после 24 * 60 — уже следующего дня)
+    return (datetime.combine(day, time()) + timedelta(minutes=value)).time()
+
+def schedule_overlaps(starts_at, ends_at):
+    # Сеансы, пересекающиеся с [starts_at, ends_at), — один диапазон по ix_schedule_room_starts
+    return sqlalchemy.and_(schedule.c.starts_at > starts_at - SCHEDULE_MAX_LENGTH,
+                           schedule.c.starts_at < ends_at, schedule.c.ends_at > starts_at)
+
+# Комната :room_id свободна на [:starts_at, :ends_at); как и SLOT_HAS_ROOM,
+# условие проверяется в том же операторе, что и запись
+ROOM_IS_FREE = (
+    "NOT EXISTS (SELECT 1 FROM schedule AS busy"
+    " WHERE busy.room_id = :room_id AND busy.schedule_id != :exclude_id"
+    " AND busy.starts_at > :earliest AND busy.starts_at < :ends_at AND busy.ends_at > :starts_at)"
+)
+# Типы параметров, чтобы даты и время в сыром SQL были в том же формате, что пишет SQLAlchemy
+SCHEDULE_WRITE_PARAMS = [
+    *(sqlalchemy.bindparam(column.name, type_=column.type)
+      for column in schedule.columns if column is not schedule.c.schedule_id),
+    sqlalchemy.bindparam("earliest", type_=sqlalchemy.DateTime),
+]
+
+def schedule_write(sql, values, exclude_id=0):
+    return sqlalchemy.text(sql).bindparams(*SCHEDULE_WRITE_PARAMS).bindparams(
+        **values, exclude_id=exclude_id, earliest=values["starts_at"] - SCHEDULE_MAX_LENGTH)
+
+async def insert_schedule(values):
+    # Кеш занятости сбрасывает вызывающий — после фиксации транзакции, иначе
+    # параллельный запрос закеширует занятость без нового сеанса
+    inserted = await database.fetch_one(schedule_write(
+        "INSERT INTO schedule (quest_id, room_id, date, start_time, end_time, starts_at, ends_at)"
+        " SELECT :quest_id, :room_id, :date, :start_time, :end_time, :starts_at, :ends_at"
+        f" WHERE {ROOM_IS_FREE} RETURNING schedule_id", values))
+    if not inserted:
+        raise HTTPException(status_code=409, detail="The room is busy at this time")
+    return inserted["schedule_id"]
+
+@app.post("/schedules/", response_model=Schedule, dependencies=[Depends(staff_user)])
 async def create_schedule(schedule_data: ScheduleCreate):
-    query = schedule.insert().values(**schedule_data.dict())
-    schedule_id = await database.execute(query)
+    values = schedule_values(schedule_data.dict())
+    schedule_id = await insert_schedule(values)
+    await invalidate_occupancy(span_days(values["starts_at"], values["ends_at"]))
     return await database.fetch_one(schedule.select().where(schedule.c.schedule_id == schedule_id))
 
 @app.get("/schedules/", response_model=List[Schedule])
-async def read_schedules():
-    query = schedule.select()
-    return await database.fetch_all(query)
+async def read_schedules(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                         ids: Optional[str] = Query(None, description=IDS_DESCRIPTION),
+                         date_from: Optional[date] = Query(None, alias="from", description="Первый день, включительно"),
+                         date_to: Optional[date] = Query(None, alias="to", description="Последний день, включительно"),
+                         room_id: Optional[int] = Query(None),
+                         since: Optional[datetime] = Query(None, description="Сеансы, которые ещё идут в этот момент или позже"),
+                         until: Optional[datetime] = Query(None, description="Сеансы, которые начинаются раньше этого момента")):
+    columns = parse_fields(Schedule, fields)
+    if date_from is None and date_to is None and room_id is None and since is None and until is None:
+        rows = await fetch_rows(schedule, Schedule, columns, parse_ids(ids))
+        return list_response(Schedule, rows, columns)
+
+    conditions = []
+    if room_id is not None:
+        conditions.append(schedule.c.room_id == room_id)
+    else:
+        # Индекс начинается с room_id: без комнаты перебираем все комнаты
+        # через IN, чтобы SQLite всё равно искал по индексу, а не сканировал таблицу
+        conditions.append(schedule.c.room_id.in_(sqlalchemy.select([room.c.room_id])))
+    if date_from is not None:
+        conditions.append(schedule.c.date >= date_from)
+    if date_to is not None:
+        conditions.append(schedule.c.date <= date_to)
+    if since is not None or until is not None:
+        # «Ближайшие N часов»: пересечение с [since, until) по (room_id, starts_at)
+        if since is not None and until is not None:
+            conditions.append(schedule_overlaps(since, until))
+        elif since is not None:
+            conditions.append(sqlalchemy.and_(schedule.c.starts_at > since - SCHEDULE_MAX_LENGTH,
+                                              schedule.c.ends_at > since))
+        else:
+            conditions.append(schedule.c.starts_at < until)
+        order_by = (schedule.c.room_id, schedule.c.starts_at)
+    else:
+        order_by = (schedule.c.room_id, schedule.c.date, schedule.c.start_time)
+
+    rows = await fetch_rows(schedule, Schedule, columns, parse_ids(ids), where=sqlalchemy.and_(*conditions),
+                            order_by=order_by)
+    return list_response(Schedule, rows, columns)
 
 @app.get("/schedules/{schedule_id}", response_model=Schedule)
 async def read_schedule(schedule_id: int):
@@ -736,27 +1809,357 @@ async def read_schedule(schedule_id: int):
         raise HTTPException(status_code=404, detail="Schedule not found")
     return result
 
-@app.put("/schedules/{schedule_id}", response_model=Schedule)
+@app.put("/schedules/{schedule_id}", response_model=Schedule, dependencies=[Depends(staff_user)])
 async def update_schedule(schedule_id: int, schedule_data: ScheduleCreate):
-    await database.execute(
-        schedule.update()
-        .where(schedule.c.schedule_id == schedule_id)
-        .values(**schedule_data.dict())
-    )
+    previous = await database.fetch_one(
+        sqlalchemy.select([schedule.c.starts_at, schedule.c.ends_at]).where(schedule.c.schedule_id == schedule_id))
+    if not previous:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    values = schedule_values(schedule_data.dict())
+    updated = await database.fetch_one(schedule_write(
+        "UPDATE schedule SET quest_id = :quest_id, room_id = :room_id, date = :date, start_time = :start_time,"
+        " end_time = :end_time, starts_at = :starts_at, ends_at = :ends_at"
+        f" WHERE schedule_id = :exclude_id AND {ROOM_IS_FREE} RETURNING schedule_id", values, schedule_id))
+    if not updated:
+        raise HTTPException(status_code=409, detail="The room is busy at this time")
+    await invalidate_occupancy(span_days(previous["starts_at"], previous["ends_at"])
+                               + span_days(values["starts_at"], values["ends_at"]))
     return await database.fetch_one(schedule.select().where(schedule.c.schedule_id == schedule_id))
 
 
-@app.delete("/schedules/{schedule_id}")
+@app.delete("/schedules/{schedule_id}", dependencies=[Depends(staff_user)])
 async def delete_schedule(schedule_id: int):
-    await database.execute(schedule.delete().where(schedule.c.schedule_id == schedule_id))
+    # Сеанс с неотменёнными бронями не удаляется: без него бронь нельзя ни
+    # изменить, ни отменить. Проверка — в том же операторе, что и удаление
+    deleted = await database.fetch_one(
+        "DELETE FROM schedule WHERE schedule_id = :schedule_id AND NOT EXISTS"
+        " (SELECT 1 FROM booking WHERE booking.schedule_id = :schedule_id AND booking.status != :cancelled)"
+        " RETURNING starts_at, ends_at",
+        {"schedule_id": schedule_id, "cancelled": CANCELLED_STATUS})
+    if deleted:
+        await invalidate_occupancy(span_days(datetime.fromisoformat(deleted["starts_at"]),
+                                             datetime.fromisoformat(deleted["ends_at"])))
+    elif await database.fetch_val(sqlalchemy.select([schedule.c.schedule_id]).where(schedule.c.schedule_id == schedule_id)):
+        raise HTTPException(status_code=409, detail="The slot still has bookings")
     return {"message": "Schedule deleted"}
 
+# Schedule template routes
+# Больше слотов за один шаблон не создаём: это уже явно ошибка в датах
+TEMPLATE_MAX_SLOTS = 5000
+
+def template_from_row(row):
+    return {
+        "template_id": row["template_id"],
+        "quest_id": row["quest_id"],
+        "room_id": row["room_id"],
+        "weekdays": [int(day) for day in row["weekdays"].split(",")],
+        "start_times": [time.fromisoformat(value) for value in row["start_times"].split(",")],
+        "date_from": row["date_from"],
+        "date_to": row["date_to"],
+    }
+
+async def expand_template(template_data):
+    # Слоты шаблона в порядке даты и времени; конец слота — начало плюс длительность квеста
+    weekdays = sorted(set(template_data.weekdays))
+    start_times = sorted(set(template_data.start_times))
+    if not weekdays or any(day < 0 or day > 6 for day in weekdays):
+        raise HTTPException(status_code=400, detail="weekdays must be numbers 0 (Monday) to 6 (Sunday)")
+    if not start_times:
+        raise HTTPException(status_code=400, detail="start_times must not be empty")
+    if template_data.date_to < template_data.date_from:
+        raise HTTPException(status_code=400, detail="date_to is before date_from")
+
+    duration = await database.fetch_val(
+        sqlalchemy.select([quest.c.duration]).where(quest.c.quest_id == template_data.quest_id))
+    if duration is None:
+        raise HTTPException(status_code=404, detail="Quest not found")
+    room_exists = await database.fetch_val(
+        sqlalchemy.select([room.c.room_id]).where(room.c.room_id == template_data.room_id))
+    if room_exists is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    minutes = [start.hour * 60 + start.minute for start in start_times]
+    if minutes[-1] + duration >= 24 * 60:
+        raise HTTPException(status_code=400, detail=f"Slot at {start_times[-1]:%H:%M} ends after midnight")
+    for previous, current in zip(minutes, minutes[1:]):
+        if current - previous < duration:
+            raise HTTPException(status_code=400,
+                                detail=f"Start times are closer than the quest duration ({duration} min)")
+    times = [(start, time((m + duration) // 60, (m + duration) % 60)) for start, m in zip(start_times, minutes)]
+
+    slots = []
+    day = template_data.date_from
+    while day <= template_data.date_to:
+        if day.weekday() in weekdays:
+            for start, end in times:
+                slots.append(schedule_values({"quest_id": template_data.quest_id, "room_id": template_data.room_id,
+                                              "date": day, "start_time": start, "end_time": end}))
+                if len(slots) > TEMPLATE_MAX_SLOTS:
+                    raise HTTPException(status_code=400,
+                                        detail=f"Template expands to more than {TEMPLATE_MAX_SLOTS} slots")
+        day += timedelta(days=1)
+    return slots
+
+async def find_conflicts(slots):
+    # Пересечения со строками schedule той же комнаты; один запрос по
+    # индексу (room_id, starts_at) на весь диапазон шаблона
+    if not slots:
+        return []
+    rows = await database.fetch_all(
+        sqlalchemy.select([schedule.c.schedule_id, schedule.c.starts_at, schedule.c.ends_at])
+        .where(sqlalchemy.and_(schedule.c.room_id == slots[0]["room_id"],
+                               schedule_overlaps(slots[0]["starts_at"], slots[-1]["ends_at"])))
+        .order_by(schedule.c.room_id, schedule.c.starts_at)
+    )
+    starts = [row["starts_at"] for row in rows]
+
+    conflicts = []
+    for index, slot in enumerate(slots):
+        # Пересечь слот могут только сеансы, начавшиеся меньше чем за сутки до него
+        first = bisect.bisect_right(starts, slot["starts_at"] - SCHEDULE_MAX_LENGTH)
+        for row in rows[first:bisect.bisect_left(starts, slot["ends_at"])]:
+            if row["ends_at"] > slot["starts_at"]:
+                conflicts.append({"slot": index, "date": slot["date"], "start_time": slot["start_time"],
+                                  "end_time": slot["end_time"], "schedule_id": row["schedule_id"]})
+                break
+    return conflicts
+
+@app.post("/schedule-templates/preview", dependencies=[Depends(staff_user)])
+async def preview_schedule_template(template_data: ScheduleTemplateCreate):
+    # Что создаст шаблон, без записи в базу
+    slots = await expand_template(template_data)
+    return {"slots": slots, "conflicts": await find_conflicts(slots)}
+
+@app.post("/schedule-templates/", response_model=ScheduleTemplateResult, dependencies=[Depends(staff_user)])
+async def create_schedule_template(template_data: ScheduleTemplateCreate,
+                                   skip_conflicts: bool = Query(False, description="Создать слоты без пересечений, пропустив остальные")):
+    # Шаблон и все его слоты создаются в одной транзакции
+    async with transaction():
+        slots = await expand_template(template_data)
+        conflicts = await find_conflicts(slots)
+        if conflicts and not skip_conflicts:
+            raise HTTPException(status_code=409, detail=jsonable_encoder(
+                {"message": "Slots overlap existing schedules", "conflicts": conflicts}))
+
+        template_id = await database.execute(schedule_template.insert().values(
+            quest_id=template_data.quest_id,
+            room_id=template_data.room_id,
+            weekdays=",".join(str(day) for day in sorted(set(template_data.weekdays))),
+            start_times=",".join(value.strftime("%H:%M") for value in sorted(set(template_data.start_times))),
+            date_from=template_data.date_from,
+            date_to=template_data.date_to,
+        ))
+        skipped = {conflict["slot"] for conflict in conflicts}
+        created = [slot for index, slot in enumerate(slots) if index not in skipped]
+        if created:
+            await database.execute_many(schedule.insert(), created)
+
+        row = await database.fetch_one(
+            schedule_template.select().where(schedule_template.c.template_id == template_id))
+    await invalidate_occupancy([day for slot in created for day in span_days(slot["starts_at"], slot["ends_at"])])
+    return {**template_from_row(row), "created": len(created), "skipped": len(skipped)}
+
+@app.get("/schedule-templates/", response_model=List[ScheduleTemplate])
+async def read_schedule_templates():
+    rows = await database.fetch_all(schedule_template.select().order_by(schedule_template.c.template_id))
+    return [template_from_row(row) for row in rows]
+
+@app.delete("/schedule-templates/{template_id}", dependencies=[Depends(staff_user)])
+async def delete_schedule_template(template_id: int):
+    # Созданные по шаблону расписания остаются
+    await database.execute(schedule_template.delete().where(schedule_template.c.template_id == template_id))
+    return {"message": "Schedule template deleted"}
+
 # Booking routes
+# Вместимость слота — вместимость комнаты его расписания. Места занимают
+# все брони, кроме отменённых и стоящих в листе ожидания (INACTIVE_STATUSES).
+INACTIVE_PARAMS = {f"inactive_{i}": status for i, status in enumerate(INACTIVE_STATUSES)}
+INACTIVE_PLACEHOLDERS = ", ".join(":" + name for name in INACTIVE_PARAMS)
+# Занятые места слота, не считая брони :exclude_id. Проверка и запись идут
+# одним оператором: SQLite выполняет его атомарно, так что две одновременные
+# брони не займут одно место, и при этом не нужна транзакция на чтение и запись
+SLOT_HAS_ROOM = (
+    "(SELECT COALESCE(SUM(participants_count), 0) FROM booking"
+    " WHERE schedule_id = :schedule_id AND booking_id != :exclude_id"
+    f" AND status NOT IN ({INACTIVE_PLACEHOLDERS}))"
+    " + :participants_count <= :capacity"
+)
+
+# position.access_level игровых мастеров — их сервер назначает на брони
+GAME_MASTER_ACCESS_LEVEL = 2
+# Мастер :employee_id свободен на время сеанса :schedule_id: у него нет активных
+# броней на других сеансах, пересекающихся по времени. Как и
+# SLOT_HAS_ROOM, условие проверяется в том же операторе, что и запись
+GAME_MASTER_IS_FREE = (
+    "NOT EXISTS (SELECT 1 FROM booking AS other"
+    " JOIN schedule AS busy ON busy.schedule_id = other.schedule_id"
+    " JOIN schedule AS slot ON slot.schedule_id = :schedule_id"
+    " WHERE other.employee_id = :employee_id AND other.schedule_id != :schedule_id"
+    f" AND other.status NOT IN ({INACTIVE_PLACEHOLDERS})"
+    " AND busy.starts_at < slot.ends_at AND busy.ends_at > slot.starts_at)"
+)
+
+async def slot_capacity(schedule_id):
+    row = await database.fetch_one(
+        sqlalchemy.select([schedule.c.schedule_id, room.c.capacity])
+        .select_from(schedule.outerjoin(room, room.c.room_id == schedule.c.room_id))
+        .where(schedule.c.schedule_id == schedule_id)
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return row["capacity"]
+
+async def game_masters():
+    rows = await database.fetch_all(
+        sqlalchemy.select([employee.c.employee_id])
+        .select_from(employee.join(position, position.c.position_id == employee.c.position_id))
+        .where(position.c.access_level == GAME_MASTER_ACCESS_LEVEL)
+        .order_by(employee.c.employee_id)
+    )
+    return [row["employee_id"] for row in rows]
+
+async def day_sessions(day):
+    # Активные брони сеансов, идущих в этот день, в том числе начатых накануне
+    # вечером: (schedule_id, начало, конец в минутах от полуночи day, мастер)
+    midnight = datetime.combine(day, time())
+    rows = await database.fetch_all(
+        sqlalchemy.select([schedule.c.schedule_id, schedule.c.starts_at, schedule.c.ends_at, booking.c.employee_id])
+        .select_from(schedule.join(booking, booking.c.schedule_id == schedule.c.schedule_id))
+        .where(sqlalchemy.and_(
+            # Как в read_schedules: IN по комнатам, чтобы диапазон искался по индексу
+            schedule.c.room_id.in_(sqlalchemy.select([room.c.room_id])),
+            schedule_overlaps(midnight, midnight + timedelta(days=1)),
+            booking.c.status.notin_(INACTIVE_STATUSES),
+        ))
+    )
+    return [(row["schedule_id"], *span_minutes(row["starts_at"], row["ends_at"], day), row["employee_id"])
+            for row in rows]
+
+async def game_master_is_free(employee_id, schedule_id):
+    return bool(await database.fetch_val(
+        f"SELECT {GAME_MASTER_IS_FREE}",
+        {"employee_id": employee_id, "schedule_id": schedule_id, **INACTIVE_PARAMS},
+    ))
+
+async def assign_game_master(booking_id, schedule_id):
+    # Назначает брони свободного мастера с наименьшей нагрузкой за день;
+    # None — свободных мастеров нет, бронь остаётся без мастера
+    slot = await database.fetch_one(
+        sqlalchemy.select([schedule.c.date, schedule.c.starts_at, schedule.c.ends_at])
+        .where(schedule.c.schedule_id == schedule_id)
+    )
+    if not slot:
+        return None
+    candidates = rank_candidates(schedule_id, *span_minutes(slot["starts_at"], slot["ends_at"], slot["date"]),
+                                 await day_sessions(slot["date"]), await game_masters())
+    for employee_id in candidates:
+        # Между чтением и записью мастера мог занять другой запрос — тогда следующий
+        assigned = await database.fetch_one(
+            f"UPDATE booking SET employee_id = :employee_id WHERE booking_id = :booking_id"
+            f" AND {GAME_MASTER_IS_FREE} RETURNING employee_id",
+            {"employee_id": employee_id, "booking_id": booking_id, "schedule_id": schedule_id, **INACTIVE_PARAMS},
+        )
+        if assigned:
+            return employee_id
+    return None
+
+async def staff_promoted(schedule_id, promoted):
+    # Поднятой из листа ожидания брони нужен мастер, свободный на время сеанса
+    for booking_id, employee_id in promoted:
+        if employee_id is None or not await game_master_is_free(employee_id, schedule_id):
+            await assign_game_master(booking_id, schedule_id)
+
+async def promote_waitlist(schedule_id):
+    # Брони из листа ожидания по очереди занимают освободившиеся места;
+    # группа, которой мест не хватает, пропускает вперёд следующую
+    try:
+        capacity = await slot_capacity(schedule_id)
+    except HTTPException:
+        return []
+    params = {"promoted": PROMOTED_STATUS, "waitlist": WAITLIST_STATUS, "schedule_id": schedule_id}
+    if capacity is None:
+        rows = await database.fetch_all(
+            "UPDATE booking SET status = :promoted WHERE schedule_id = :schedule_id AND status = :waitlist"
+            " RETURNING booking_id, employee_id", params)
+        await staff_promoted(schedule_id, [(row["booking_id"], row["employee_id"]) for row in rows])
+        return [row["booking_id"] for row in rows]
+
+    waiting = await database.fetch_all(
+        sqlalchemy.select([booking.c.booking_id, booking.c.participants_count, booking.c.employee_id])
+        .where(sqlalchemy.and_(booking.c.schedule_id == schedule_id, booking.c.status == WAITLIST_STATUS))
+        .order_by(booking.c.booking_id)
+    )
+    promoted = []
+    for row in waiting:
+        result = await database.fetch_one(
+            "UPDATE booking SET status = :promoted WHERE booking_id = :exclude_id AND status = :waitlist"
+            f" AND {SLOT_HAS_ROOM} RETURNING booking_id",
+            {**params, "exclude_id": row["booking_id"], "participants_count": row["participants_count"],
+             "capacity": capacity, **INACTIVE_PARAMS},
+        )
+        if result:
+            promoted.append((result["booking_id"], row["employee_id"]))
+    await staff_promoted(schedule_id, promoted)
+    return [booking_id for booking_id, _ in promoted]
+
+@app.get("/schedules/{schedule_id}/capacity")
+async def read_schedule_capacity(schedule_id: int):
+    capacity = await slot_capacity(schedule_id)
+    rows = await database.fetch_all(
+        sqlalchemy.select([booking.c.status, sqlalchemy.func.sum(booking.c.participants_count).label("people"),
+                           sqlalchemy.func.count().label("bookings")])
+        .where(booking.c.schedule_id == schedule_id)
+        .group_by(booking.c.status)
+    )
+    booked = sum(row["people"] or 0 for row in rows if row["status"] not in INACTIVE_STATUSES)
+    waitlist = sum(row["bookings"] for row in rows if row["status"] == WAITLIST_STATUS)
+    return {
+        "schedule_id": schedule_id,
+        "capacity": capacity,
+        "booked": booked,
+        "available": None if capacity is None else max(capacity - booked, 0),
+        "waitlist": waitlist,
+    }
+
 @app.post("/bookings/", response_model=Booking)
-async def create_booking(booking_data: BookingCreate):
-    # Вставляем данные в таблицу booking
-    query = booking.insert().values(**booking_data.dict())
-    booking_id = await database.execute(query)
+async def create_booking(booking_data: BookingCreate,
+                         waitlist: bool = Query(True, description="Если мест нет, поставить бронь в лист ожидания"),
+                         user: TokenUser = Depends(current_user)):
+    check_client_access(user, booking_data.client_id)
+    if booking_data.status not in INITIAL_STATUSES:
+        raise HTTPException(status_code=400, detail=f"A booking cannot be created as '{booking_data.status}'")
+    if user.role == "client" and booking_data.status not in CLIENT_INITIAL_STATUSES:
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    values = booking_data.dict()
+    capacity = await slot_capacity(booking_data.schedule_id)
+    if capacity is not None and booking_data.participants_count > capacity:
+        raise HTTPException(status_code=400, detail=f"The room holds at most {capacity} participants")
+    if (booking_data.employee_id is not None and booking_data.status not in INACTIVE_STATUSES
+            and not await game_master_is_free(booking_data.employee_id, booking_data.schedule_id)):
+        raise HTTPException(status_code=409, detail="The game master is busy at this time")
+
+    if capacity is None or booking_data.status in INACTIVE_STATUSES:
+        booking_id = await database.execute(booking.insert().values(**values))
+    else:
+        inserted = await database.fetch_one(
+            "INSERT INTO booking (client_id, schedule_id, employee_id, status, participants_count)"
+            " SELECT :client_id, :schedule_id, :employee_id, :status, :participants_count"
+            f" WHERE {SLOT_HAS_ROOM} RETURNING booking_id",
+            {**values, "exclude_id": 0, "capacity": capacity, **INACTIVE_PARAMS},
+        )
+        if inserted:
+            booking_id = inserted["booking_id"]
+        elif not waitlist:
+            raise HTTPException(status_code=409, detail="No places left in this slot")
+        else:
+            booking_id = await database.execute(booking.insert().values(**{**values, "status": WAITLIST_STATUS}))
+            # Места могли освободиться, пока бронь вставала в очередь
+            await promote_waitlist(booking_data.schedule_id)
+
+    if booking_data.employee_id is None:
+        status = await database.fetch_val(sqlalchemy.select([booking.c.status]).where(booking.c.booking_id == booking_id))
+        if status not in INACTIVE_STATUSES:
+            await assign_game_master(booking_id, booking_data.schedule_id)
 
     # Получаем созданную запись
     created_booking = await database.fetch_one(
@@ -768,56 +2171,266 @@ async def create_booking(booking_data: BookingCreate):
 
     return created_booking
 
-@app.get("/bookings/", response_model=List[Booking])
-async def read_bookings():
-    query = booking.select()
+@app.post("/bookings/new-session", response_model=Booking)
+async def create_session_booking(booking_data: SessionBookingCreate, user: TokenUser = Depends(current_user)):
+    # Клиенты не создают сеансы сами: свободное время занимается только вместе
+    # с их бронью, одной транзакцией — без брони не остаётся и сеанса
+    check_client_access(user, booking_data.client_id)
+    duration = await database.fetch_val(
+        sqlalchemy.select([quest.c.duration]).where(quest.c.quest_id == booking_data.quest_id))
+    if duration is None:
+        raise HTTPException(status_code=404, detail="Quest not found")
+    if not await database.fetch_val(sqlalchemy.select([room.c.room_id]).where(room.c.room_id == booking_data.room_id)):
+        raise HTTPException(status_code=404, detail="Room not found")
+    end_time = (datetime.combine(booking_data.date, booking_data.start_time) + timedelta(minutes=duration)).time()
+    values = schedule_values({"quest_id": booking_data.quest_id, "room_id": booking_data.room_id,
+                              "date": booking_data.date, "start_time": booking_data.start_time,
+                              "end_time": end_time})
+    async with transaction():
+        schedule_id = await insert_schedule(values)
+        created_booking = await create_booking(BookingCreate(
+            client_id=booking_data.client_id, schedule_id=schedule_id, status=booking_data.status,
+            participants_count=booking_data.participants_count), waitlist=False, user=user)
+    await invalidate_occupancy(span_days(values["starts_at"], values["ends_at"]))
+    return created_booking
+
+@app.get("/bookings/", response_model=List[Booking], dependencies=[Depends(staff_user)])
+async def read_bookings(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                        ids: Optional[str] = Query(None, description=IDS_DESCRIPTION),
+                        status: Optional[BookingStatus] = Query(None),
+                        date_from: Optional[date] = Query(None, alias="from", description="Первый день сеанса, включительно"),
+                        date_to: Optional[date] = Query(None, alias="to", description="Последний день сеанса, включительно")):
+    columns = parse_fields(Booking, fields)
+    if status is None and date_from is None and date_to is None:
+        rows = await fetch_rows(booking, Booking, columns, parse_ids(ids))
+        return list_response(Booking, rows, columns)
+
+    # Индекс (status, schedule_date): без статуса перебираем все статусы через IN
+    conditions = [booking.c.status == status.value if status is not None
+                  else booking.c.status.in_([s.value for s in BookingStatus])]
+    if date_from is not None:
+        conditions.append(booking.c.schedule_date >= date_from)
+    if date_to is not None:
+        conditions.append(booking.c.schedule_date <= date_to)
+    rows = await fetch_rows(booking, Booking, columns, parse_ids(ids), sqlalchemy.and_(*conditions))
+    return list_response(Booking, rows, columns)
+
+@app.get("/bookings/status-counts", response_model=List[BookingStatusCount], dependencies=[Depends(staff_user)])
+async def read_booking_status_counts(
+        date_from: Optional[date] = Query(None, alias="from", description="Первый день сеанса, включительно"),
+        date_to: Optional[date] = Query(None, alias="to", description="Последний день сеанса, включительно")):
+    # Без периода — готовые счётчики booking_status_count; за период — подсчёт
+    # по индексу (status, schedule_date), не читая строки броней
+    if date_from is None and date_to is None:
+        rows = await database.fetch_all(booking_status_count.select())
+    else:
+        conditions = [booking.c.status.in_([s.value for s in BookingStatus])]
+        if date_from is not None:
+            conditions.append(booking.c.schedule_date >= date_from)
+        if date_to is not None:
+            conditions.append(booking.c.schedule_date <= date_to)
+        rows = await database.fetch_all(
+            sqlalchemy.select([booking.c.status, sqlalchemy.func.count().label("bookings")])
+            .where(sqlalchemy.and_(*conditions))
+            .group_by(booking.c.status)
+        )
+    counts = {row["status"]: row["bookings"] for row in rows}
+    return [{"status": s, "bookings": counts.get(s.value, 0)} for s in BookingStatus]
+
+@app.get("/bookings/outstanding", response_model=List[Booking], dependencies=[Depends(staff_user)])
+async def read_outstanding_bookings(after: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    # Брони с непогашенным остатком по частичному индексу ix_booking_outstanding:
+    # в нём только должники, страницы — по booking_id после after
+    query = (
+        booking.select()
+        .where(booking.c.balance > 0, booking.c.booking_id > after)
+        .order_by(booking.c.booking_id)
+        .limit(limit)
+    )
     return await database.fetch_all(query)
 
 @app.get("/bookings/{booking_id}", response_model=Booking)
-async def read_booking(booking_id: int):
+async def read_booking(booking_id: int, user: TokenUser = Depends(current_user)):
     query = booking.select().where(booking.c.booking_id == booking_id)
     result = await database.fetch_one(query)
     if not result:
         raise HTTPException(status_code=404, detail="Booking not found")
+    check_client_access(user, result["client_id"])
     return result
 
 @app.put("/bookings/{booking_id}", response_model=Booking)
-async def update_booking(booking_id: int, booking_data: BookingCreate):
-    query = (
-        booking.update()
-        .where(booking.c.booking_id == booking_id)
-        .values(**booking_data.dict())
-    )
-    await database.execute(query)
-    return {**booking_data.dict(), "booking_id": booking_id}
+async def update_booking(booking_id: int, booking_data: BookingCreate, user: TokenUser = Depends(current_user)):
+    current = await database.fetch_one(booking.select().where(booking.c.booking_id == booking_id))
+    if not current:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    # Клиент правит только свои брони и не передаёт их другим
+    check_client_access(user, current["client_id"])
+    check_client_access(user, booking_data.client_id)
+    if (booking_data.status != current["status"]
+            and booking_data.status not in BOOKING_TRANSITIONS[BookingStatus(current["status"])]):
+        raise HTTPException(status_code=409,
+                            detail=f"Cannot change booking status from '{current['status']}' to '{booking_data.status}'")
+    if user.role == "client" and booking_data.status != current["status"] and booking_data.status in STAFF_STATUSES:
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+    values = booking_data.dict()
+    capacity = await slot_capacity(booking_data.schedule_id)
+    # Мастера проверяем, только если его сменили или перенесли сеанс: старые брони
+    # не должны блокировать смену статуса
+    moved = (booking_data.employee_id, booking_data.schedule_id) != (current["employee_id"], current["schedule_id"])
+    if (moved and booking_data.employee_id is not None and booking_data.status not in INACTIVE_STATUSES
+            and not await game_master_is_free(booking_data.employee_id, booking_data.schedule_id)):
+        raise HTTPException(status_code=409, detail="The game master is busy at this time")
+
+    if capacity is None or booking_data.status in INACTIVE_STATUSES:
+        await database.execute(booking.update().where(booking.c.booking_id == booking_id).values(**values))
+    else:
+        updated = await database.fetch_one(
+            "UPDATE booking SET client_id = :client_id, schedule_id = :schedule_id, employee_id = :employee_id,"
+            " status = :status, participants_count = :participants_count"
+            f" WHERE booking_id = :exclude_id AND {SLOT_HAS_ROOM} RETURNING booking_id",
+            {**values, "exclude_id": booking_id, "capacity": capacity, **INACTIVE_PARAMS},
+        )
+        if not updated:
+            raise HTTPException(status_code=409, detail="No places left in this slot")
+
+    if booking_data.employee_id is None and booking_data.status not in INACTIVE_STATUSES:
+        await assign_game_master(booking_id, booking_data.schedule_id)
+
+    # Отмена, перенос или меньшая группа освобождают места в прежнем слоте
+    if current["status"] not in INACTIVE_STATUSES:
+        await promote_waitlist(current["schedule_id"])
+    return await database.fetch_one(booking.select().where(booking.c.booking_id == booking_id))
 
 @app.delete("/bookings/{booking_id}")
-async def delete_booking(booking_id: int):
-    query = booking.delete().where(booking.c.booking_id == booking_id)
-    await database.execute(query)
+async def delete_booking(booking_id: int, user: TokenUser = Depends(current_user)):
+    current = await database.fetch_one(booking.select().where(booking.c.booking_id == booking_id))
+    if current:
+        check_client_access(user, current["client_id"])
+    async with transaction():
+        await database.execute(booking_service.delete().where(booking_service.c.booking_id == booking_id))
+        await database.execute(booking.delete().where(booking.c.booking_id == booking_id))
+    if current and current["status"] not in INACTIVE_STATUSES:
+        await promote_waitlist(current["schedule_id"])
     return {"message": "Booking deleted successfully"}
 
+@app.post("/assignments/optimize", dependencies=[Depends(staff_user)])
+async def optimize_assignments(day: date, dry_run: bool = Query(False, description="Только рассчитать план")):
+    # Пересчёт мастеров на все сеансы дня: без пересечений и с выравниванием нагрузки.
+    # Сеансы, начатые накануне, не пересчитываются, но их мастера заняты
+    slots, current, fixed = {}, {}, {}
+    for schedule_id, start, end, employee_id in await day_sessions(day):
+        slots[schedule_id] = (schedule_id, start, end)
+        if employee_id is not None:
+            current.setdefault(schedule_id, employee_id)
+            if start < 0:
+                fixed.setdefault(schedule_id, employee_id)
+    plan, unassigned, load = plan_day(slots.values(), await game_masters(), current, fixed)
+    slots = {schedule_id: slot for schedule_id, slot in slots.items() if slot[1] >= 0}
+    plan = {schedule_id: employee_id for schedule_id, employee_id in plan.items() if schedule_id in slots}
+    unassigned = [schedule_id for schedule_id in unassigned if schedule_id in slots]
+
+    if not dry_run and slots:
+        # Все брони сеанса получают одного мастера; сеанс без мастера — NULL
+        async with transaction():
+            await database.execute_many(
+                "UPDATE booking SET employee_id = :employee_id"
+                f" WHERE schedule_id = :schedule_id AND status NOT IN ({INACTIVE_PLACEHOLDERS})",
+                [{"employee_id": plan.get(schedule_id), "schedule_id": schedule_id, **INACTIVE_PARAMS}
+                 for schedule_id in slots],
+            )
+    return {
+        "day": day,
+        "assigned": [{"schedule_id": schedule_id, "employee_id": employee_id}
+                     for schedule_id, employee_id in sorted(plan.items())],
+        "unassigned": sorted(unassigned),
+        "changed": sum(1 for schedule_id in slots if plan.get(schedule_id) != current.get(schedule_id)),
+        "load": [{"employee_id": employee_id, "minutes": total} for employee_id, total in sorted(load.items())],
+    }
+
+# Booking service routes
+async def booking_client(booking_id):
+    row = await database.fetch_one(
+        sqlalchemy.select([booking.c.client_id]).where(booking.c.booking_id == booking_id))
+    if not row:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    return row["client_id"]
+
+async def booking_services(booking_id):
+    return await database.fetch_all(
+        booking_service.select()
+        .where(booking_service.c.booking_id == booking_id)
+        .order_by(booking_service.c.service_id)
+    )
+
+@app.get("/booking-services/", response_model=List[BookingService], dependencies=[Depends(staff_user)])
+async def read_all_booking_services(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                                    ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(BookingService, fields)
+    rows = await fetch_rows(booking_service, BookingService, columns, parse_ids(ids))
+    return list_response(BookingService, rows, columns)
+
+@app.get("/bookings/{booking_id}/services", response_model=List[BookingService])
+async def read_booking_services(booking_id: int, user: TokenUser = Depends(current_user)):
+    check_client_access(user, await booking_client(booking_id))
+    return await booking_services(booking_id)
+
+@app.post("/bookings/{booking_id}/services", response_model=List[BookingService])
+async def change_booking_services(booking_id: int, changes: BookingServiceChanges,
+                                  user: TokenUser = Depends(current_user)):
+    # Добавление и удаление услуг брони одной транзакцией: либо всё, либо ничего
+    check_client_access(user, await booking_client(booking_id))
+    attach = {item.service_id: item.quantity for item in changes.attach}
+    detach = set(changes.detach)
+    if len(attach) != len(changes.attach) or attach.keys() & detach:
+        raise HTTPException(status_code=400, detail="Each service may appear only once")
+
+    async with transaction():
+        if attach:
+            prices = {row["service_id"]: row["price"] for row in await database.fetch_all(
+                sqlalchemy.select([service.c.service_id, service.c.price]).where(service.c.service_id.in_(list(attach))))}
+            unknown = sorted(attach.keys() - prices.keys())
+            if unknown:
+                raise HTTPException(status_code=404, detail=f"Unknown services: {', '.join(map(str, unknown))}")
+            # Без ON CONFLICT: он отменил бы INSERT OR REPLACE в триггерах change_log
+            attached = {row["service_id"] for row in await booking_services(booking_id)}
+            for service_id, quantity in attach.items():
+                if service_id in attached:
+                    await database.execute(booking_service.update().where(sqlalchemy.and_(
+                        booking_service.c.booking_id == booking_id, booking_service.c.service_id == service_id,
+                    )).values(quantity=quantity))
+                else:
+                    await database.execute(booking_service.insert().values(
+                        booking_id=booking_id, service_id=service_id, quantity=quantity, price=prices[service_id]))
+        if detach:
+            await database.execute(booking_service.delete().where(sqlalchemy.and_(
+                booking_service.c.booking_id == booking_id, booking_service.c.service_id.in_(list(detach)))))
+    return await booking_services(booking_id)
+
 # Payment routes
-@app.post("/payments/", response_model=Payment)
-async def create_payment(payment: PaymentCreate):
-    query = payment.insert().values(**payment.dict())
+@app.post("/payments/", response_model=Payment, dependencies=[Depends(staff_user)])
+async def create_payment(payment_data: PaymentCreate):
+    query = payment.insert().values(**payment_data.dict())
     last_record_id = await database.execute(query)
-    return {**payment.dict(), "payment_id": last_record_id}
+    return {**payment_data.dict(), "payment_id": last_record_id}
 
-@app.get("/payments/", response_model=List[Payment])
-async def read_payments():
-    query = payment.select()
-    return await database.fetch_all(query)
+@app.get("/payments/", response_model=List[Payment], dependencies=[Depends(staff_user)])
+async def read_payments(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                        ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Payment, fields)
+    rows = await fetch_rows(payment, Payment, columns, parse_ids(ids))
+    return list_response(Payment, rows, columns)
 
 @app.get("/payments/{payment_id}", response_model=Payment)
-async def read_payment(payment_id: int):
+async def read_payment(payment_id: int, user: TokenUser = Depends(current_user)):
     query = payment.select().where(payment.c.payment_id == payment_id)
     result = await database.fetch_one(query)
     if not result:
         raise HTTPException(status_code=404, detail="Payment not found")
+    check_client_access(user, await booking_client(result["booking_id"]))
     return result
 
-@app.put("/payments/{payment_id}", response_model=Payment)
+@app.put("/payments/{payment_id}", response_model=Payment, dependencies=[Depends(staff_user)])
 async def update_payment(payment_id: int, payment_data: PaymentCreate):
     query = (
         payment.update()
@@ -827,23 +2440,33 @@ async def update_payment(payment_id: int, payment_data: PaymentCreate):
     await database.execute(query)
     return {**payment_data.dict(), "payment_id": payment_id}
 
-@app.delete("/payments/{payment_id}")
+@app.delete("/payments/{payment_id}", dependencies=[Depends(staff_user)])
 async def delete_payment(payment_id: int):
     query = payment.delete().where(payment.c.payment_id == payment_id)
     await database.execute(query)
     return {"message": "Payment deleted successfully"}
 
 # Review routes
+async def review_client(review_id):
+    row = await database.fetch_one(
+        sqlalchemy.select([review.c.client_id]).where(review.c.review_id == review_id))
+    if not row:
+        raise HTTPException(status_code=404, detail="Review not found")
+    return row["client_id"]
+
 @app.post("/reviews/", response_model=Review)
-async def create_review(review: ReviewCreate):
-    query = review.insert().values(**review.dict())
+async def create_review(review_data: ReviewCreate, user: TokenUser = Depends(current_user)):
+    check_client_access(user, review_data.client_id)
+    query = review.insert().values(**review_data.dict())
     last_record_id = await database.execute(query)
-    return {**review.dict(), "review_id": last_record_id}
+    return {**review_data.dict(), "review_id": last_record_id}
 
 @app.get("/reviews/", response_model=List[Review])
-async def read_reviews():
-    query = review.select()
-    return await database.fetch_all(query)
+async def read_reviews(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                       ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Review, fields)
+    rows = await fetch_rows(review, Review, columns, parse_ids(ids))
+    return list_response(Review, rows, columns)
 
 @app.get("/reviews/{review_id}", response_model=Review)
 async def read_review(review_id: int):
@@ -854,7 +2477,10 @@ async def read_review(review_id: int):
     return result
 
 @app.put("/reviews/{review_id}", response_model=Review)
-async def update_review(review_id: int, review_data: ReviewCreate):
+async def update_review(review_id: int, review_data: ReviewCreate, user: TokenUser = Depends(current_user)):
+    # Клиент правит только свои отзывы и не подписывает их чужим именем
+    check_client_access(user, await review_client(review_id))
+    check_client_access(user, review_data.client_id)
     query = (
         review.update()
         .where(review.c.review_id == review_id)
@@ -864,13 +2490,14 @@ async def update_review(review_id: int, review_data: ReviewCreate):
     return {**review_data.dict(), "review_id": review_id}
 
 @app.delete("/reviews/{review_id}")
-async def delete_review(review_id: int):
+async def delete_review(review_id: int, user: TokenUser = Depends(current_user)):
+    check_client_access(user, await review_client(review_id))
     query = review.delete().where(review.c.review_id == review_id)
     await database.execute(query)
     return {"message": "Review deleted successfully"}
 
 # Service routes
-@app.post("/services/", response_model=Service)
+@app.post("/services/", response_model=Service, dependencies=[Depends(staff_user)])
 async def create_service(service_data: ServiceCreate):
     query = service.insert().values(**service_data.dict())
     last_record_id = await database.execute(query)
@@ -885,9 +2512,11 @@ async def create_service(service_data: ServiceCreate):
 
 
 @app.get("/services/", response_model=List[Service])
-async def read_services():
-    query = service.select()
-    return await database.fetch_all(query)
+async def read_services(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                        ids: Optional[str] = Query(None, description=IDS_DESCRIPTION)):
+    columns = parse_fields(Service, fields)
+    rows = await fetch_rows(service, Service, columns, parse_ids(ids))
+    return list_response(Service, rows, columns)
 
 @app.get("/services/{service_id}", response_model=Service)
 async def read_service(service_id: int):
@@ -897,7 +2526,7 @@ async def read_service(service_id: int):
         raise HTTPException(status_code=404, detail="Service not found")
     return result
 
-@app.put("/services/{service_id}", response_model=Service)
+@app.put("/services/{service_id}", response_model=Service, dependencies=[Depends(staff_user)])
 async def update_service(service_id: int, service_data: ServiceCreate):
     query = (
         service.update()
@@ -907,13 +2536,73 @@ async def update_service(service_id: int, service_data: ServiceCreate):
     await database.execute(query)
     return {**service_data.dict(), "service_id": service_id}
 
-@app.delete("/services/{service_id}")
+@app.delete("/services/{service_id}", dependencies=[Depends(staff_user)])
 async def delete_service(service_id: int):
+    # Оформленные брони ссылаются на услугу; проверка идёт по ix_booking_service_service
+    in_use = await database.fetch_val(
+        sqlalchemy.select([booking_service.c.booking_id]).where(booking_service.c.service_id == service_id).limit(1))
+    if in_use is not None:
+        raise HTTPException(status_code=409, detail="The service is attached to bookings")
     query = service.delete().where(service.c.service_id == service_id)
     await database.execute(query)
     return {"message": "Service deleted successfully"}
 
 
+async def run_command(command):
+    await database.connect()
+    try:
+        await ensure_schema()
+        if command == "seed":
+            await insert_initial_data()
+    finally:
+        await database.disconnect()
+
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, port=8000)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Black Rooms API")
+    parser.add_argument("command", nargs="?", default="serve", choices=["serve", "migrate", "seed", "calibrate"],
+                        help="serve — запустить сервер, migrate — обновить схему, seed — заполнить начальными данными, "
+                             "calibrate — подобрать стоимость хеширования паролей")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BLACKROOMS_WORKERS", "1")),
+                        help="Количество процессов uvicorn")
+    parser.add_argument("--target-ms", type=float, default=250,
+                        help="calibrate: допустимое время одной проверки пароля, мс")
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default="bcrypt",
+                        help="calibrate: схема хеширования (argon2 требует argon2-cffi)")
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        import password_policy
+
+        try:
+            cost, elapsed = password_policy.calibrate(args.scheme, args.target_ms)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+        password_policy.save_context(password_policy.build_context(args.scheme, cost), password_policy.POLICY_PATH)
+        print(f"{args.scheme}: rounds={cost}, проверка ~{elapsed:.0f} мс (цель {args.target_ms:.0f} мс)")
+        if elapsed > args.target_ms:
+            print("Минимальная стоимость дороже цели: стоимость ниже минимума не выставляется")
+        print(f"Политика сохранена в {password_policy.POLICY_PATH}; хеши обновятся при следующем входе")
+    elif args.command == "serve":
+        import uvicorn
+
+        if "BLACKROOMS_SECRET_KEY" not in os.environ:
+            print("BLACKROOMS_SECRET_KEY не задан: токены станут недействительны после перезапуска")
+
+        if args.workers > 1:
+            # Схему обновляем один раз до запуска воркеров, а не в каждом из них
+            asyncio.run(run_command("migrate"))
+            os.environ["BLACKROOMS_WORKERS"] = str(args.workers)
+            os.environ.setdefault("BLACKROOMS_SHARED_STATE", "sqlite:///./blackrooms_events.db")
+            # Воркеры импортируют main заново; общий ключ нужен, чтобы токен,
+            # выданный одним процессом, принимали остальные
+            os.environ.setdefault("BLACKROOMS_SECRET_KEY", SECRET_KEY)
+            uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+        else:
+            uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        asyncio.run(run_command(args.command))
\ No newline at end of file
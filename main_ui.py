@@ -1,16 +1,210 @@
+import base64
+import datetime
+import os
 import sys
+import threading
 import requests
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                                QLabel, QLineEdit, QPushButton, QStackedWidget, QTableWidget,
                                QTableWidgetItem, QMessageBox, QComboBox, QDateEdit, QTimeEdit,
                                QTabWidget, QFormLayout, QGroupBox, QCheckBox, QSpinBox, QTextEdit, QDialogButtonBox,
-                               QDialog)
-from PySide6.QtCore import Qt, QDate, QTime, QTimer
+                               QDialog, QTableView)
+from PySide6.QtCore import Qt, QDate, QTime, QTimer, QObject, Signal, QAbstractTableModel, QModelIndex
 from PySide6.QtGui import QPalette, QColor, QIntValidator
 
+from entity_store import EntityStore
+from local_replica import LocalReplica, ReplicaSync
+from schedule_cache import ScheduleCache
+from search_index import SearchIndex
+from token_auth import TokenAuth
+from write_queue import WriteQueue, error_message
+
 # Базовый URL вашего FastAPI сервера
 BASE_URL = "http://127.0.0.1:8000"
 
+# Одна сессия на всё приложение: keep-alive и сжатые ответы.
+# requests распаковывает gzip сам, brotli — если установлен пакет brotli.
+session = requests.Session()
+try:
+    import brotli  # noqa: F401
+    session.headers["Accept-Encoding"] = "br, gzip"
+except ImportError:
+    session.headers["Accept-Encoding"] = "gzip"
+# Токен доступа подставляется во все запросы сессии и обновляется сам
+token_auth = TokenAuth(BASE_URL)
+session.auth = token_auth
+
+
+# Статус брони, для которой в слоте не хватило мест (сервер ставит её в очередь)
+WAITLIST_STATUS = "Лист ожидания"
+CANCELLED_STATUS = "Отменен"
+# Смены статуса, которые принимает сервер (BOOKING_TRANSITIONS в main.py)
+NEXT_STATUSES = {
+    "На рассмотрение": ["Подтвержден", CANCELLED_STATUS],
+    "Подтвержден": ["Завершен", CANCELLED_STATUS],
+    WAITLIST_STATUS: ["На рассмотрение", CANCELLED_STATUS],
+}
+# Сводка на вкладке бронирований: статус -> подпись
+STATUS_SUMMARY = [("На рассмотрение", "На рассмотрении"), ("Подтвержден", "Подтверждено"),
+                  (CANCELLED_STATUS, "Отменено")]
+
+# Уровень доступа администратора (ADMIN_ACCESS_LEVEL в main.py): клиентов,
+# сотрудников и должности правит только он
+ADMIN_ACCESS_LEVEL = 3
+
+# Сколько id отправлять в одном запросе ?ids=, чтобы не упереться в длину URL
+ID_CHUNK_SIZE = 500
+
+
+def fields_params(fields):
+    # Сервер вернёт только перечисленные колонки
+    return {"fields": ",".join(fields)} if fields else {}
+
+
+def fetch_list(path, fields=None, ids=None):
+    if replica is not None and replica.ready:
+        # Реплика загружена: списки читаются локально, без сети
+        return replica.rows(path.strip("/"), fields, ids)
+
+    if ids is None:
+        response = session.get(f"{BASE_URL}{path}", params=fields_params(fields))
+        response.raise_for_status()
+        return response.json()
+
+    ids = sorted(set(i for i in ids if i is not None))
+    result = []
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        params = fields_params(fields)
+        params["ids"] = ",".join(str(i) for i in ids[start:start + ID_CHUNK_SIZE])
+        response = session.get(f"{BASE_URL}{path}", params=params)
+        response.raise_for_status()
+        result.extend(response.json())
+    return result
+
+
+def api_write(method, path, payload=None):
+    # С репликой запись без связи с сервером уходит в очередь
+    if replica_sync is not None:
+        return replica_sync.write(method, path, payload)
+    response = session.request(method, f"{BASE_URL}{path}", json=payload)
+    response.raise_for_status()
+    return True if method == "delete" else response.json()
+
+
+PRIMARY_KEYS = {
+    "positions": "position_id",
+    "employees": "employee_id",
+    "clients": "client_id",
+    "quests": "quest_id",
+    "rooms": "room_id",
+    "schedules": "schedule_id",
+    "bookings": "booking_id",
+    "payments": "payment_id",
+    "reviews": "review_id",
+    "services": "service_id",
+    "booking-services": "booking_service_id",
+}
+
+# Общее хранилище данных для всех окон клиента
+store = EntityStore(PRIMARY_KEYS)
+store.define_index("bookings", "by_schedule", lambda b: b.get("schedule_id"))
+store.define_index("bookings", "by_client", lambda b: b.get("client_id"))
+store.define_index("schedules", "by_room_date", lambda s: (s.get("room_id"), s.get("date")))
+store.define_index("booking-services", "by_booking", lambda s: s.get("booking_id"))
+
+# Локальная реплика: BLACKROOMS_REPLICA — путь к файлу SQLite. Без него
+# клиент, как раньше, читает всё напрямую с сервера.
+REPLICA_PATH = os.environ.get("BLACKROOMS_REPLICA")
+REPLICA_SYNC_INTERVAL = float(os.environ.get("BLACKROOMS_REPLICA_SYNC_INTERVAL", "2"))
+
+# Колонки, которые сервер пересчитывает триггерами: при отправке очереди
+# реплики их расхождение с сохранённой копией — не конфликт
+DERIVED_FIELDS = {
+    "bookings": ("quest_price", "total_due", "total_paid", "balance", "schedule_date"),
+}
+
+# Расписание лента читает из реплики диапазонами дней
+REPLICA_RANGE_FIELDS = {"schedules": "date"}
+
+replica = LocalReplica(REPLICA_PATH, PRIMARY_KEYS, DERIVED_FIELDS, REPLICA_RANGE_FIELDS) if REPLICA_PATH else None
+replica_sync = ReplicaSync(replica, session, BASE_URL) if replica is not None else None
+
+# Записи администратора: сразу в хранилище, на сервер — фоновым потоком
+# Статус брони сервер меняет только по допустимым переходам, поэтому смены
+# статуса уходят по одной, а не сливаются в одну
+write_queue = WriteQueue(store, api_write, create_paths={"clients": "/clients/register/"},
+                         ordered_fields={"bookings": ("status",)})
+
+
+# Задержка поиска после последнего нажатия клавиши
+SEARCH_DEBOUNCE_MS = 200
+# Задержка подбора комнаты после изменения формы брони
+ROOM_SUGGESTION_DEBOUNCE_MS = 150
+
+
+def debounced(parent, callback, interval=SEARCH_DEBOUNCE_MS):
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.setInterval(interval)
+    timer.timeout.connect(callback)
+    return timer
+
+
+def apply_row_filter(table, row_ids, matches):
+    # Строки таблицы скрываются, а не пересоздаются; matches=None — показать все
+    for row, row_id in enumerate(row_ids):
+        hidden = matches is not None and row_id not in matches
+        if table.isRowHidden(row) != hidden:
+            table.setRowHidden(row, hidden)
+
+
+def set_table_row(table, row, values):
+    for column, value in enumerate(values):
+        table.setItem(row, column, QTableWidgetItem(value))
+
+
+class TableBinding:
+    # Таблица окна следует за хранилищем: изменённые строки перерисовываются
+    # на месте, новые добавляются в конец, удалённые убираются. Полная замена
+    # ресурса (ids=None) остаётся за update_table самого окна.
+    def __init__(self, table, resource, get_ids, table_row, on_change, required=()):
+        # required — поля, без которых строку нельзя показать (например,
+        # брони, загруженные другим окном только с booking_id)
+        self.table = table
+        self.resource = resource
+        self.get_ids = get_ids
+        self.table_row = table_row
+        self.on_change = on_change
+        self.required = required
+        store.subscribe(self.on_store_change)
+        table.destroyed.connect(lambda: store.unsubscribe(self.on_store_change))
+
+    def on_store_change(self, resource, ids):
+        if resource != self.resource or ids is None:
+            return
+
+        row_ids = self.get_ids()
+        positions = {row_id: row for row, row_id in enumerate(row_ids)}
+        removed = []
+        for row_id in ids:
+            item = store.get(resource, row_id)
+            row = positions.get(row_id)
+            if row is not None:
+                if item is None:
+                    removed.append(row)
+                else:
+                    set_table_row(self.table, row, self.table_row(item))
+            elif item is not None and all(field in item for field in self.required):
+                row = self.table.rowCount()
+                self.table.insertRow(row)
+                set_table_row(self.table, row, self.table_row(item))
+                row_ids.append(row_id)
+
+        for row in sorted(removed, reverse=True):
+            self.table.removeRow(row)
+            del row_ids[row]
+        self.on_change()
+
 
 class DarkTheme:
     @staticmethod
@@ -45,11 +239,9 @@ class DarkTheme:
 
 class ApiClient:
     @staticmethod
-    def get_positions():
+    def get_positions(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/positions/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/positions/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching positions: {e}")
             return []
@@ -57,9 +249,7 @@ class ApiClient:
     @staticmethod
     def create_position(position_data):
         try:
-            response = requests.post(f"{BASE_URL}/positions/", json=position_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/positions/", position_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating position: {e}")
             return None
@@ -67,9 +257,7 @@ class ApiClient:
     @staticmethod
     def update_position(position_id, position_data):
         try:
-            response = requests.put(f"{BASE_URL}/positions/{position_id}", json=position_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/positions/{position_id}", position_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating position: {e}")
             return None
@@ -77,19 +265,16 @@ class ApiClient:
     @staticmethod
     def delete_position(position_id):
         try:
-            response = requests.delete(f"{BASE_URL}/positions/{position_id}")
-            response.raise_for_status()
+            api_write("delete", f"/positions/{position_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting position: {e}")
             return False
 
     @staticmethod
-    def get_clients():
+    def get_clients(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/clients/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/clients/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching clients: {e}")
             return []
@@ -97,7 +282,7 @@ class ApiClient:
     @staticmethod
     def get_client(client_id):
         try:
-            response = requests.get(f"{BASE_URL}/clients/{client_id}")
+            response = session.get(f"{BASE_URL}/clients/{client_id}")
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -107,17 +292,30 @@ class ApiClient:
     @staticmethod
     def register_client(client_data):
         try:
-            response = requests.post(f"{BASE_URL}/clients/register/", json=client_data)
+            response = session.post(f"{BASE_URL}/clients/register/", json=client_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error registering client: {e}")
             return None
 
+    @staticmethod
+    def login(login, password):
+        # {"role": "client" | "employee", "user_id": ..., "access_level": ...} или None
+        try:
+            return token_auth.login(login, password)
+        except requests.exceptions.RequestException as e:
+            print(f"Error logging in: {e}")
+            return None
+
+    @staticmethod
+    def logout():
+        token_auth.clear()
+
     @staticmethod
     def login_client(login_data):
         try:
-            response = requests.post(f"{BASE_URL}/clients/login/", json=login_data)
+            response = session.post(f"{BASE_URL}/clients/login/", json=login_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -127,7 +325,7 @@ class ApiClient:
     @staticmethod
     def update_client(client_id, client_data):
         try:
-            response = requests.put(
+            response = session.put(
                 f"{BASE_URL}/clients/{client_id}",
                 json=client_data
             )
@@ -153,8 +351,7 @@ class ApiClient:
     @staticmethod
     def delete_client(client_id):
         try:
-            response = requests.delete(f"{BASE_URL}/clients/{client_id}")
-            response.raise_for_status()
+            api_write("delete", f"/clients/{client_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting client: {e}")
@@ -163,12 +360,13 @@ class ApiClient:
     @staticmethod
     def change_password(client_id, old_password, new_password):
         try:
+            # Сервер меняет пароль пользователя из токена; client_id не передаётся
             data = {
-                "current_password": old_password,  # возможно, нужно "current_password" вместо "old_password"
+                "current_password": old_password,
                 "new_password": new_password
             }
 
-            response = requests.post(
+            response = session.post(
                 f"{BASE_URL}/auth/change-password",
                 json=data
             )
@@ -187,11 +385,9 @@ class ApiClient:
             return None
 
     @staticmethod
-    def get_employees():
+    def get_employees(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/employees/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/employees/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching employees: {e}")
             return []
@@ -199,9 +395,7 @@ class ApiClient:
     @staticmethod
     def create_employee(employee_data):
         try:
-            response = requests.post(f"{BASE_URL}/employees/", json=employee_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/employees/", employee_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating employee: {e}")
             return None
@@ -209,9 +403,7 @@ class ApiClient:
     @staticmethod
     def update_employee(employee_id, employee_data):
         try:
-            response = requests.put(f"{BASE_URL}/employees/{employee_id}", json=employee_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/employees/{employee_id}", employee_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating employee: {e}")
             return None
@@ -219,19 +411,16 @@ class ApiClient:
     @staticmethod
     def delete_employee(employee_id):
         try:
-            response = requests.delete(f"{BASE_URL}/employees/{employee_id}")
-            response.raise_for_status()
+            api_write("delete", f"/employees/{employee_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting employee: {e}")
             return False
 
     @staticmethod
-    def get_quests():
+    def get_quests(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/quests/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/quests/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching quests: {e}")
             return []
@@ -239,9 +428,7 @@ class ApiClient:
     @staticmethod
     def create_quest(quest_data):
         try:
-            response = requests.post(f"{BASE_URL}/quests/", json=quest_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/quests/", quest_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating quest: {e}")
             return None
@@ -249,9 +436,7 @@ class ApiClient:
     @staticmethod
     def update_quest(quest_id, quest_data):
         try:
-            response = requests.put(f"{BASE_URL}/quests/{quest_id}", json=quest_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/quests/{quest_id}", quest_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating quest: {e}")
             return None
@@ -259,19 +444,16 @@ class ApiClient:
     @staticmethod
     def delete_quest(quest_id):
         try:
-            response = requests.delete(f"{BASE_URL}/quests/{quest_id}")
-            response.raise_for_status()
+            api_write("delete", f"/quests/{quest_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting quest: {e}")
             return False
 
     @staticmethod
-    def get_rooms():
+    def get_rooms(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/rooms/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/rooms/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching rooms: {e}")
             return []
@@ -279,9 +461,7 @@ class ApiClient:
     @staticmethod
     def create_room(room_data):
         try:
-            response = requests.post(f"{BASE_URL}/rooms/", json=room_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/rooms/", room_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating room: {e}")
             return None
@@ -289,9 +469,7 @@ class ApiClient:
     @staticmethod
     def update_room(room_id, room_data):
         try:
-            response = requests.put(f"{BASE_URL}/rooms/{room_id}", json=room_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/rooms/{room_id}", room_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating room: {e}")
             return None
@@ -299,39 +477,128 @@ class ApiClient:
     @staticmethod
     def delete_room(room_id):
         try:
-            response = requests.delete(f"{BASE_URL}/rooms/{room_id}")
-            response.raise_for_status()
+            api_write("delete", f"/rooms/{room_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting room: {e}")
             return False
 
     @staticmethod
-    def get_schedules():
+    def get_schedules(fields=None, ids=None):
+        try:
+            return fetch_list("/schedules/", fields, ids)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching schedules: {e}")
+            return []
+
+    @staticmethod
+    def suggest_rooms(quest_id, date, time, participants):
+        # Комнаты и время для брони, лучшие первыми (date — YYYY-MM-DD, time — HH:mm)
         try:
-            response = requests.get(f"{BASE_URL}/schedules/")
+            response = session.get(f"{BASE_URL}/rooms/suggestions", params={
+                "quest_id": quest_id, "date": date, "time": time, "participants": participants})
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching room suggestions: {e}")
+            return None
+
+    @staticmethod
+    def get_availability(quest_id, date_from, date_to, participants):
+        # Сетка возможных начал квеста по комнатам за период (даты — YYYY-MM-DD)
+        try:
+            response = session.get(f"{BASE_URL}/availability/matrix", params={
+                "quest_id": quest_id, "from": date_from, "to": date_to, "participants": participants})
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching availability: {e}")
+            return None
+
+    @staticmethod
+    def get_booking_status_counts():
+        # Число броней в каждом статусе: [{"status", "bookings"}]
+        try:
+            response = session.get(f"{BASE_URL}/bookings/status-counts")
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching booking status counts: {e}")
+            return None
+
+    @staticmethod
+    def optimize_assignments(day):
+        # Пересчёт игровых мастеров на все сеансы дня (строка YYYY-MM-DD)
+        try:
+            response = session.post(f"{BASE_URL}/assignments/optimize", params={"day": day})
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error optimizing assignments: {error_message(e)}")
+            return None
+
+    @staticmethod
+    def get_client_bookings(client_id, limit, offset=0):
+        # Страница истории бронирований: {"total", "limit", "offset", "items"}, новые сначала
+        try:
+            response = session.get(f"{BASE_URL}/clients/{client_id}/bookings",
+                                   params={"limit": limit, "offset": offset})
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching client bookings: {e}")
+            return None
+
+    @staticmethod
+    def get_schedule_range(date_from, date_to, room_id=None):
+        # Расписания за дни date_from..date_to (строки YYYY-MM-DD) включительно
+        try:
+            if replica is not None and replica.ready:
+                return [s for s in replica.rows_between("schedules", date_from, date_to, room_id=room_id)
+                        if s["room_id"] is not None]
+            params = {"from": date_from, "to": date_to}
+            if room_id is not None:
+                params["room_id"] = room_id
+            response = session.get(f"{BASE_URL}/schedules/", params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error fetching schedules: {e}")
-            return []
+            return None
 
     @staticmethod
-    def create_schedule(schedule_data):
+    def preview_schedule_template(template_data):
         try:
-            response = requests.post(f"{BASE_URL}/schedules/", json=schedule_data)
+            response = session.post(f"{BASE_URL}/schedule-templates/preview", json=template_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error creating schedule: {e}")
+            print(f"Error previewing schedule template: {error_message(e)}")
             return None
 
     @staticmethod
-    def update_schedule(schedule_id, schedule_data):
+    def create_schedule_template(template_data, skip_conflicts=False):
         try:
-            response = requests.put(f"{BASE_URL}/schedules/{schedule_id}", json=schedule_data)
+            response = session.post(f"{BASE_URL}/schedule-templates/", json=template_data,
+                                    params={"skip_conflicts": "true" if skip_conflicts else "false"})
             response.raise_for_status()
             return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error creating schedule template: {error_message(e)}")
+            return None
+
+    @staticmethod
+    def create_schedule(schedule_data):
+        try:
+            return api_write("post", f"/schedules/", schedule_data)
+        except requests.exceptions.RequestException as e:
+            print(f"Error creating schedule: {e}")
+            return None
+
+    @staticmethod
+    def update_schedule(schedule_id, schedule_data):
+        try:
+            return api_write("put", f"/schedules/{schedule_id}", schedule_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating schedule: {e}")
             return None
@@ -339,19 +606,16 @@ class ApiClient:
     @staticmethod
     def delete_schedule(schedule_id):
         try:
-            response = requests.delete(f"{BASE_URL}/schedules/{schedule_id}")
-            response.raise_for_status()
+            api_write("delete", f"/schedules/{schedule_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting schedule: {e}")
             return False
 
     @staticmethod
-    def get_bookings():
+    def get_bookings(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/bookings/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/bookings/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching bookings: {e}")
             return []
@@ -359,19 +623,26 @@ class ApiClient:
     @staticmethod
     def create_booking(booking_data):
         try:
-            response = requests.post(f"{BASE_URL}/bookings/", json=booking_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/bookings/", booking_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating booking: {e}")
             return None
 
     @staticmethod
-    def update_booking(booking_id, booking_data):
+    def create_session_booking(booking_data):
+        # Новый сеанс вместе с бронью на него — сеансы сами по себе создают только сотрудники
         try:
-            response = requests.put(f"{BASE_URL}/bookings/{booking_id}", json=booking_data)
+            response = session.post(f"{BASE_URL}/bookings/new-session", json=booking_data)
             response.raise_for_status()
             return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error creating booking: {error_message(e)}")
+            return None
+
+    @staticmethod
+    def update_booking(booking_id, booking_data):
+        try:
+            return api_write("put", f"/bookings/{booking_id}", booking_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating booking: {e}")
             return None
@@ -379,19 +650,16 @@ class ApiClient:
     @staticmethod
     def delete_booking(booking_id):
         try:
-            response = requests.delete(f"{BASE_URL}/bookings/{booking_id}")
-            response.raise_for_status()
+            api_write("delete", f"/bookings/{booking_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting booking: {e}")
             return False
 
     @staticmethod
-    def get_payments():
+    def get_payments(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/payments/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/payments/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching payments: {e}")
             return []
@@ -399,9 +667,7 @@ class ApiClient:
     @staticmethod
     def create_payment(payment_data):
         try:
-            response = requests.post(f"{BASE_URL}/payments/", json=payment_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/payments/", payment_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating payment: {e}")
             return None
@@ -409,9 +675,7 @@ class ApiClient:
     @staticmethod
     def update_payment(payment_id, payment_data):
         try:
-            response = requests.put(f"{BASE_URL}/payments/{payment_id}", json=payment_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/payments/{payment_id}", payment_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating payment: {e}")
             return None
@@ -419,19 +683,16 @@ class ApiClient:
     @staticmethod
     def delete_payment(payment_id):
         try:
-            response = requests.delete(f"{BASE_URL}/payments/{payment_id}")
-            response.raise_for_status()
+            api_write("delete", f"/payments/{payment_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting payment: {e}")
             return False
 
     @staticmethod
-    def get_reviews():
+    def get_reviews(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/reviews/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/reviews/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching reviews: {e}")
             return []
@@ -439,9 +700,7 @@ class ApiClient:
     @staticmethod
     def create_review(review_data):
         try:
-            response = requests.post(f"{BASE_URL}/reviews/", json=review_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/reviews/", review_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating review: {e}")
             return None
@@ -449,9 +708,7 @@ class ApiClient:
     @staticmethod
     def update_review(review_id, review_data):
         try:
-            response = requests.put(f"{BASE_URL}/reviews/{review_id}", json=review_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/reviews/{review_id}", review_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating review: {e}")
             return None
@@ -459,19 +716,16 @@ class ApiClient:
     @staticmethod
     def delete_review(review_id):
         try:
-            response = requests.delete(f"{BASE_URL}/reviews/{review_id}")
-            response.raise_for_status()
+            api_write("delete", f"/reviews/{review_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting review: {e}")
             return False
 
     @staticmethod
-    def get_services():
+    def get_services(fields=None, ids=None):
         try:
-            response = requests.get(f"{BASE_URL}/services/")
-            response.raise_for_status()
-            return response.json()
+            return fetch_list("/services/", fields, ids)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching services: {e}")
             return []
@@ -479,9 +733,7 @@ class ApiClient:
     @staticmethod
     def create_service(service_data):
         try:
-            response = requests.post(f"{BASE_URL}/services/", json=service_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("post", f"/services/", service_data)
         except requests.exceptions.RequestException as e:
             print(f"Error creating service: {e}")
             return None
@@ -489,9 +741,7 @@ class ApiClient:
     @staticmethod
     def update_service(service_id, service_data):
         try:
-            response = requests.put(f"{BASE_URL}/services/{service_id}", json=service_data)
-            response.raise_for_status()
-            return response.json()
+            return api_write("put", f"/services/{service_id}", service_data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating service: {e}")
             return None
@@ -499,13 +749,52 @@ class ApiClient:
     @staticmethod
     def delete_service(service_id):
         try:
-            response = requests.delete(f"{BASE_URL}/services/{service_id}")
-            response.raise_for_status()
+            api_write("delete", f"/services/{service_id}")
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error deleting service: {e}")
             return False
 
+    @staticmethod
+    def change_booking_services(booking_id, attach, detach=()):
+        # Услуги брони одной транзакцией на сервере; attach — {service_id: количество}.
+        # Только онлайн: без связи бронь создать тоже нельзя
+        try:
+            response = session.post(f"{BASE_URL}/bookings/{booking_id}/services", json={
+                "attach": [{"service_id": service_id, "quantity": quantity} for service_id, quantity in attach.items()],
+                "detach": list(detach),
+            })
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error changing booking services: {error_message(e)}")
+            return None
+
+class ReplicaSyncWorker(QObject):
+    # Синхронизация реплики идёт в отдельном потоке, а изменения приходят
+    # в поток интерфейса сигналом
+    synced = Signal(object)
+
+    def __init__(self, sync, interval):
+        super().__init__()
+        self.sync = sync
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            result = self.sync.sync()
+            if result["changes"] or result["conflicts"]:
+                self.synced.emit(result)
+            self._stopped.wait(self.interval)
+
+
 class LoginWindow(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -729,7 +1018,10 @@ class QuestListWindow(QWidget):
         self.book_button = QPushButton("Забронировать")
         self.book_button.setStyleSheet("background-color: #2a82da; padding: 8px;")
 
-        self.search_input.textChanged.connect(self.filter_quests)
+        self.search_index = SearchIndex(self.search_fields)
+        self.search_index.attach(store, "quests")
+        self.search_timer = debounced(self, self.filter_quests)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
 
         layout.addWidget(self.title_label)
         layout.addWidget(self.search_input)
@@ -741,31 +1033,16 @@ class QuestListWindow(QWidget):
         # Загружаем квесты с сервера
         self.load_quests()
 
-    def filter_quests(self):
-        search_text = self.search_input.text().lower()
-        quests = ApiClient.get_quests()
-
-        if not search_text:
-            self.load_quests()
-            return
-
-        filtered = [q for q in quests if
-                    search_text in q["title"].lower() or
-                    search_text in q["description"].lower() or
-                    search_text in str(q["difficulty"]) or
-                    search_text in str(q["duration"]) or
-                    search_text in str(q["price"])]
+    def search_fields(self, quest):
+        return [quest.get("title"), quest.get("description"), quest.get("difficulty"),
+                quest.get("duration"), quest.get("price")]
 
-        self.quests_table.setRowCount(len(filtered))
-        for row, quest in enumerate(filtered):
-            self.quests_table.setItem(row, 0, QTableWidgetItem(quest["title"]))
-            self.quests_table.setItem(row, 1, QTableWidgetItem(quest["description"]))
-            self.quests_table.setItem(row, 2, QTableWidgetItem(str(quest["difficulty"])))
-            self.quests_table.setItem(row, 3, QTableWidgetItem(f"{quest['duration']} мин"))
-            self.quests_table.setItem(row, 4, QTableWidgetItem(f"{quest['price']} руб"))
+    def filter_quests(self):
+        apply_row_filter(self.quests_table, self.quest_ids, self.search_index.search(self.search_input.text()))
 
     def load_quests(self):
-        quests = ApiClient.get_quests()
+        self.quest_ids = store.replace("quests", ApiClient.get_quests())
+        quests = store.get_many("quests", self.quest_ids)
 
         self.quests_table.setRowCount(len(quests))
         for row, quest in enumerate(quests):
@@ -779,6 +1056,85 @@ class QuestListWindow(QWidget):
         self.quests_table.resizeColumnsToContents()
         # Добавляем немного отступа
         self.quests_table.horizontalHeader().setStretchLastSection(True)
+        self.filter_quests()
+
+
+def free_room_counts(matrix):
+    # Маски начал из /availability/matrix -> [день][клетка] = число комнат, где
+    # квест может начаться. День — bytes_per_day байт little-endian, бит i — клетка i
+    days = (datetime.date.fromisoformat(matrix["to"]) - datetime.date.fromisoformat(matrix["from"])).days + 1
+    per_day = matrix["bytes_per_day"]
+    counts = [[0] * matrix["cells"] for _ in range(days)]
+    for room in matrix["rooms"]:
+        data = base64.b64decode(room["starts"])
+        for day in range(days):
+            mask = int.from_bytes(data[day * per_day:(day + 1) * per_day], "little")
+            while mask:
+                low = mask & -mask
+                counts[day][low.bit_length() - 1] += 1
+                mask ^= low
+    return counts
+
+
+class AvailabilityModel(QAbstractTableModel):
+    # Строки — дни, столбцы — клетки по step_minutes от открытия; цвет клетки —
+    # сколько комнат свободно для начала квеста
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.first_day = None
+        self.opening = 0
+        self.step = 1
+        self.counts = []
+        self.rooms = 1
+
+    def set_matrix(self, matrix):
+        self.beginResetModel()
+        if matrix:
+            self.first_day = datetime.date.fromisoformat(matrix["from"])
+            opening = datetime.time.fromisoformat(matrix["opening"])
+            self.opening = opening.hour * 60 + opening.minute
+            self.step = matrix["step_minutes"]
+            self.counts = free_room_counts(matrix)
+            self.rooms = max(len(matrix["rooms"]), 1)
+        else:
+            self.counts = []
+        self.endResetModel()
+
+    def day(self, row):
+        return self.first_day + datetime.timedelta(days=row)
+
+    def cell_time(self, column):
+        start = self.opening + column * self.step
+        return QTime(start // 60, start % 60)
+
+    def free(self, index):
+        return self.counts[index.row()][index.column()]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.counts)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() or not self.counts else len(self.counts[0])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Vertical:
+            day = self.day(section)
+            return f"{WEEKDAYS[day.weekday()]} {day.strftime('%d.%m')}"
+        # Подпись только у начала часа, чтобы столбцы оставались узкими
+        start = self.cell_time(section)
+        return start.toString("HH") if start.minute() == 0 else ""
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        free = self.free(index)
+        if role == Qt.BackgroundRole:
+            return QColor(40, 90 + 130 * free // self.rooms, 60) if free else QColor(60, 60, 60)
+        if role == Qt.ToolTipRole and free:
+            return f"{self.cell_time(index.column()).toString('HH:mm')}: свободно комнат — {free}"
+        return None
 
 
 class BookingWindow(QWidget):
@@ -797,17 +1153,17 @@ class BookingWindow(QWidget):
 
         # Выбор квеста
         self.quest_combo = QComboBox()
-        quests = ApiClient.get_quests()
+        quests = ApiClient.get_quests(fields=["quest_id", "title", "duration"])
+        store.upsert("quests", quests)
         for quest in quests:
             self.quest_combo.addItem(quest["title"], quest["quest_id"])
 
-        # Выбор комнаты
+        # Комнату и точное время подбирает сервер под квест, время и размер группы
         self.room_combo = QComboBox()
-        rooms = ApiClient.get_rooms()
-        for room in rooms:
-            if room["is_available"]:
-                self.room_combo.addItem(f"{room['title']} ({room['type']}, до {room['capacity']} чел.)",
-                                        room["room_id"])
+        self.suggestions = []
+        store.upsert("rooms", ApiClient.get_rooms())
+        self.suggestion_label = QLabel()
+        self.suggestion_label.setWordWrap(True)
 
         # Выбор даты и времени
         self.date_input = QDateEdit()
@@ -828,7 +1184,7 @@ class BookingWindow(QWidget):
         self.services_group = QGroupBox("Дополнительные услуги")
         services_layout = QVBoxLayout()
 
-        services = ApiClient.get_services()
+        services = ApiClient.get_services(fields=["service_id", "title", "price"])
         self.service_checkboxes = []
         for service in services:
             cb = QCheckBox(f"{service['title']} (+{service['price']} руб)")
@@ -844,38 +1200,132 @@ class BookingWindow(QWidget):
         self.confirm_button.clicked.connect(self.create_booking)
 
         form_layout.addRow("Квест:", self.quest_combo)
-        form_layout.addRow("Комната:", self.room_combo)
         form_layout.addRow("Дата:", self.date_input)
         form_layout.addRow("Время:", self.time_input)
         form_layout.addRow("Количество участников:", self.participants_input)
+        form_layout.addRow("Комната:", self.room_combo)
+        form_layout.addRow("", self.suggestion_label)
+
+        # Свободное время на месяц выбранной даты; клик выбирает день и время
+        self.availability_model = AvailabilityModel(self)
+        self.availability_view = QTableView()
+        self.availability_view.setModel(self.availability_model)
+        self.availability_view.setEditTriggers(QTableView.NoEditTriggers)
+        self.availability_view.horizontalHeader().setMinimumSectionSize(10)
+        self.availability_view.horizontalHeader().setDefaultSectionSize(14)
+        self.availability_view.verticalHeader().setDefaultSectionSize(18)
+        self.availability_view.setMinimumHeight(240)
+        self.availability_view.clicked.connect(self.select_slot)
+        self.availability_key = None
+
+        self.suggestion_timer = debounced(self, self.update_suggestions, ROOM_SUGGESTION_DEBOUNCE_MS)
+        self.quest_combo.currentIndexChanged.connect(lambda: self.suggestion_timer.start())
+        self.date_input.dateChanged.connect(lambda: self.suggestion_timer.start())
+        self.time_input.timeChanged.connect(lambda: self.suggestion_timer.start())
+        self.participants_input.valueChanged.connect(lambda: self.suggestion_timer.start())
+        self.room_combo.currentIndexChanged.connect(self.show_suggestion)
 
         layout.addWidget(self.title_label)
         layout.addLayout(form_layout)
+        layout.addWidget(QLabel("Свободное время (клик выбирает дату и время):"))
+        layout.addWidget(self.availability_view)
         layout.addWidget(self.services_group)
         layout.addWidget(self.confirm_button)
         layout.addStretch()
 
         self.setLayout(layout)
+        self.update_suggestions()
+
+    def update_availability(self, force=False):
+        # Сетка перезагружается, только если сменились квест, размер группы или месяц
+        quest_id = self.quest_combo.currentData()
+        day = self.date_input.date()
+        key = (quest_id, self.participants_input.value(), day.year(), day.month())
+        if key == self.availability_key and not force:
+            return
+        self.availability_key = key
+        matrix = None
+        if quest_id is not None:
+            first = QDate(day.year(), day.month(), 1)
+            matrix = ApiClient.get_availability(quest_id, first.toString("yyyy-MM-dd"),
+                                                first.addMonths(1).addDays(-1).toString("yyyy-MM-dd"),
+                                                self.participants_input.value())
+        self.availability_model.set_matrix(matrix)
+
+    def select_slot(self, index):
+        # Смена даты и времени запустит подбор комнаты через таймер
+        if not self.availability_model.free(index):
+            return
+        day = self.availability_model.day(index.row())
+        self.date_input.setDate(QDate(day.year, day.month, day.day))
+        self.time_input.setTime(self.availability_model.cell_time(index.column()))
+
+    def update_suggestions(self):
+        self.update_availability()
+        quest_id = self.quest_combo.currentData()
+        suggestions = None
+        if quest_id is not None:
+            suggestions = ApiClient.suggest_rooms(quest_id, self.date_input.date().toString("yyyy-MM-dd"),
+                                                  self.time_input.time().toString("HH:mm"),
+                                                  self.participants_input.value())
+        self.suggestions = suggestions or []
+
+        self.room_combo.blockSignals(True)
+        self.room_combo.clear()
+        for index, suggestion in enumerate(self.suggestions):
+            room = store.get("rooms", suggestion["room_id"], {})
+            kind = f"{room['type']}, " if room.get("type") else ""
+            self.room_combo.addItem(
+                f"{suggestion['room_title']} ({kind}до {suggestion['capacity']} чел.) — "
+                f"{suggestion['start_time'][:5]}–{suggestion['end_time'][:5]}", index)
+        self.room_combo.blockSignals(False)
+        self.confirm_button.setEnabled(bool(self.suggestions))
+        if suggestions is None and quest_id is not None:
+            self.suggestion_label.setText("Не удалось подобрать комнату")
+        else:
+            self.show_suggestion()
+
+    def show_suggestion(self):
+        suggestion = self.selected_suggestion()
+        if suggestion is None:
+            self.suggestion_label.setText("На этот день нет комнаты для группы такого размера")
+            return
+        parts = []
+        if suggestion["shift_minutes"]:
+            parts.append(f"Ближайшее свободное время — {suggestion['start_time'][:5]}")
+        if suggestion["schedule_id"] is not None:
+            parts.append("Вы присоединитесь к уже запланированной игре")
+        self.suggestion_label.setText(". ".join(parts))
+
+    def selected_suggestion(self):
+        index = self.room_combo.currentData()
+        return self.suggestions[index] if index is not None else None
 
     def create_booking(self):
         if not self.client_id:
             QMessageBox.warning(self, "Ошибка", "Необходимо войти в систему")
             return
 
-        # Получаем выбранные параметры
+        suggestion = self.selected_suggestion()
+        if suggestion is None:
+            QMessageBox.warning(self, "Ошибка", "Нет подходящей комнаты: измените дату, время или число участников")
+            return
+
+        # Получаем выбранные параметры; время — подобранное сервером
         quest_id = self.quest_combo.currentData()
-        room_id = self.room_combo.currentData()
+        room_id = suggestion["room_id"]
         date = self.date_input.date().toString("yyyy-MM-dd")
-        time = self.time_input.time().toString("HH:mm")
+        time = suggestion["start_time"][:5]
 
-        # Проверяем доступность комнаты
-        rooms = ApiClient.get_rooms()
-        room = next((r for r in rooms if r["room_id"] == room_id), None)
+        # Проверяем доступность комнаты по свежим данным
+        store.upsert("rooms", ApiClient.get_rooms(ids=[room_id]))
+        room = store.get("rooms", room_id)
         if not room or not room["is_available"]:
             QMessageBox.warning(self, "Ошибка", "Выбранная комната недоступна")
             return
 
-        # Проверяем количество участников
+        # Группа больше комнаты не поместится никогда; свободные места
+        # в слоте проверяет сервер при создании брони
         participants = self.participants_input.value()
         if participants > room["capacity"]:
             QMessageBox.warning(
@@ -885,56 +1335,108 @@ class BookingWindow(QWidget):
             )
             return
 
-        # Создаем новое расписание
-        schedule_data = {
-            "quest_id": quest_id,
-            "room_id": room_id,
-            "date": date,
-            "start_time": time,
-            "end_time": self.calculate_end_time(quest_id, time)
-        }
-
-        schedule = ApiClient.create_schedule(schedule_data)
-        if not schedule:
-            QMessageBox.warning(self, "Ошибка", "Не удалось создать расписание")
-            return
-
-        # Создаем бронирование
+        # Игрового мастера назначает сервер
         booking_data = {
             "client_id": self.client_id,
-            "schedule_id": schedule["schedule_id"],
-            "employee_id": 1,
             "status": "На рассмотрение",
             "participants_count": participants
         }
-
-        booking = ApiClient.create_booking(booking_data)
+        if suggestion["schedule_id"] is not None:
+            # Присоединяемся к существующему сеансу того же квеста
+            booking = ApiClient.create_booking({**booking_data, "schedule_id": suggestion["schedule_id"]})
+        else:
+            # Новый сеанс сервер создаёт вместе с бронью
+            booking = ApiClient.create_session_booking(
+                {**booking_data, "quest_id": quest_id, "room_id": room_id, "date": date, "start_time": time})
         if not booking:
             QMessageBox.warning(self, "Ошибка", "Не удалось создать бронирование")
             return
+        waitlisted = booking["status"] == WAITLIST_STATUS
+
+        # Добавляем выбранные услуги одним запросом
+        selected_services = {cb.service_id: 1 for cb in self.service_checkboxes if cb.isChecked()}
+        if selected_services:
+            attached = ApiClient.change_booking_services(booking["booking_id"], selected_services)
+            if attached is None:
+                QMessageBox.warning(self, "Ошибка", "Бронирование создано, но не удалось добавить услуги")
+            else:
+                store.upsert("booking-services", attached)
 
-        # Добавляем выбранные услуги
-        selected_services = [cb.service_id for cb in self.service_checkboxes if cb.isChecked()]
-        for service_id in selected_services:
-            service_data = {
-                "service_id": service_id,
-                "booking_id": booking["booking_id"]
-            }
-            ApiClient.update_service(service_id, service_data)
-
-        QMessageBox.information(self, "Успех", "Бронирование успешно создано!")
+        if waitlisted:
+            QMessageBox.information(self, "Лист ожидания",
+                                    "Все места на это время заняты. Бронирование добавлено в лист ожидания "
+                                    "и будет подтверждено, если места освободятся.")
+        else:
+            QMessageBox.information(self, "Успех", "Бронирование успешно создано!")
+        # Время занято этой бронью — следующий подбор должен это учесть
+        self.update_availability(force=True)
+        self.update_suggestions()
         self.parent().stacked_widget.setCurrentIndex(0)  # Возвращаемся к списку квестов
 
-    def calculate_end_time(self, quest_id, start_time):
-        quests = ApiClient.get_quests()
-        quest = next((q for q in quests if q["quest_id"] == quest_id), None)
-        if not quest:
-            return start_time
 
-        duration = quest["duration"]
-        start = QTime.fromString(start_time, "HH:mm")
-        end = start.addSecs(duration * 60)
-        return end.toString("HH:mm")
+class ClientBookingsWindow(QWidget):
+    PAGE_SIZE = 20
+
+    def __init__(self, client_id, parent=None):
+        super().__init__(parent)
+        self.client_id = client_id
+        self.offset = 0
+        self.total = 0
+
+        layout = QVBoxLayout()
+
+        self.title_label = QLabel("Мои бронирования")
+        self.title_label.setStyleSheet("font-size: 18px; font-weight: bold;")
+
+        self.bookings_table = QTableWidget()
+        self.bookings_table.setColumnCount(8)
+        self.bookings_table.setHorizontalHeaderLabels(
+            ["Дата", "Время", "Квест", "Комната", "Участников", "Статус", "Оплачено", "К доплате"])
+        self.bookings_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.bookings_table.horizontalHeader().setStretchLastSection(True)
+
+        pages_layout = QHBoxLayout()
+        self.prev_button = QPushButton("Назад")
+        self.prev_button.clicked.connect(lambda: self.load_page(self.offset - self.PAGE_SIZE))
+        self.page_label = QLabel()
+        self.next_button = QPushButton("Вперёд")
+        self.next_button.clicked.connect(lambda: self.load_page(self.offset + self.PAGE_SIZE))
+        pages_layout.addWidget(self.prev_button)
+        pages_layout.addStretch()
+        pages_layout.addWidget(self.page_label)
+        pages_layout.addStretch()
+        pages_layout.addWidget(self.next_button)
+
+        layout.addWidget(self.title_label)
+        layout.addWidget(self.bookings_table)
+        layout.addLayout(pages_layout)
+        self.setLayout(layout)
+
+    def load_page(self, offset=0):
+        page = ApiClient.get_client_bookings(self.client_id, self.PAGE_SIZE, max(offset, 0))
+        if page is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось загрузить бронирования")
+            return
+        self.offset, self.total = page["offset"], page["total"]
+
+        items = page["items"]
+        self.bookings_table.setRowCount(len(items))
+        for row, item in enumerate(items):
+            start = (item["start_time"] or "")[:5]
+            end = (item["end_time"] or "")[:5]
+            paid = f"{item['paid']} руб из {item['total_due']} руб"
+            values = [item["date"] or "—", f"{start}–{end}" if start else "—",
+                      item["quest_title"] or "—", item["room_title"] or "—",
+                      str(item["participants_count"]), item["status"], paid,
+                      f"{max(item['balance'], 0)} руб"]
+            for column, value in enumerate(values):
+                self.bookings_table.setItem(row, column, QTableWidgetItem(value))
+        self.bookings_table.resizeColumnsToContents()
+
+        pages = max((self.total + self.PAGE_SIZE - 1) // self.PAGE_SIZE, 1)
+        self.page_label.setText(f"Страница {self.offset // self.PAGE_SIZE + 1} из {pages}")
+        self.prev_button.setEnabled(self.offset > 0)
+        self.next_button.setEnabled(self.offset + self.PAGE_SIZE < self.total)
 
 
 class AdminBookingsWindow(QWidget):
@@ -946,18 +1448,32 @@ class AdminBookingsWindow(QWidget):
         self.title_label = QLabel("Управление бронированиями")
         self.title_label.setStyleSheet("font-size: 18px; font-weight: bold;")
 
+        # Счётчики статусов сервер ведёт сам; обновляем после изменений броней
+        self.status_counts_label = QLabel()
+        self.status_counts_timer = debounced(self, self.update_status_counts)
+        store.subscribe(self.on_store_change)
+        self.destroyed.connect(lambda: store.unsubscribe(self.on_store_change))
+
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Поиск бронирований...")
-        self.search_input.textChanged.connect(self.filter_bookings)
+        self.search_index = SearchIndex(self.booking_row)
+        self.search_index.attach(store, "bookings", depends=("schedules", "clients", "quests", "rooms", "employees"))
+        self.search_timer = debounced(self, self.filter_bookings)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
 
         self.bookings_table = QTableWidget()
-        self.bookings_table.setColumnCount(8)
+        self.bookings_table.setColumnCount(10)
         self.bookings_table.setHorizontalHeaderLabels(
-            ["ID", "Клиент", "Квест", "Комната", "Дата", "Время", "Участники", "Статус"])
+            ["ID", "Клиент", "Квест", "Комната", "Дата", "Время", "Участники", "Мастер", "Статус", "Остаток"])
         self.bookings_table.horizontalHeader().setStretchLastSection(True)
         self.bookings_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.bookings_table.setSelectionMode(QTableWidget.SingleSelection)
 
+        self.booking_ids = []
+        self.table_binding = TableBinding(self.bookings_table, "bookings", lambda: self.booking_ids,
+                                          self.booking_row, self.filter_bookings,
+                                          required=("client_id", "schedule_id", "status"))
+
         button_layout = QHBoxLayout()
 
         self.status_button = QPushButton("Изменить статус")
@@ -968,10 +1484,20 @@ class AdminBookingsWindow(QWidget):
         self.cancel_button.setStyleSheet("background-color: #d9534f; padding: 8px;")
         self.cancel_button.clicked.connect(self.cancel_booking)
 
+        self.assign_date_input = QDateEdit(QDate.currentDate())
+        self.assign_date_input.setCalendarPopup(True)
+        self.assign_button = QPushButton("Распределить мастеров")
+        self.assign_button.setStyleSheet("padding: 8px;")
+        self.assign_button.clicked.connect(self.optimize_assignments)
+
         button_layout.addWidget(self.status_button)
         button_layout.addWidget(self.cancel_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.assign_date_input)
+        button_layout.addWidget(self.assign_button)
 
         layout.addWidget(self.title_label)
+        layout.addWidget(self.status_counts_label)
         layout.addWidget(self.search_input)
         layout.addWidget(self.bookings_table)
         layout.addLayout(button_layout)
@@ -980,98 +1506,94 @@ class AdminBookingsWindow(QWidget):
 
         self.load_bookings()
 
+    def on_store_change(self, resource, ids):
+        if resource == "bookings":
+            self.status_counts_timer.start()
+
+    def update_status_counts(self):
+        counts = ApiClient.get_booking_status_counts()
+        if counts is None:
+            return
+        counts = {item["status"]: item["bookings"] for item in counts}
+        self.status_counts_label.setText(
+            "   ".join(f"{title}: {counts.get(status, 0)}" for status, title in STATUS_SUMMARY))
+
     def load_bookings(self):
-        self.bookings = ApiClient.get_bookings()
-        self.clients = {c["client_id"]: c["full_name"] for c in ApiClient.get_clients()}
-        self.schedules = ApiClient.get_schedules()
-        self.quests = {q["quest_id"]: q["title"] for q in ApiClient.get_quests()}
-        self.rooms = {r["room_id"]: r["title"] for r in ApiClient.get_rooms()}
-        self.employees = {e["employee_id"]: e["full_name"] for e in ApiClient.get_employees()}
+        self.booking_ids = store.replace("bookings", ApiClient.get_bookings())
+        bookings = store.get_many("bookings", self.booking_ids)
+
+        # Расписания берём свежими, а из справочников догружаем только то,
+        # на что ссылаются брони и чего ещё нет в общем хранилище
+        store.upsert("schedules", ApiClient.get_schedules(
+            fields=["schedule_id", "quest_id", "room_id", "starts_at"],
+            ids=[b["schedule_id"] for b in bookings]))
+        schedules = store.get_many("schedules", [b["schedule_id"] for b in bookings])
+
+        store.upsert("clients", ApiClient.get_clients(
+            fields=["client_id", "full_name"],
+            ids=store.missing("clients", [b["client_id"] for b in bookings], fields=["full_name"])))
+        store.upsert("quests", ApiClient.get_quests(
+            fields=["quest_id", "title"],
+            ids=store.missing("quests", [s["quest_id"] for s in schedules], fields=["title"])))
+        store.upsert("rooms", ApiClient.get_rooms(
+            fields=["room_id", "title"],
+            ids=store.missing("rooms", [s["room_id"] for s in schedules], fields=["title"])))
+        store.upsert("employees", ApiClient.get_employees(
+            fields=["employee_id", "full_name"],
+            ids=store.missing("employees", [b["employee_id"] for b in bookings], fields=["full_name"])))
 
         self.update_table()
 
-    def update_table(self):
-        self.bookings_table.setRowCount(len(self.bookings))
-
-        for row, booking in enumerate(self.bookings):
-            schedule = next((s for s in self.schedules if s["schedule_id"] == booking["schedule_id"]), None)
-
-            self.bookings_table.setItem(row, 0, QTableWidgetItem(str(booking["booking_id"])))
-            self.bookings_table.setItem(row, 1, QTableWidgetItem(self.clients.get(booking["client_id"], "Неизвестно")))
-
-            if schedule:
-                self.bookings_table.setItem(row, 2,
-                                            QTableWidgetItem(self.quests.get(schedule["quest_id"], "Неизвестно")))
-                self.bookings_table.setItem(row, 3, QTableWidgetItem(self.rooms.get(schedule["room_id"], "Неизвестно")))
-                self.bookings_table.setItem(row, 4, QTableWidgetItem(schedule.get("date", "Неизвестно")))
-                time = schedule.get("start_time", "")
-                if isinstance(time, str) and "T" in time:
-                    time = time.split("T")[1][:5]
-                self.bookings_table.setItem(row, 5, QTableWidgetItem(time[:5] if time else "Неизвестно"))
-            else:
-                self.bookings_table.setItem(row, 2, QTableWidgetItem("Неизвестно"))
-                self.bookings_table.setItem(row, 3, QTableWidgetItem("Неизвестно"))
-                self.bookings_table.setItem(row, 4, QTableWidgetItem("Неизвестно"))
-                self.bookings_table.setItem(row, 5, QTableWidgetItem("Неизвестно"))
+    def booking_row(self, booking):
+        schedule = store.get("schedules", booking.get("schedule_id"))
+        client = store.get("clients", booking.get("client_id"), {})
+        values = [str(booking["booking_id"]), client.get("full_name", "Неизвестно")]
+
+        if schedule:
+            quest = store.get("quests", schedule["quest_id"], {})
+            room = store.get("rooms", schedule["room_id"], {})
+            # starts_at — 'YYYY-MM-DDTHH:MM:SS', дата и время начала одним значением
+            starts_at = schedule.get("starts_at") or ""
+            values += [quest.get("title", "Неизвестно"), room.get("title", "Неизвестно"),
+                       starts_at[:10] or "Неизвестно", starts_at[11:16] or "Неизвестно"]
+        else:
+            values += ["Неизвестно"] * 4
+
+        if booking.get("employee_id") is None:
+            master = "Не назначен"
+        else:
+            master = store.get("employees", booking["employee_id"], {}).get("full_name", "Неизвестно")
+        values += [str(booking.get("participants_count", 0)), master, booking.get("status", ""),
+                   str(booking.get("balance", 0))]
+        return values
+
+    def optimize_assignments(self):
+        day = self.assign_date_input.date().toString("yyyy-MM-dd")
+        result = ApiClient.optimize_assignments(day)
+        if result is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось распределить игровых мастеров")
+            return
 
-            self.bookings_table.setItem(row, 6, QTableWidgetItem(str(booking.get("participants_count", 0))))
-            self.bookings_table.setItem(row, 7, QTableWidgetItem(booking["status"]))
+        self.load_bookings()
+        message = f"Сеансов: {len(result['assigned']) + len(result['unassigned'])}, изменено: {result['changed']}"
+        if result["unassigned"]:
+            QMessageBox.warning(self, "Распределение мастеров",
+                                f"{message}\nНе хватило свободных мастеров на сеансов: {len(result['unassigned'])}")
+        else:
+            QMessageBox.information(self, "Распределение мастеров", message)
+
+    def update_table(self):
+        bookings = store.get_many("bookings", self.booking_ids)
+        self.bookings_table.setRowCount(len(bookings))
+        for row, booking in enumerate(bookings):
+            set_table_row(self.bookings_table, row, self.booking_row(booking))
 
         self.bookings_table.resizeColumnsToContents()
         self.bookings_table.horizontalHeader().setStretchLastSection(True)
+        self.filter_bookings()
 
     def filter_bookings(self):
-        search_text = self.search_input.text().lower()
-        if not search_text:
-            self.update_table()
-            return
-
-        filtered = []
-        for booking in self.bookings:
-            schedule = next((s for s in self.schedules if s["schedule_id"] == booking["schedule_id"]), None)
-
-            client_name = self.clients.get(booking["client_id"], "").lower()
-            quest_name = self.quests.get(schedule["quest_id"], "").lower() if schedule else ""
-            room_name = self.rooms.get(schedule["room_id"], "").lower() if schedule else ""
-            date = schedule.get("date", "").lower() if schedule else ""
-            time = schedule.get("start_time", "").lower() if schedule else ""
-            participants = str(booking.get("participants_count", 0)).lower()
-            status = booking.get("status", "").lower()
-
-            if (search_text in str(booking["booking_id"]) or
-                    search_text in client_name or
-                    search_text in quest_name or
-                    search_text in room_name or
-                    search_text in date or
-                    search_text in time or
-                    search_text in participants or
-                    search_text in status):
-                filtered.append(booking)
-
-        self.bookings_table.setRowCount(len(filtered))
-        for row, booking in enumerate(filtered):
-            schedule = next((s for s in self.schedules if s["schedule_id"] == booking["schedule_id"]), None)
-
-            self.bookings_table.setItem(row, 0, QTableWidgetItem(str(booking["booking_id"])))
-            self.bookings_table.setItem(row, 1, QTableWidgetItem(self.clients.get(booking["client_id"], "Неизвестно")))
-
-            if schedule:
-                self.bookings_table.setItem(row, 2,
-                                            QTableWidgetItem(self.quests.get(schedule["quest_id"], "Неизвестно")))
-                self.bookings_table.setItem(row, 3, QTableWidgetItem(self.rooms.get(schedule["room_id"], "Неизвестно")))
-                self.bookings_table.setItem(row, 4, QTableWidgetItem(schedule.get("date", "Неизвестно")))
-                time = schedule.get("start_time", "")
-                if isinstance(time, str) and "T" in time:
-                    time = time.split("T")[1][:5]
-                self.bookings_table.setItem(row, 5, QTableWidgetItem(time[:5] if time else "Неизвестно"))
-            else:
-                self.bookings_table.setItem(row, 2, QTableWidgetItem("Неизвестно"))
-                self.bookings_table.setItem(row, 3, QTableWidgetItem("Неизвестно"))
-                self.bookings_table.setItem(row, 4, QTableWidgetItem("Неизвестно"))
-                self.bookings_table.setItem(row, 5, QTableWidgetItem("Неизвестно"))
-
-            self.bookings_table.setItem(row, 6, QTableWidgetItem(str(booking.get("participants_count", 0))))
-            self.bookings_table.setItem(row, 7, QTableWidgetItem(booking["status"]))
+        apply_row_filter(self.bookings_table, self.booking_ids, self.search_index.search(self.search_input.text()))
 
     def change_booking_status(self):
         selected_row = self.bookings_table.currentRow()
@@ -1080,7 +1602,7 @@ class AdminBookingsWindow(QWidget):
             return
 
         booking_id = int(self.bookings_table.item(selected_row, 0).text())
-        booking = next((b for b in self.bookings if b["booking_id"] == booking_id), None)
+        booking = store.get("bookings", booking_id)
         if not booking:
             return
 
@@ -1090,9 +1612,14 @@ class AdminBookingsWindow(QWidget):
 
         layout = QFormLayout(dialog)
 
+        next_statuses = NEXT_STATUSES.get(booking["status"], [])
+        if not next_statuses:
+            QMessageBox.information(self, "Статус бронирования",
+                                    f"Статус «{booking['status']}» окончательный и не меняется")
+            return
+
         status_combo = QComboBox()
-        status_combo.addItems(["Подтвержден", "Завершен", "Отменен"])
-        status_combo.setCurrentText(booking["status"])
+        status_combo.addItems(next_statuses)
 
         layout.addRow("Новый статус:", status_combo)
 
@@ -1113,12 +1640,7 @@ class AdminBookingsWindow(QWidget):
                 "participants_count": booking["participants_count"]
             }
 
-            success = ApiClient.update_booking(booking_id, update_data)
-            if success:
-                QMessageBox.information(self, "Успех", "Статус бронирования успешно изменен")
-                self.load_bookings()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось изменить статус бронирования")
+            write_queue.update("bookings", booking_id, update_data, f"Статус бронирования #{booking_id}")
 
     def cancel_booking(self):
         selected_row = self.bookings_table.currentRow()
@@ -1128,6 +1650,12 @@ class AdminBookingsWindow(QWidget):
 
         booking_id = int(self.bookings_table.item(selected_row, 0).text())
         booking_title = f"Бронирование #{booking_id}"
+        booking = store.get("bookings", booking_id)
+        if not booking:
+            return
+        if CANCELLED_STATUS not in NEXT_STATUSES.get(booking["status"], []):
+            QMessageBox.warning(self, "Ошибка", f"Бронирование в статусе «{booking['status']}» нельзя отменить")
+            return
 
         reply = QMessageBox.question(
             self, "Подтверждение отмены",
@@ -1136,24 +1664,15 @@ class AdminBookingsWindow(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            booking = next((b for b in self.bookings if b["booking_id"] == booking_id), None)
-            if not booking:
-                return
-
             update_data = {
                 "client_id": booking["client_id"],
                 "schedule_id": booking["schedule_id"],
                 "employee_id": booking["employee_id"],
-                "status": "Отменен",
+                "status": CANCELLED_STATUS,
                 "participants_count": booking["participants_count"]
             }
 
-            success = ApiClient.update_booking(booking_id, update_data)
-            if success:
-                QMessageBox.information(self, "Успех", "Бронирование успешно отменено")
-                self.load_bookings()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось отменить бронирование")
+            write_queue.update("bookings", booking_id, update_data, f"Отмена бронирования #{booking_id}")
 
 
 class AdminServicesWindow(QWidget):
@@ -1167,15 +1686,22 @@ class AdminServicesWindow(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Поиск услуг...")
-        self.search_input.textChanged.connect(self.filter_services)
+        self.search_index = SearchIndex(self.search_fields)
+        self.search_index.attach(store, "services")
+        self.search_timer = debounced(self, self.filter_services)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
 
         self.services_table = QTableWidget()
-        self.services_table.setColumnCount(5)
-        self.services_table.setHorizontalHeaderLabels(["ID", "Название", "Описание", "Цена", "Бронирование"])
+        self.services_table.setColumnCount(4)
+        self.services_table.setHorizontalHeaderLabels(["ID", "Название", "Описание", "Цена"])
         self.services_table.horizontalHeader().setStretchLastSection(True)
         self.services_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.services_table.setSelectionMode(QTableWidget.SingleSelection)
 
+        self.service_ids = []
+        self.table_binding = TableBinding(self.services_table, "services", lambda: self.service_ids,
+                                          self.service_row, self.filter_services, required=("title", "price"))
+
         button_layout = QHBoxLayout()
 
         self.add_button = QPushButton("Добавить")
@@ -1204,45 +1730,28 @@ class AdminServicesWindow(QWidget):
         self.load_services()
 
     def load_services(self):
-        self.services = ApiClient.get_services()
-        self.bookings = {b["booking_id"]: f"Бронь #{b['booking_id']}" for b in ApiClient.get_bookings()}
+        self.service_ids = store.replace("services", ApiClient.get_services())
         self.update_table()
 
     def update_table(self):
-        self.services_table.setRowCount(len(self.services))
-        for row, service in enumerate(self.services):
-            self.services_table.setItem(row, 0, QTableWidgetItem(str(service["service_id"])))
-            self.services_table.setItem(row, 1, QTableWidgetItem(service["title"]))
-            self.services_table.setItem(row, 2, QTableWidgetItem(service["description"]))
-            self.services_table.setItem(row, 3, QTableWidgetItem(str(service["price"])))
-            self.services_table.setItem(row, 4,
-                                        QTableWidgetItem(self.bookings.get(service.get("booking_id", 0), "Не указано")))
+        services = store.get_many("services", self.service_ids)
+        self.services_table.setRowCount(len(services))
+        for row, service in enumerate(services):
+            set_table_row(self.services_table, row, self.service_row(service))
 
         self.services_table.resizeColumnsToContents()
         self.services_table.setColumnWidth(2, 300)  # Фиксированная ширина для описания
         self.services_table.horizontalHeader().setStretchLastSection(True)
+        self.filter_services()
 
-    def filter_services(self):
-        search_text = self.search_input.text().lower()
-        if not search_text:
-            self.update_table()
-            return
+    def service_row(self, service):
+        return [str(service["service_id"]), service["title"], service["description"], str(service["price"])]
+
+    def search_fields(self, service):
+        return [service["service_id"], service.get("title"), service.get("description"), service.get("price")]
 
-        filtered = [s for s in self.services if
-                    search_text in str(s["service_id"]) or
-                    search_text in s["title"].lower() or
-                    search_text in s["description"].lower() or
-                    search_text in str(s["price"]) or
-                    search_text in self.bookings.get(s.get("booking_id", 0), "").lower()]
-
-        self.services_table.setRowCount(len(filtered))
-        for row, service in enumerate(filtered):
-            self.services_table.setItem(row, 0, QTableWidgetItem(str(service["service_id"])))
-            self.services_table.setItem(row, 1, QTableWidgetItem(service["title"]))
-            self.services_table.setItem(row, 2, QTableWidgetItem(service["description"]))
-            self.services_table.setItem(row, 3, QTableWidgetItem(str(service["price"])))
-            self.services_table.setItem(row, 4,
-                                        QTableWidgetItem(self.bookings.get(service.get("booking_id", 0), "Не указано")))
+    def filter_services(self):
+        apply_row_filter(self.services_table, self.service_ids, self.search_index.search(self.search_input.text()))
 
     def add_service(self):
         dialog = QDialog(self)
@@ -1259,16 +1768,9 @@ class AdminServicesWindow(QWidget):
         price_input.setValue(1000)
         price_input.setSuffix(" руб")
 
-        booking_combo = QComboBox()
-        booking_combo.addItem("Не привязано", 0)
-        bookings = ApiClient.get_bookings()
-        for booking in bookings:
-            booking_combo.addItem(f"Бронь #{booking['booking_id']}", booking["booking_id"])
-
         layout.addRow("Название*:", title_input)
         layout.addRow("Описание:", description_input)
         layout.addRow("Цена*:", price_input)
-        layout.addRow("Бронирование:", booking_combo)
 
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dialog.accept)
@@ -1284,16 +1786,10 @@ class AdminServicesWindow(QWidget):
             service_data = {
                 "title": title_input.text(),
                 "description": description_input.toPlainText(),
-                "price": price_input.value(),
-                "booking_id": booking_combo.currentData()
+                "price": price_input.value()
             }
 
-            new_service = ApiClient.create_service(service_data)
-            if new_service:
-                self.load_services()
-                QMessageBox.information(self, "Успех", "Услуга успешно добавлена")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось добавить услугу")
+            write_queue.create("services", service_data, f"Новая услуга '{service_data['title']}'")
 
     def edit_service(self):
         selected_row = self.services_table.currentRow()
@@ -1302,7 +1798,7 @@ class AdminServicesWindow(QWidget):
             return
 
         service_id = int(self.services_table.item(selected_row, 0).text())
-        service = next((s for s in self.services if s["service_id"] == service_id), None)
+        service = store.get("services", service_id)
         if not service:
             return
 
@@ -1320,21 +1816,9 @@ class AdminServicesWindow(QWidget):
         price_input.setValue(service["price"])
         price_input.setSuffix(" руб")
 
-        booking_combo = QComboBox()
-        booking_combo.addItem("Не привязано", 0)
-        bookings = ApiClient.get_bookings()
-        for booking in bookings:
-            booking_combo.addItem(f"Бронь #{booking['booking_id']}", booking["booking_id"])
-
-        current_booking = service.get("booking_id", 0)
-        index = booking_combo.findData(current_booking)
-        if index >= 0:
-            booking_combo.setCurrentIndex(index)
-
         layout.addRow("Название*:", title_input)
         layout.addRow("Описание:", description_input)
         layout.addRow("Цена*:", price_input)
-        layout.addRow("Бронирование:", booking_combo)
 
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dialog.accept)
@@ -1350,16 +1834,10 @@ class AdminServicesWindow(QWidget):
             service_data = {
                 "title": title_input.text(),
                 "description": description_input.toPlainText(),
-                "price": price_input.value(),
-                "booking_id": booking_combo.currentData()
+                "price": price_input.value()
             }
 
-            success = ApiClient.update_service(service_id, service_data)
-            if success:
-                self.load_services()
-                QMessageBox.information(self, "Успех", "Услуга успешно обновлена")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось обновить услугу")
+            write_queue.update("services", service_id, service_data, f"Услуга '{service_data['title']}'")
 
     def delete_service(self):
         selected_row = self.services_table.currentRow()
@@ -1377,12 +1855,7 @@ class AdminServicesWindow(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            success = ApiClient.delete_service(service_id)
-            if success:
-                self.load_services()
-                QMessageBox.information(self, "Успех", "Услуга успешно удалена")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось удалить услугу")
+            write_queue.delete("services", service_id, f"Удаление услуги '{service_name}'")
 
 
 class AdminUsersWindow(QWidget):
@@ -1396,7 +1869,10 @@ class AdminUsersWindow(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Поиск пользователей...")
-        self.search_input.textChanged.connect(self.filter_users)
+        self.search_index = SearchIndex(self.search_fields)
+        self.search_index.attach(store, "clients")
+        self.search_timer = debounced(self, self.filter_users)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
 
         self.users_table = QTableWidget()
         self.users_table.setColumnCount(6)
@@ -1405,6 +1881,11 @@ class AdminUsersWindow(QWidget):
         self.users_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.users_table.setSelectionMode(QTableWidget.SingleSelection)
 
+        self.client_ids = []
+        self.table_binding = TableBinding(self.users_table, "clients", lambda: self.client_ids,
+                                          self.client_row, self.filter_users,
+                                          required=("full_name", "phone", "email", "birth_date"))
+
         button_layout = QHBoxLayout()
 
         self.add_button = QPushButton("Добавить")
@@ -1433,44 +1914,30 @@ class AdminUsersWindow(QWidget):
         self.load_users()
 
     def load_users(self):
-        clients = ApiClient.get_clients()
+        self.client_ids = store.replace("clients", ApiClient.get_clients())
+        self.update_table()
+
+    def update_table(self):
+        clients = store.get_many("clients", self.client_ids)
         self.users_table.setRowCount(len(clients))
 
         for row, client in enumerate(clients):
-            self.users_table.setItem(row, 0, QTableWidgetItem(str(client["client_id"])))
-            self.users_table.setItem(row, 1, QTableWidgetItem(client["full_name"]))
-            self.users_table.setItem(row, 2, QTableWidgetItem(client["phone"]))
-            self.users_table.setItem(row, 3, QTableWidgetItem(client["email"]))
-            self.users_table.setItem(row, 4, QTableWidgetItem(client["birth_date"]))
-            self.users_table.setItem(row, 5, QTableWidgetItem(client.get("login", "")))
+            set_table_row(self.users_table, row, self.client_row(client))
 
         self.users_table.resizeColumnsToContents()
         self.users_table.horizontalHeader().setStretchLastSection(True)
+        self.filter_users()
 
-    def filter_users(self):
-        search_text = self.search_input.text().lower()
-        clients = ApiClient.get_clients()
+    def client_row(self, client):
+        return [str(client["client_id"]), client["full_name"], client["phone"], client["email"],
+                client["birth_date"], client.get("login", "")]
 
-        if not search_text:
-            self.load_users()
-            return
+    def search_fields(self, client):
+        return [client["client_id"], client.get("full_name"), client.get("phone"),
+                client.get("email"), client.get("birth_date"), client.get("login")]
 
-        filtered = [c for c in clients if
-                    search_text in str(c["client_id"]) or
-                    search_text in c["full_name"].lower() or
-                    search_text in c["phone"].lower() or
-                    search_text in c["email"].lower() or
-                    search_text in c["birth_date"].lower() or
-                    search_text in c.get("login", "").lower()]
-
-        self.users_table.setRowCount(len(filtered))
-        for row, client in enumerate(filtered):
-            self.users_table.setItem(row, 0, QTableWidgetItem(str(client["client_id"])))
-            self.users_table.setItem(row, 1, QTableWidgetItem(client["full_name"]))
-            self.users_table.setItem(row, 2, QTableWidgetItem(client["phone"]))
-            self.users_table.setItem(row, 3, QTableWidgetItem(client["email"]))
-            self.users_table.setItem(row, 4, QTableWidgetItem(client["birth_date"]))
-            self.users_table.setItem(row, 5, QTableWidgetItem(client.get("login", "")))
+    def filter_users(self):
+        apply_row_filter(self.users_table, self.client_ids, self.search_index.search(self.search_input.text()))
 
     def add_user(self):
         dialog = QDialog(self)
@@ -1521,12 +1988,7 @@ class AdminUsersWindow(QWidget):
                 "password": self.password_input.text()
             }
 
-            result = ApiClient.register_client(user_data)
-            if result:
-                QMessageBox.information(self, "Успех", "Пользователь успешно добавлен")
-                self.load_users()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось добавить пользователя")
+            write_queue.create("clients", user_data, f"Новый пользователь {user_data['full_name']}")
 
     def edit_user(self):
         selected_row = self.users_table.currentRow()
@@ -1589,12 +2051,7 @@ class AdminUsersWindow(QWidget):
             if password:
                 update_data["password"] = password
 
-            result = ApiClient.update_client(client_id, update_data)
-            if result:
-                QMessageBox.information(self, "Успех", "Данные пользователя успешно обновлены")
-                self.load_users()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось обновить данные пользователя")
+            write_queue.update("clients", client_id, update_data, f"Пользователь {update_data['full_name']}")
 
     def delete_user(self):
         selected_row = self.users_table.currentRow()
@@ -1612,12 +2069,7 @@ class AdminUsersWindow(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            success = ApiClient.delete_client(client_id)
-            if success:
-                QMessageBox.information(self, "Успех", "Пользователь успешно удален")
-                self.load_users()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось удалить пользователя")
+            write_queue.delete("clients", client_id, f"Удаление пользователя {client_name}")
 
 
 class AdminEmployeesWindow(QWidget):
@@ -1631,7 +2083,10 @@ class AdminEmployeesWindow(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Поиск сотрудников...")
-        self.search_input.textChanged.connect(self.filter_employees)
+        self.search_index = SearchIndex(self.search_fields)
+        self.search_index.attach(store, "employees", depends=("positions",))
+        self.search_timer = debounced(self, self.filter_employees)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
 
         self.employees_table = QTableWidget()
         self.employees_table.setColumnCount(5)
@@ -1640,6 +2095,11 @@ class AdminEmployeesWindow(QWidget):
         self.employees_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.employees_table.setSelectionMode(QTableWidget.SingleSelection)
 
+        self.employee_ids = []
+        self.table_binding = TableBinding(self.employees_table, "employees", lambda: self.employee_ids,
+                                          self.employee_row, self.filter_employees,
+                                          required=("full_name", "position_id", "login"))
+
         button_layout = QHBoxLayout()
 
         self.add_button = QPushButton("Добавить")
@@ -1668,42 +2128,33 @@ class AdminEmployeesWindow(QWidget):
         self.load_employees()
 
     def load_employees(self):
-        employees = ApiClient.get_employees()
-        positions = {p["position_id"]: p["title"] for p in ApiClient.get_positions()}
+        self.employee_ids = store.replace("employees", ApiClient.get_employees())
+        store.upsert("positions", ApiClient.get_positions(fields=["position_id", "title"]))
+        self.update_table()
+
+    def position_title(self, employee, default="Неизвестно"):
+        return store.get("positions", employee["position_id"], {}).get("title", default)
 
+    def update_table(self):
+        employees = store.get_many("employees", self.employee_ids)
         self.employees_table.setRowCount(len(employees))
         for row, employee in enumerate(employees):
-            self.employees_table.setItem(row, 0, QTableWidgetItem(str(employee["employee_id"])))
-            self.employees_table.setItem(row, 1, QTableWidgetItem(employee["full_name"]))
-            self.employees_table.setItem(row, 2, QTableWidgetItem(positions.get(employee["position_id"], "Неизвестно")))
-            self.employees_table.setItem(row, 3, QTableWidgetItem(employee["login"]))
-            self.employees_table.setItem(row, 4, QTableWidgetItem("Активен"))
+            set_table_row(self.employees_table, row, self.employee_row(employee))
 
         self.employees_table.resizeColumnsToContents()
         self.employees_table.horizontalHeader().setStretchLastSection(True)
+        self.filter_employees()
 
-    def filter_employees(self):
-        search_text = self.search_input.text().lower()
-        employees = ApiClient.get_employees()
-        positions = {p["position_id"]: p["title"] for p in ApiClient.get_positions()}
-
-        if not search_text:
-            self.load_employees()
-            return
+    def employee_row(self, employee):
+        return [str(employee["employee_id"]), employee["full_name"], self.position_title(employee),
+                employee["login"], "Активен"]
 
-        filtered = [e for e in employees if
-                    search_text in str(e["employee_id"]) or
-                    search_text in e["full_name"].lower() or
-                    search_text in positions.get(e["position_id"], "").lower() or
-                    search_text in e["login"].lower()]
+    def search_fields(self, employee):
+        return [employee["employee_id"], employee.get("full_name"),
+                self.position_title(employee, ""), employee.get("login")]
 
-        self.employees_table.setRowCount(len(filtered))
-        for row, employee in enumerate(filtered):
-            self.employees_table.setItem(row, 0, QTableWidgetItem(str(employee["employee_id"])))
-            self.employees_table.setItem(row, 1, QTableWidgetItem(employee["full_name"]))
-            self.employees_table.setItem(row, 2, QTableWidgetItem(positions.get(employee["position_id"], "Неизвестно")))
-            self.employees_table.setItem(row, 3, QTableWidgetItem(employee["login"]))
-            self.employees_table.setItem(row, 4, QTableWidgetItem("Активен"))
+    def filter_employees(self):
+        apply_row_filter(self.employees_table, self.employee_ids, self.search_index.search(self.search_input.text()))
 
     def add_employee(self):
         dialog = QDialog(self)
@@ -1748,12 +2199,7 @@ class AdminEmployeesWindow(QWidget):
                 "password": self.password_input.text()
             }
 
-            result = ApiClient.create_employee(employee_data)
-            if result:
-                QMessageBox.information(self, "Успех", "Сотрудник успешно добавлен")
-                self.load_employees()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось добавить сотрудника")
+            write_queue.create("employees", employee_data, f"Новый сотрудник {employee_data['full_name']}")
 
     def edit_employee(self):
         selected_row = self.employees_table.currentRow()
@@ -1762,7 +2208,7 @@ class AdminEmployeesWindow(QWidget):
             return
 
         employee_id = int(self.employees_table.item(selected_row, 0).text())
-        employee_data = next((e for e in ApiClient.get_employees() if e["employee_id"] == employee_id), None)
+        employee_data = store.get("employees", employee_id)
         if not employee_data:
             QMessageBox.warning(self, "Ошибка", "Не удалось загрузить данные сотрудника")
             return
@@ -1809,12 +2255,7 @@ class AdminEmployeesWindow(QWidget):
             if password:
                 update_data["password"] = password
 
-            result = ApiClient.update_employee(employee_id, update_data)
-            if result:
-                QMessageBox.information(self, "Успех", "Данные сотрудника успешно обновлены")
-                self.load_employees()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось обновить данные сотрудника")
+            write_queue.update("employees", employee_id, update_data, f"Сотрудник {update_data['full_name']}")
 
     def delete_employee(self):
         selected_row = self.employees_table.currentRow()
@@ -1832,12 +2273,7 @@ class AdminEmployeesWindow(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            success = ApiClient.delete_employee(employee_id)
-            if success:
-                QMessageBox.information(self, "Успех", "Сотрудник успешно удален")
-                self.load_employees()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось удалить сотрудника")
+            write_queue.delete("employees", employee_id, f"Удаление сотрудника {employee_name}")
 
 
 class AdminQuestsWindow(QWidget):
@@ -1854,7 +2290,10 @@ class AdminQuestsWindow(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Поиск квестов...")
-        self.search_input.textChanged.connect(self.filter_quests)
+        self.search_index = SearchIndex(self.search_fields)
+        self.search_index.attach(store, "quests")
+        self.search_timer = debounced(self, self.filter_quests)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
 
         self.quests_table = QTableWidget()
         self.quests_table.setColumnCount(6)
@@ -1863,6 +2302,11 @@ class AdminQuestsWindow(QWidget):
         self.quests_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.quests_table.setSelectionMode(QTableWidget.SingleSelection)
 
+        self.quest_ids = []
+        self.table_binding = TableBinding(self.quests_table, "quests", lambda: self.quest_ids,
+                                          self.quest_row, self.filter_quests,
+                                          required=("title", "duration", "price"))
+
         button_layout = QHBoxLayout()
 
         self.add_button = QPushButton("Добавить")
@@ -1889,44 +2333,30 @@ class AdminQuestsWindow(QWidget):
         self.setLayout(layout)
 
     def load_quests(self):
-        self.quests = ApiClient.get_quests()
+        self.quest_ids = store.replace("quests", ApiClient.get_quests())
         self.update_table()
 
     def update_table(self):
-        self.quests_table.setRowCount(len(self.quests))
-        for row, quest in enumerate(self.quests):
-            self.quests_table.setItem(row, 0, QTableWidgetItem(str(quest["quest_id"])))
-            self.quests_table.setItem(row, 1, QTableWidgetItem(quest["title"]))
-            self.quests_table.setItem(row, 2, QTableWidgetItem(quest["description"]))
-            self.quests_table.setItem(row, 3, QTableWidgetItem(str(quest["difficulty"])))
-            self.quests_table.setItem(row, 4, QTableWidgetItem(f"{quest['duration']} мин"))
-            self.quests_table.setItem(row, 5, QTableWidgetItem(f"{quest['price']} руб"))
+        quests = store.get_many("quests", self.quest_ids)
+        self.quests_table.setRowCount(len(quests))
+        for row, quest in enumerate(quests):
+            set_table_row(self.quests_table, row, self.quest_row(quest))
 
         self.quests_table.resizeColumnsToContents()
         self.quests_table.setColumnWidth(2, 300)  # Фиксированная ширина для описания
         self.quests_table.horizontalHeader().setStretchLastSection(True)
+        self.filter_quests()
 
-    def filter_quests(self):
-        search_text = self.search_input.text().lower()
-        if not search_text:
-            self.update_table()
-            return
+    def quest_row(self, quest):
+        return [str(quest["quest_id"]), quest["title"], quest["description"], str(quest["difficulty"]),
+                f"{quest['duration']} мин", f"{quest['price']} руб"]
 
-        filtered = [q for q in self.quests if
-                   search_text in q["title"].lower() or
-                   search_text in q["description"].lower() or
-                   search_text in str(q["difficulty"]) or
-                   search_text in str(q["duration"]) or
-                   search_text in str(q["price"])]
-
-        self.quests_table.setRowCount(len(filtered))
-        for row, quest in enumerate(filtered):
-            self.quests_table.setItem(row, 0, QTableWidgetItem(str(quest["quest_id"])))
-            self.quests_table.setItem(row, 1, QTableWidgetItem(quest["title"]))
-            self.quests_table.setItem(row, 2, QTableWidgetItem(quest["description"]))
-            self.quests_table.setItem(row, 3, QTableWidgetItem(str(quest["difficulty"])))
-            self.quests_table.setItem(row, 4, QTableWidgetItem(f"{quest['duration']} мин"))
-            self.quests_table.setItem(row, 5, QTableWidgetItem(f"{quest['price']} руб"))
+    def search_fields(self, quest):
+        return [quest.get("title"), quest.get("description"), quest.get("difficulty"),
+                quest.get("duration"), quest.get("price")]
+
+    def filter_quests(self):
+        apply_row_filter(self.quests_table, self.quest_ids, self.search_index.search(self.search_input.text()))
 
     def show_add_quest_dialog(self):
         dialog = QDialog(self)
@@ -1975,12 +2405,7 @@ class AdminQuestsWindow(QWidget):
                 "price": price_input.value()
             }
 
-            new_quest = ApiClient.create_quest(quest_data)
-            if new_quest:
-                self.load_quests()
-                QMessageBox.information(self, "Успех", "Квест успешно добавлен")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось добавить квест")
+            write_queue.create("quests", quest_data, f"Новый квест '{quest_data['title']}'")
 
     def edit_selected_quest(self):
         selected = self.quests_table.currentRow()
@@ -1989,7 +2414,7 @@ class AdminQuestsWindow(QWidget):
             return
 
         quest_id = int(self.quests_table.item(selected, 0).text())
-        quest = next((q for q in self.quests if q["quest_id"] == quest_id), None)
+        quest = store.get("quests", quest_id)
         if not quest:
             return
 
@@ -2039,12 +2464,7 @@ class AdminQuestsWindow(QWidget):
                 "price": price_input.value()
             }
 
-            success = ApiClient.update_quest(quest_id, quest_data)
-            if success:
-                self.load_quests()
-                QMessageBox.information(self, "Успех", "Квест успешно обновлен")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось обновить квест")
+            write_queue.update("quests", quest_id, quest_data, f"Квест '{quest_data['title']}'")
 
     def delete_selected_quest(self):
         selected = self.quests_table.currentRow()
@@ -2062,12 +2482,312 @@ class AdminQuestsWindow(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            success = ApiClient.delete_quest(quest_id)
-            if success:
-                self.load_quests()
-                QMessageBox.information(self, "Успех", "Квест успешно удален")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось удалить квест")
+            write_queue.delete("quests", quest_id, f"Удаление квеста '{quest_title}'")
+
+# Лента расписания: сколько дней до и после сегодняшнего можно прокрутить
+TIMELINE_DAYS_BEFORE = 180
+TIMELINE_DAYS_AFTER = 365
+# Сколько дней подгружать заранее с каждой стороны видимого окна
+TIMELINE_PREFETCH_DAYS = 7
+TIMELINE_LOAD_DEBOUNCE_MS = 100
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+
+def fetch_schedule_days(first, last):
+    # Вызывается в фоновом потоке ScheduleCache
+    schedules = ApiClient.get_schedule_range(first.isoformat(), last.isoformat())
+    if schedules is None:
+        return None
+    quests = ApiClient.get_quests(fields=["quest_id", "title"],
+                                  ids=[s["quest_id"] for s in schedules]) if schedules else []
+    return {"schedules": schedules, "quests": quests}
+
+
+class ScheduleTimelineModel(QAbstractTableModel):
+    # Строки — комнаты, столбцы — дни. QTableView запрашивает данные только
+    # для видимых ячеек, так что длина ленты не влияет на скорость
+    def __init__(self, cache, first_day, day_count, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.first_day = first_day
+        self.day_count = day_count
+        self.room_ids = []
+        self.cache.loaded.connect(self.on_days_loaded)
+        store.subscribe(self.on_store_change)
+        self.destroyed.connect(lambda: store.unsubscribe(self.on_store_change))
+
+    def set_rooms(self, room_ids):
+        self.beginResetModel()
+        self.room_ids = list(room_ids)
+        self.endResetModel()
+
+    def day(self, column):
+        return self.first_day + datetime.timedelta(days=column)
+
+    def column(self, day):
+        return (day - self.first_day).days
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.room_ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.day_count
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            day = self.day(section)
+            return f"{WEEKDAYS[day.weekday()]} {day.strftime('%d.%m.%Y')}"
+        room = store.get("rooms", self.room_ids[section], {})
+        return room.get("title", f"Комната #{self.room_ids[section]}")
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignLeft | Qt.AlignTop)
+        if role != Qt.DisplayRole:
+            return None
+
+        day = self.day(index.column())
+        if not self.cache.is_loaded(day):
+            return "Загрузка..."
+        schedules = store.lookup("schedules", "by_room_date", (self.room_ids[index.row()], day.isoformat()))
+        lines = []
+        for schedule in sorted(schedules, key=lambda s: s.get("start_time") or ""):
+            quest = store.get("quests", schedule.get("quest_id"), {})
+            start = (schedule.get("start_time") or "")[:5]
+            end = (schedule.get("end_time") or "")[:5]
+            lines.append(f"{start}–{end} {quest.get('title', 'Квест')}")
+        return "\n".join(lines)
+
+    def on_days_loaded(self, first, last):
+        if self.room_ids:
+            self.dataChanged.emit(self.index(0, max(self.column(first), 0)),
+                                  self.index(len(self.room_ids) - 1, min(self.column(last), self.day_count - 1)))
+
+    def on_store_change(self, resource, ids):
+        # Вид перерисует только видимые ячейки, поэтому не ищем затронутые дни
+        if resource in ("schedules", "quests") and self.room_ids:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.room_ids) - 1, self.day_count - 1))
+        elif resource == "rooms" and self.room_ids:
+            self.headerDataChanged.emit(Qt.Vertical, 0, len(self.room_ids) - 1)
+
+
+class AdminScheduleWindow(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        layout = QVBoxLayout()
+
+        self.title_label = QLabel("Расписание комнат")
+        self.title_label.setStyleSheet("font-size: 18px; font-weight: bold;")
+
+        navigation_layout = QHBoxLayout()
+
+        self.prev_button = QPushButton("◀ Неделя")
+        self.prev_button.clicked.connect(lambda: self.shift(-7))
+
+        self.date_input = QDateEdit()
+        self.date_input.setCalendarPopup(True)
+        self.date_input.setDate(QDate.currentDate())
+        self.date_input.dateChanged.connect(lambda value: self.go_to(value.toPython()))
+
+        self.today_button = QPushButton("Сегодня")
+        self.today_button.clicked.connect(lambda: self.date_input.setDate(QDate.currentDate()))
+
+        self.next_button = QPushButton("Неделя ▶")
+        self.next_button.clicked.connect(lambda: self.shift(7))
+
+        self.template_button = QPushButton("Шаблон расписания")
+        self.template_button.setStyleSheet("background-color: #5cb85c; padding: 8px;")
+        self.template_button.clicked.connect(self.show_template_dialog)
+
+        navigation_layout.addWidget(self.prev_button)
+        navigation_layout.addWidget(self.date_input)
+        navigation_layout.addWidget(self.today_button)
+        navigation_layout.addWidget(self.next_button)
+        navigation_layout.addStretch()
+        navigation_layout.addWidget(self.template_button)
+
+        self.cache = ScheduleCache(store, fetch_schedule_days, TIMELINE_PREFETCH_DAYS)
+        first_day = datetime.date.today() - datetime.timedelta(days=TIMELINE_DAYS_BEFORE)
+        self.model = ScheduleTimelineModel(self.cache, first_day, TIMELINE_DAYS_BEFORE + TIMELINE_DAYS_AFTER + 1,
+                                           self)
+
+        self.timeline_view = QTableView()
+        self.timeline_view.setModel(self.model)
+        self.timeline_view.setEditTriggers(QTableView.NoEditTriggers)
+        self.timeline_view.setHorizontalScrollMode(QTableView.ScrollPerPixel)
+        self.timeline_view.setVerticalScrollMode(QTableView.ScrollPerPixel)
+        self.timeline_view.setWordWrap(True)
+        self.timeline_view.horizontalHeader().setDefaultSectionSize(170)
+        self.timeline_view.verticalHeader().setDefaultSectionSize(120)
+
+        # Загружаем дни, когда прокрутка остановилась
+        self.load_timer = debounced(self, self.load_visible, TIMELINE_LOAD_DEBOUNCE_MS)
+        self.timeline_view.horizontalScrollBar().valueChanged.connect(lambda: self.load_timer.start())
+
+        layout.addWidget(self.title_label)
+        layout.addLayout(navigation_layout)
+        layout.addWidget(self.timeline_view)
+
+        self.setLayout(layout)
+
+        self.load_rooms()
+        QTimer.singleShot(0, lambda: self.go_to(datetime.date.today()))
+
+    def load_rooms(self):
+        store.upsert("rooms", ApiClient.get_rooms(fields=["room_id", "title"]))
+        self.model.set_rooms(sorted(room["room_id"] for room in store.all("rooms")))
+
+    def first_visible_day(self):
+        column = self.timeline_view.columnAt(0)
+        return self.model.day(max(column, 0))
+
+    def go_to(self, day):
+        column = min(max(self.model.column(day), 0), self.model.day_count - 1)
+        self.timeline_view.horizontalScrollBar().setValue(self.timeline_view.columnViewportPosition(column)
+                                                         + self.timeline_view.horizontalOffset())
+        self.load_visible()
+
+    def shift(self, days):
+        self.go_to(self.first_visible_day() + datetime.timedelta(days=days))
+
+    def load_visible(self):
+        first = self.timeline_view.columnAt(0)
+        if first < 0:
+            return
+        last = self.timeline_view.columnAt(self.timeline_view.viewport().width() - 1)
+        if last < 0:
+            last = self.model.day_count - 1
+        self.cache.ensure(self.model.day(first), self.model.day(last))
+
+    def reload(self):
+        self.cache.invalidate()
+        self.load_rooms()
+        self.load_visible()
+
+    def show_template_dialog(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Шаблон расписания")
+        dialog.setModal(True)
+        dialog.setMinimumWidth(500)
+
+        layout = QFormLayout(dialog)
+
+        quest_combo = QComboBox()
+        for quest in ApiClient.get_quests(fields=["quest_id", "title"]):
+            quest_combo.addItem(quest["title"], quest["quest_id"])
+
+        room_combo = QComboBox()
+        for room_id in self.model.room_ids:
+            room_combo.addItem(store.get("rooms", room_id, {}).get("title", f"Комната #{room_id}"), room_id)
+
+        weekdays_layout = QHBoxLayout()
+        weekday_checkboxes = []
+        for name in WEEKDAYS:
+            checkbox = QCheckBox(name)
+            weekday_checkboxes.append(checkbox)
+            weekdays_layout.addWidget(checkbox)
+
+        times_input = QLineEdit()
+        times_input.setPlaceholderText("18:00, 19:30, 21:00")
+
+        date_from_input = QDateEdit()
+        date_from_input.setCalendarPopup(True)
+        date_from_input.setDate(QDate.currentDate())
+        date_to_input = QDateEdit()
+        date_to_input.setCalendarPopup(True)
+        date_to_input.setDate(QDate.currentDate().addMonths(3))
+
+        preview_button = QPushButton("Предпросмотр")
+        preview_output = QTextEdit()
+        preview_output.setReadOnly(True)
+
+        layout.addRow("Квест*:", quest_combo)
+        layout.addRow("Комната*:", room_combo)
+        layout.addRow("Дни недели*:", weekdays_layout)
+        layout.addRow("Время начала*:", times_input)
+        layout.addRow("С:", date_from_input)
+        layout.addRow("По:", date_to_input)
+        layout.addRow(preview_button)
+        layout.addRow(preview_output)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addRow(buttons)
+
+        def template_data():
+            times = [QTime.fromString(value.strip(), "H:mm") for value in times_input.text().replace(";", ",").split(",")
+                     if value.strip()]
+            weekdays = [day for day, checkbox in enumerate(weekday_checkboxes) if checkbox.isChecked()]
+            if not quest_combo.count() or not room_combo.count() or not weekdays or not times \
+                    or not all(value.isValid() for value in times):
+                QMessageBox.warning(dialog, "Ошибка",
+                                    "Выберите квест, комнату и дни недели, время укажите через запятую: 18:00, 19:30")
+                return None
+            return {
+                "quest_id": quest_combo.currentData(),
+                "room_id": room_combo.currentData(),
+                "weekdays": weekdays,
+                "start_times": [value.toString("HH:mm") for value in times],
+                "date_from": date_from_input.date().toString("yyyy-MM-dd"),
+                "date_to": date_to_input.date().toString("yyyy-MM-dd"),
+            }
+
+        def preview(data):
+            result = ApiClient.preview_schedule_template(data)
+            if result is None:
+                QMessageBox.warning(dialog, "Ошибка",
+                                    "Не удалось построить расписание. Время начала должно отстоять друг от друга "
+                                    "не меньше длительности квеста, а последний слот — заканчиваться до полуночи.")
+                return None
+            lines = [f"Слотов: {len(result['slots'])}, пересекаются с расписанием: {len(result['conflicts'])}"]
+            for conflict in result["conflicts"][:50]:
+                lines.append(f"{conflict['date']} {conflict['start_time'][:5]}–{conflict['end_time'][:5]} "
+                             f"(расписание #{conflict['schedule_id']})")
+            preview_output.setPlainText("\n".join(lines))
+            return result
+
+        def on_preview():
+            data = template_data()
+            if data:
+                preview(data)
+
+        preview_button.clicked.connect(on_preview)
+
+        if dialog.exec() != QDialog.Accepted:
+            return
+        data = template_data()
+        result = preview(data) if data else None
+        if result is None:
+            return
+
+        skip_conflicts = False
+        if len(result["conflicts"]) == len(result["slots"]):
+            QMessageBox.warning(self, "Ошибка", "Все слоты шаблона пересекаются с существующим расписанием")
+            return
+        if result["conflicts"]:
+            reply = QMessageBox.question(
+                self, "Пересечения",
+                f"{len(result['conflicts'])} из {len(result['slots'])} слотов пересекаются с существующим "
+                f"расписанием. Создать остальные?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+            if reply != QMessageBox.Yes:
+                return
+            skip_conflicts = True
+
+        created = ApiClient.create_schedule_template(data, skip_conflicts)
+        if not created:
+            QMessageBox.warning(self, "Ошибка", "Не удалось создать расписание по шаблону")
+            return
+        QMessageBox.information(self, "Успех", f"Создано слотов: {created['created']}, пропущено: {created['skipped']}")
+        self.reload()
+
 
 class ClientMainWindow(QMainWindow):
     def __init__(self, client_id):
@@ -2082,11 +2802,13 @@ class ClientMainWindow(QMainWindow):
         self.account_widget = ClientAccountWindow(client_id=self.client_id)
         self.quest_list_widget = QuestListWindow()
         self.booking_widget = BookingWindow(client_id=self.client_id)
+        self.my_bookings_widget = ClientBookingsWindow(client_id=self.client_id)
 
         # Добавляем виджеты в stacked widget
         self.stacked_widget.addWidget(self.quest_list_widget)
         self.stacked_widget.addWidget(self.account_widget)
         self.stacked_widget.addWidget(self.booking_widget)
+        self.stacked_widget.addWidget(self.my_bookings_widget)
 
         # Создаем навигационное меню
         self.nav_layout = QHBoxLayout()
@@ -2099,11 +2821,16 @@ class ClientMainWindow(QMainWindow):
         self.account_button.setStyleSheet("padding: 8px;")
         self.account_button.clicked.connect(lambda: self.stacked_widget.setCurrentWidget(self.account_widget))
 
+        self.my_bookings_button = QPushButton("Мои бронирования")
+        self.my_bookings_button.setStyleSheet("padding: 8px;")
+        self.my_bookings_button.clicked.connect(self.show_my_bookings)
+
         self.logout_button = QPushButton("Выйти")
         self.logout_button.setStyleSheet("padding: 8px; background-color: #d9534f;")
         self.logout_button.clicked.connect(self.logout)
 
         self.nav_layout.addWidget(self.quests_button)
+        self.nav_layout.addWidget(self.my_bookings_button)
         self.nav_layout.addWidget(self.account_button)
         self.nav_layout.addStretch()
         self.nav_layout.addWidget(self.logout_button)
@@ -2122,32 +2849,42 @@ class ClientMainWindow(QMainWindow):
         self.quest_list_widget.book_button.clicked.connect(
             lambda: self.stacked_widget.setCurrentWidget(self.booking_widget))
 
+    def show_my_bookings(self):
+        # Каждый раз с первой страницы: там появятся только что сделанные брони
+        self.my_bookings_widget.load_page(0)
+        self.stacked_widget.setCurrentWidget(self.my_bookings_widget)
+
     def logout(self):
+        ApiClient.logout()
         self.close()
-        # Здесь можно добавить дополнительную логику очистки, если необходимо
 
 
 class AdminMainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, access_level=ADMIN_ACCESS_LEVEL):
         super().__init__()
-        self.setWindowTitle("Black Rooms - Администратор")
+        is_admin = access_level >= ADMIN_ACCESS_LEVEL
+        self.setWindowTitle("Black Rooms - Администратор" if is_admin else "Black Rooms - Сотрудник")
         self.setMinimumSize(1000, 700)
 
         self.tab_widget = QTabWidget()
 
-        # Создаем виджеты для администратора
-        self.users_widget = AdminUsersWindow()
-        self.employees_widget = AdminEmployeesWindow()
+        # Вкладки пользователей и сотрудников — только администратору:
+        # остальным сотрудникам сервер ответит на их запросы 403
+        self.users_widget = AdminUsersWindow() if is_admin else None
+        self.employees_widget = AdminEmployeesWindow() if is_admin else None
         self.quests_widget = AdminQuestsWindow()
         self.bookings_widget = AdminBookingsWindow()
         self.services_widget = AdminServicesWindow()
+        self.schedule_widget = AdminScheduleWindow()
 
         # Добавляем вкладки
-        self.tab_widget.addTab(self.users_widget, "Пользователи")
-        self.tab_widget.addTab(self.employees_widget, "Сотрудники")
+        if is_admin:
+            self.tab_widget.addTab(self.users_widget, "Пользователи")
+            self.tab_widget.addTab(self.employees_widget, "Сотрудники")
         self.tab_widget.addTab(self.quests_widget, "Квесты")
         self.tab_widget.addTab(self.bookings_widget, "Бронирования")
         self.tab_widget.addTab(self.services_widget, "Услуги")
+        self.tab_widget.addTab(self.schedule_widget, "Расписание")
 
         # Создаем кнопку выхода
         self.logout_button = QPushButton("Выйти")
@@ -2170,18 +2907,24 @@ class AdminMainWindow(QMainWindow):
 
     def refresh_data(self):
         """Обновление данных во всех вкладках"""
-        current_tab = self.tab_widget.currentIndex()
+        # Полная перезагрузка затёрла бы ещё не подтверждённые правки
+        if write_queue.busy:
+            return
+
+        current_tab = self.tab_widget.currentWidget()
 
-        if current_tab == 0:
+        if current_tab is self.users_widget:
             self.users_widget.load_users()
-        elif current_tab == 1:
+        elif current_tab is self.employees_widget:
             self.employees_widget.load_employees()
-        elif current_tab == 2:
+        elif current_tab is self.quests_widget:
             self.quests_widget.load_quests()
-        elif current_tab == 3:
+        elif current_tab is self.bookings_widget:
             self.bookings_widget.load_bookings()
-        elif current_tab == 4:
+        elif current_tab is self.services_widget:
             self.services_widget.load_services()
+        elif current_tab is self.schedule_widget:
+            self.schedule_widget.reload()
 
 
 class MainApp:
@@ -2200,8 +2943,27 @@ class MainApp:
         self.login_window.login_button.clicked.connect(self.handle_login)
         self.login_window.register_button.clicked.connect(self.handle_register)
 
+        write_queue.failed.connect(self.show_write_failures)
+
+        # Фоновая синхронизация локальной реплики — после входа сотрудника
+        self.replica_worker = None
+
         sys.exit(self.app.exec())
 
+    def apply_replica_sync(self, result):
+        for resource, change in result["changes"].items():
+            store.upsert(resource, change["upserts"])
+            store.remove(resource, change["deletes"])
+
+        if result["conflicts"]:
+            lines = [f"{c['resource']} #{c['row_id']}: {c['reason']}" for c in result["conflicts"]]
+            QMessageBox.warning(QApplication.activeWindow(), "Синхронизация",
+                                "Изменения, сделанные без связи, не применены:\n" + "\n".join(lines))
+
+    def show_write_failures(self, failures):
+        QMessageBox.warning(QApplication.activeWindow(), "Ошибка",
+                            "Не удалось сохранить изменения:\n" + "\n".join(failures))
+
     def handle_login(self):
         login = self.login_window.login_input.text()
         password = self.login_window.password_input.text()
@@ -2210,25 +2972,24 @@ class MainApp:
             QMessageBox.warning(self.login_window, "Ошибка", "Введите логин и пароль")
             return
 
-        # Попробуем войти как клиент
-        login_data = {"login": login, "password": password}
-        client_response = ApiClient.login_client(login_data)
-
-        if client_response and "client_id" in client_response:
-            self.login_window.hide()
-            self.client_window = ClientMainWindow(client_response["client_id"])
-            self.client_window.show()
+        # Сервер ищет логин среди клиентов и сотрудников и возвращает роль
+        user = ApiClient.login(login, password)
+        if user is None:
+            QMessageBox.warning(self.login_window, "Ошибка", "Неверный логин или пароль")
             return
 
-        # Если не клиент, попробуем войти как сотрудник (админ)
-        # Здесь нужно добавить проверку для сотрудников
-        # Для демонстрации просто проверяем логин "admin"
-        if login == "admin" and password == "admin123":
-            self.login_window.hide()
-            self.admin_window = AdminMainWindow()
-            self.admin_window.show()
+        self.login_window.hide()
+        if user["role"] == "client":
+            self.client_window = ClientMainWindow(user["user_id"])
+            self.client_window.show()
         else:
-            QMessageBox.warning(self.login_window, "Ошибка", "Неверный логин или пароль")
+            # Журнал изменений и полные списки сервер отдаёт только сотрудникам
+            if replica_sync is not None and self.replica_worker is None:
+                self.replica_worker = ReplicaSyncWorker(replica_sync, REPLICA_SYNC_INTERVAL)
+                self.replica_worker.synced.connect(self.apply_replica_sync)
+                self.replica_worker.start()
+            self.admin_window = AdminMainWindow(user["access_level"])
+            self.admin_window.show()
 
     def handle_register(self):
         dialog = QDialog(self.login_window)
@@ -2284,6 +3045,7 @@ class MainApp:
                                     "Не удалось зарегистрироваться. Возможно, такой логин уже существует.")
 
     def logout(self):
+        ApiClient.logout()
         if self.client_window:
             self.client_window.hide()
             self.client_window = None
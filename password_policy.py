@@ -0,0 +1,95 @@
+"""Политика хеширования паролей: схема и стоимость под конкретный сервер.
+
+Стоимость хеша подбирается замером на этой машине (python main.py calibrate):
+берётся самая дорогая настройка, при которой одна проверка пароля укладывается
+в заданное время, но не ниже минимума из MIN_COST. Результат сохраняется в
+файл в формате CryptContext из passlib. Хеши со старой схемой или стоимостью
+помечаются устаревшими и пересчитываются при следующем успешном входе.
+
+argon2 доступен, если установлен пакет argon2-cffi; bcrypt остаётся в списке
+схем, чтобы старые хеши проверялись и обновлялись.
+"""
+import os
+import statistics
+import time
+
+from passlib.context import CryptContext
+from passlib.hash import argon2, bcrypt
+
+# По умолчанию — рядом с модулем, а не в текущем каталоге: сервер и calibrate,
+# запущенные из разных мест, читают одну политику
+POLICY_PATH = os.environ.get(
+    "BLACKROOMS_PASSWORD_POLICY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "password_policy.ini")
+)
+
+# Ниже этих значений калибровка не опускается даже на медленной машине
+MIN_COST = {"bcrypt": 10, "argon2": 2}
+MAX_COST = {"bcrypt": 16, "argon2": 20}
+# Память argon2 в КиБ (рекомендация OWASP — не меньше 19 МиБ)
+ARGON2_MEMORY_KIB = 19456
+
+SAMPLE_PASSWORD = "calibration-password"
+
+
+def available_schemes():
+    schemes = ["bcrypt"]
+    if argon2.has_backend():
+        schemes.insert(0, "argon2")
+    return schemes
+
+
+def load_context(path=POLICY_PATH):
+    # Без файла политики — bcrypt со стоимостью passlib по умолчанию; argon2
+    # остаётся в списке, чтобы хеши, созданные по прежней политике, проверялись
+    if path and os.path.exists(path):
+        return CryptContext.from_path(path)
+    return CryptContext(schemes=["bcrypt"] + [s for s in available_schemes() if s != "bcrypt"],
+                        default="bcrypt", deprecated="auto")
+
+
+def measure(handler, samples=3):
+    # Медиана нескольких хешей в миллисекундах; проверка стоит столько же
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash(SAMPLE_PASSWORD)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def cost_handler(scheme, cost, memory_kib=ARGON2_MEMORY_KIB):
+    if scheme == "argon2":
+        return argon2.using(rounds=cost, memory_cost=memory_kib, parallelism=1)
+    return bcrypt.using(rounds=cost)
+
+
+def calibrate(scheme, target_ms, memory_kib=ARGON2_MEMORY_KIB):
+    # -> (стоимость, время одной проверки в мс). Время растёт со стоимостью
+    # монотонно (у bcrypt — вдвое на шаг), поэтому идём снизу до первого превышения
+    if scheme not in available_schemes():
+        raise ValueError(f"Схема {scheme} недоступна (для argon2 нужен пакет argon2-cffi)")
+    cost = MIN_COST[scheme]
+    elapsed = measure(cost_handler(scheme, cost, memory_kib))
+    while cost < MAX_COST[scheme]:
+        next_elapsed = measure(cost_handler(scheme, cost + 1, memory_kib))
+        if next_elapsed > target_ms:
+            break
+        cost, elapsed = cost + 1, next_elapsed
+    return cost, elapsed
+
+
+def build_context(scheme, cost, memory_kib=ARGON2_MEMORY_KIB):
+    # Новая схема — первая в списке; остальные нужны для проверки старых хешей.
+    # min/max_rounds равны стоимости: needs_update пересчитает и более слабые,
+    # и более дорогие хеши, чтобы проверка везде укладывалась в бюджет
+    schemes = [scheme] + [s for s in ("argon2", "bcrypt") if s != scheme and s in available_schemes()]
+    settings = {"schemes": schemes, "default": scheme, "deprecated": "auto", f"{scheme}__rounds": cost,
+                f"{scheme}__min_rounds": cost, f"{scheme}__max_rounds": cost}
+    if scheme == "argon2":
+        settings.update(argon2__memory_cost=memory_kib, argon2__parallelism=1)
+    return CryptContext(**settings)
+
+
+def save_context(context, path=POLICY_PATH):
+    with open(path, "w") as f:
+        f.write(context.to_string())
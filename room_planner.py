@@ -0,0 +1,91 @@
+"""Подбор комнаты и времени для брони.
+
+Время — минуты от начала дня. Для каждой подходящей по вместимости комнаты
+занятые сеансы дня превращаются в свободные промежутки, и в каждом
+промежутке ищется начало, ближайшее к желаемому. Кроме нового сеанса группа
+может присоединиться к уже созданному сеансу того же квеста, если в нём
+хватает мест.
+
+Варианты сравниваются по порядку:
+1. сдвиг от желаемого времени — клиент выбирал время сам;
+2. лишние места (best fit): маленькая группа не занимает большую комнату,
+   пока есть подходящая по размеру;
+3. «мёртвые» минуты — остатки промежутка до и после сеанса, куда уже не
+   поместится ни один квест. Сеанс, поставленный вплотную к соседнему,
+   не дробит расписание.
+На комнату возвращается один лучший вариант.
+"""
+
+
+def free_gaps(sessions, opening, closing):
+    # sessions — (начало, конец) в любом порядке -> свободные [начало, конец)
+    gaps, cursor = [], opening
+    for start, end in sorted(sessions):
+        if start > cursor:
+            gaps.append((cursor, min(start, closing)))
+        cursor = max(cursor, end)
+        if cursor >= closing:
+            break
+    if cursor < closing:
+        gaps.append((cursor, closing))
+    return [(start, end) for start, end in gaps if end > start]
+
+
+def place_in_gap(gap, duration, preferred, step):
+    # Начало в промежутке, ближайшее к preferred и кратное step; если кратного
+    # нет, сеанс ставится вплотную к началу промежутка. None — не помещается
+    gap_start, gap_end = gap
+    latest = gap_end - duration
+    if latest < gap_start:
+        return None
+    target = min(max(preferred, gap_start), latest)
+    aligned = [s for s in (target - target % step, target - target % step + step) if gap_start <= s <= latest]
+    if not aligned:
+        return gap_start
+    return min(aligned, key=lambda s: (abs(s - preferred), s))
+
+
+def dead_minutes(gap, start, end, min_duration):
+    leftovers = (start - gap[0], gap[1] - end)
+    return sum(m for m in leftovers if 0 < m < min_duration)
+
+
+def suggest(rooms, sessions, quest_id, duration, preferred, participants, min_duration,
+            opening, closing, step=15, limit=5):
+    # rooms — {room_id: вместимость} доступных комнат; sessions — {room_id:
+    # [(начало, конец, schedule_id, quest_id, занято мест)]}. Возвращает
+    # варианты от лучшего: словари с room_id, start, end, schedule_id (если это
+    # существующий сеанс), shift, wasted_seats, dead_minutes
+    options = []
+    for room_id, capacity in rooms.items():
+        if capacity is None or capacity < participants:
+            continue
+        room_sessions = sessions.get(room_id, [])
+        candidates = []
+
+        for start, end, schedule_id, session_quest, booked in room_sessions:
+            free_seats = capacity - booked
+            if session_quest == quest_id and start >= opening and free_seats >= participants:
+                candidates.append({"start": start, "end": end, "schedule_id": schedule_id,
+                                   "wasted_seats": free_seats - participants, "dead_minutes": 0})
+
+        for gap in free_gaps([(s[0], s[1]) for s in room_sessions], opening, closing):
+            start = place_in_gap(gap, duration, preferred, step)
+            if start is None:
+                continue
+            candidates.append({"start": start, "end": start + duration, "schedule_id": None,
+                               "wasted_seats": capacity - participants,
+                               "dead_minutes": dead_minutes(gap, start, start + duration, min_duration)})
+
+        for candidate in candidates:
+            candidate.update(room_id=room_id, shift=abs(candidate["start"] - preferred))
+        if candidates:
+            options.append(min(candidates, key=option_key))
+
+    options.sort(key=option_key)
+    return options[:limit]
+
+
+def option_key(option):
+    return (option["shift"], option["wasted_seats"], option["dead_minutes"],
+            option["schedule_id"] is None, option["room_id"])
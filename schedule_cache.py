@@ -0,0 +1,103 @@
+"""Подгрузка расписания по дням для ленты комнат.
+
+Лента показывает только видимые дни, поэтому данные запрашиваются
+диапазоном (GET /schedules/?from=&to=) — видимое окно плюс соседние дни
+с каждой стороны, чтобы прокрутка не упиралась в загрузку. Строки
+складываются в общее хранилище (EntityStore), а здесь учитывается только,
+какие дни уже загружены. Запросы выполняет фоновый поток; соседние
+недостающие дни склеиваются в один диапазон.
+"""
+import threading
+from datetime import timedelta
+
+from PySide6.QtCore import QObject, Signal
+
+
+def day_ranges(days):
+    # Отсортированные дни -> непрерывные диапазоны [(первый, последний), ...]
+    ranges = []
+    for day in days:
+        if ranges and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+
+class ScheduleCache(QObject):
+    # loaded(first, last) — дни загружены и уже лежат в хранилище
+    loaded = Signal(object, object)
+    _fetched = Signal(object, object, object)
+
+    def __init__(self, store, fetch, prefetch_days=7):
+        super().__init__()
+        # fetch(first, last) -> {ресурс: строки}, вызывается в фоновом потоке;
+        # при ошибке возвращает None
+        self.store = store
+        self.fetch = fetch
+        self.prefetch_days = prefetch_days
+        self._loaded = set()
+        self._requested = set()
+        self._queue = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._fetched.connect(self._apply)
+
+    def is_loaded(self, day):
+        return day in self._loaded
+
+    def ensure(self, first, last):
+        # Видимые дни first..last; соседние дни подгружаются заранее
+        start = first - timedelta(days=self.prefetch_days)
+        count = (last - first).days + 1 + 2 * self.prefetch_days
+        days = [start + timedelta(days=i) for i in range(count)]
+        # Сначала видимые дни, потом запас по краям
+        missing = [d for d in days if d not in self._loaded and d not in self._requested]
+        if not missing:
+            return
+
+        visible = [d for d in missing if first <= d <= last]
+        around = [d for d in missing if d < first or d > last]
+        self._requested.update(missing)
+        with self._condition:
+            self._queue.extend(day_ranges(visible))
+            self._queue.extend(day_ranges(around))
+            self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def invalidate(self):
+        # Следующий ensure перечитает дни с сервера; уже показанные данные остаются
+        self._loaded.clear()
+        self._requested.clear()
+        with self._condition:
+            self._queue.clear()
+
+    def _apply(self, first, last, result):
+        days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+        self._requested.difference_update(days)
+        if result is None:
+            return
+        for resource, rows in result.items():
+            self.store.upsert(resource, rows)
+
+        # Расписания этих дней, которых больше нет на сервере: ищем по индексу
+        # by_room_date только загруженные дни, а не все расписания хранилища
+        fresh = {row["schedule_id"] for row in result.get("schedules", [])}
+        room_ids = {r["room_id"] for r in self.store.all("rooms")}
+        self.store.remove("schedules", [
+            s["schedule_id"] for day in days for room_id in room_ids
+            for s in self.store.lookup("schedules", "by_room_date", (room_id, day.isoformat()))
+            if s["schedule_id"] not in fresh
+        ])
+        self._loaded.update(days)
+        self.loaded.emit(first, last)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                first, last = self._queue.pop(0)
+            self._fetched.emit(first, last, self.fetch(first, last))
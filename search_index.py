@@ -0,0 +1,139 @@
+"""Поисковый индекс для фильтрации таблиц клиента.
+
+Текст строки разбивается на токены в нижнем регистре. Индекс токенов хранит
+для каждого токена id строк; слово запроса ищется как подстрока токена в
+словаре — все различные токены, склеенные в одну строку, так что поиск идёт
+одним проходом str.find, а не перебором строк таблицы. Обновление строки
+затрагивает только её собственные токены, а полная замена данных только
+помечает индекс устаревшим — он перестраивается при следующем поиске.
+"""
+
+SEPARATOR = "\n"
+
+
+def tokenize(values):
+    tokens = set()
+    for value in values:
+        if value is None:
+            continue
+        tokens.update(str(value).lower().split())
+    return tokens
+
+
+class SearchIndex:
+    def __init__(self, fields_func):
+        # fields_func(row) — значения, по которым ищется строка
+        self._fields_func = fields_func
+        self._row_tokens = {}
+        self._tokens = {}
+        self._vocabulary = None
+        self._source = None
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._row_tokens)
+
+    def clear(self):
+        self._row_tokens.clear()
+        self._tokens.clear()
+        self._vocabulary = None
+
+    def rebuild(self, rows, primary_key):
+        self.clear()
+        row_tokens, tokens = self._row_tokens, self._tokens
+        for row in rows:
+            row_id = row[primary_key]
+            row_tokens[row_id] = current = tokenize(self._fields_func(row))
+            for token in current:
+                ids = tokens.get(token)
+                if ids is None:
+                    tokens[token] = {row_id}
+                else:
+                    ids.add(row_id)
+
+    def attach(self, store, resource, depends=()):
+        # Индекс следует за изменениями ресурса в EntityStore. depends —
+        # ресурсы, из которых fields_func берёт подписи (клиент брони и т.п.)
+        self._source = (store, resource)
+        self._dirty = True
+
+        def on_change(changed_resource, ids):
+            if changed_resource in depends or (changed_resource == resource and ids is None):
+                self._dirty = True
+                return
+            if changed_resource != resource or self._dirty:
+                return
+            for row_id in ids:
+                row = store.get(resource, row_id)
+                if row is None:
+                    self.remove(row_id)
+                else:
+                    self.update(row_id, row)
+
+        store.subscribe(on_change)
+
+    def update(self, row_id, row):
+        tokens = tokenize(self._fields_func(row))
+        old_tokens = self._row_tokens.get(row_id, set())
+        for token in old_tokens - tokens:
+            self._remove_token(token, row_id)
+        for token in tokens - old_tokens:
+            self._add_token(token, row_id)
+        self._row_tokens[row_id] = tokens
+
+    def remove(self, row_id):
+        for token in self._row_tokens.pop(row_id, ()):
+            self._remove_token(token, row_id)
+
+    def search(self, query):
+        # None — пустой запрос, подходят все строки
+        words = query.lower().split()
+        if not words:
+            return None
+        if self._dirty:
+            store, resource = self._source
+            self.rebuild(store.all(resource), store.primary_key(resource))
+            self._dirty = False
+
+        result = None
+        # Сначала самые длинные слова: у них меньше кандидатов
+        for word in sorted(words, key=len, reverse=True):
+            ids = set()
+            for token in self._matching_tokens(word):
+                ids.update(self._tokens[token])
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return result
+
+    def _matching_tokens(self, word):
+        if self._vocabulary is None:
+            self._vocabulary = SEPARATOR + SEPARATOR.join(self._tokens) + SEPARATOR
+
+        vocabulary = self._vocabulary
+        matches = []
+        position = vocabulary.find(word)
+        while position != -1:
+            start = vocabulary.rfind(SEPARATOR, 0, position) + 1
+            end = vocabulary.find(SEPARATOR, position)
+            matches.append(vocabulary[start:end])
+            # Следующее совпадение ищем уже в другом токене
+            position = vocabulary.find(word, end)
+        return matches
+
+    def _add_token(self, token, row_id):
+        ids = self._tokens.get(token)
+        if ids is None:
+            self._tokens[token] = {row_id}
+            self._vocabulary = None
+        else:
+            ids.add(row_id)
+
+    def _remove_token(self, token, row_id):
+        ids = self._tokens.get(token)
+        if ids is None:
+            return
+        ids.discard(row_id)
+        if not ids:
+            del self._tokens[token]
+            self._vocabulary = None
@@ -0,0 +1,140 @@
+"""Общее состояние между воркерами API.
+
+Всё, что приложение держит в памяти процесса (кэши, счётчики, уведомления),
+при нескольких воркерах uvicorn расходится. Через SharedState воркеры
+рассылают друг другу события: сброс кэша по ключу и произвольные сообщения
+по каналам.
+
+LocalSharedState — для одного процесса. SQLiteSharedState — локальная
+замена брокеру: события пишутся в отдельный файл SQLite, каждый воркер
+опрашивает его и раздаёт новые события своим подписчикам.
+"""
+import asyncio
+import inspect
+import json
+import os
+import time
+import uuid
+
+import databases
+
+INVALIDATE_CHANNEL = "invalidate"
+
+
+class SharedState:
+    def __init__(self):
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._subscribers = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def on_invalidate(self, callback):
+        self.subscribe(INVALIDATE_CHANNEL, lambda message: callback(message["key"]))
+
+    async def publish(self, channel, message):
+        await self._dispatch(channel, message)
+
+    async def invalidate(self, key):
+        await self.publish(INVALIDATE_CHANNEL, {"key": key})
+
+    async def _dispatch(self, channel, message):
+        for callback in self._subscribers.get(channel, []):
+            try:
+                result = callback(message)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error in shared state subscriber for '{channel}': {e}")
+
+
+class LocalSharedState(SharedState):
+    """События остаются внутри процесса."""
+
+
+class SQLiteSharedState(SharedState):
+    """Рассылка событий между процессами через общий файл SQLite."""
+
+    def __init__(self, url, poll_interval=0.1, retention=60.0):
+        super().__init__()
+        self.database = databases.Database(url)
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._last_event_id = 0
+        self._poller = None
+
+    async def start(self):
+        await self.database.connect()
+        await self.database.execute("PRAGMA journal_mode=WAL")
+        await self.database.execute(
+            "CREATE TABLE IF NOT EXISTS shared_event ("
+            " event_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " channel TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " origin TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._last_event_id = await self.database.fetch_val(
+            "SELECT COALESCE(MAX(event_id), 0) FROM shared_event"
+        )
+        self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        await self.database.disconnect()
+
+    async def publish(self, channel, message):
+        await self.database.execute(
+            "INSERT INTO shared_event (channel, payload, origin, created_at)"
+            " VALUES (:channel, :payload, :origin, :created_at)",
+            {"channel": channel, "payload": json.dumps(message, default=str),
+             "origin": self.worker_id, "created_at": time.time()},
+        )
+        # Свои подписчики получают событие сразу, без ожидания опроса
+        await self._dispatch(channel, message)
+
+    async def _poll(self):
+        last_cleanup = time.monotonic()
+        while True:
+            try:
+                rows = await self.database.fetch_all(
+                    "SELECT event_id, channel, payload, origin FROM shared_event"
+                    " WHERE event_id > :last ORDER BY event_id",
+                    {"last": self._last_event_id},
+                )
+                for row in rows:
+                    self._last_event_id = row["event_id"]
+                    if row["origin"] != self.worker_id:
+                        await self._dispatch(row["channel"], json.loads(row["payload"]))
+
+                if time.monotonic() - last_cleanup > self.retention:
+                    await self.database.execute(
+                        "DELETE FROM shared_event WHERE created_at < :border",
+                        {"border": time.time() - self.retention},
+                    )
+                    last_cleanup = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error polling shared events: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+def create_shared_state(url):
+    if not url or url == "local":
+        return LocalSharedState()
+    if url.startswith("sqlite:"):
+        return SQLiteSharedState(url)
+    raise ValueError(f"Unsupported shared state backend: {url}")
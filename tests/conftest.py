@@ -0,0 +1,48 @@
+"""Общие фикстуры тестов API: временная база с начальными данными и входы."""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main читает настройки при импорте, поэтому база задаётся до него
+DATA_DIR = tempfile.mkdtemp(prefix="blackrooms-tests-")
+os.environ["BLACKROOMS_DATABASE_URL"] = f"sqlite:///{os.path.join(DATA_DIR, 'blackrooms.db')}"
+os.environ["BLACKROOMS_PASSWORD_POLICY"] = os.path.join(DATA_DIR, "password_policy.ini")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+# Учётные записи из insert_initial_data
+ADMIN = ("admin", "admin123")
+MASTER = ("master1", "master123")
+CLIENT = ("smirnov", "client123")  # client_id 1
+OTHER_CLIENT = ("kuznetsova", "client123")  # client_id 2
+
+
+@pytest.fixture(scope="session")
+def client():
+    # TestClient этой версии Starlette работает в текущем цикле событий потока
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main.run_command("seed"))
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def login(client):
+    # Заголовок Authorization для учётной записи; токены кешируются на весь прогон
+    tokens = {}
+
+    def headers(account):
+        if account not in tokens:
+            username, password = account
+            response = client.post("/token", data={"username": username, "password": password})
+            assert response.status_code == 200, response.text
+            tokens[account] = response.json()["access_token"]
+        return {"Authorization": f"Bearer {tokens[account]}"}
+
+    return headers
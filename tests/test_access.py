@@ -0,0 +1,26 @@
+import pytest
+
+from conftest import ADMIN, CLIENT, MASTER
+
+STAFF_LISTS = ["/clients/", "/changes/", "/bookings/", "/booking-services/", "/payments/", "/employees/"]
+
+
+@pytest.mark.parametrize("path", STAFF_LISTS)
+def test_lists_require_token(client, path):
+    assert client.get(path).status_code == 401
+
+
+@pytest.mark.parametrize("path", STAFF_LISTS)
+def test_lists_are_staff_only(client, login, path):
+    assert client.get(path, headers=login(CLIENT)).status_code == 403
+    assert client.get(path, headers=login(MASTER)).status_code == 200
+
+
+@pytest.mark.parametrize("path, own", [
+    ("/clients/1", True), ("/clients/2", False),
+    ("/bookings/1", True), ("/bookings/2", False),
+])
+def test_client_reads_only_own_rows(client, login, path, own):
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=login(CLIENT)).status_code == (200 if own else 403)
+    assert client.get(path, headers=login(ADMIN)).status_code == 200
@@ -0,0 +1,15 @@
+import pytest
+
+from benchmark import percentile
+
+
+@pytest.mark.parametrize("count, fraction, expected", [
+    (100, 0.50, 50), (100, 0.95, 95), (100, 0.99, 99), (100, 0.07, 7), (100, 1.0, 100),
+    (10, 0.50, 5), (10, 0.95, 10), (10, 0.0, 1), (1, 0.99, 1),
+])
+def test_percentile_nearest_rank(count, fraction, expected):
+    assert percentile(list(range(1, count + 1)), fraction) == expected
+
+
+def test_percentile_of_empty_list():
+    assert percentile([], 0.95) == 0.0
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+from conftest import ADMIN, CLIENT, MASTER
+
+
+def new_session_booking(client, headers, status, start_time):
+    return client.post("/bookings/new-session", headers=headers, json={
+        "client_id": 1, "quest_id": 3, "room_id": 2, "date": (date.today() + timedelta(days=50)).isoformat(),
+        "start_time": start_time, "participants_count": 1, "status": status,
+    })
+
+
+def booking_update(row, status):
+    fields = ("client_id", "schedule_id", "employee_id", "participants_count")
+    return {**{key: row[key] for key in fields}, "status": status}
+
+
+def test_client_creates_bookings_only_as_pending(client, login):
+    response = client.post("/bookings/", headers=login(CLIENT), json={
+        "client_id": 1, "schedule_id": 1, "status": "Подтвержден", "participants_count": 1,
+    })
+    assert response.status_code == 403
+    assert new_session_booking(client, login(CLIENT), "Подтвержден", "10:00").status_code == 403
+
+    response = new_session_booking(client, login(CLIENT), "На рассмотрение", "10:00")
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "На рассмотрение"
+
+
+def test_only_staff_confirms_and_completes(client, login):
+    row = new_session_booking(client, login(CLIENT), "На рассмотрение", "12:00").json()
+    path = f"/bookings/{row['booking_id']}"
+
+    assert client.put(path, headers=login(CLIENT), json=booking_update(row, "Подтвержден")).status_code == 403
+    response = client.put(path, headers=login(MASTER), json=booking_update(row, "Подтвержден"))
+    assert response.status_code == 200, response.text
+
+    row = response.json()
+    assert client.put(path, headers=login(CLIENT), json=booking_update(row, "Завершен")).status_code == 403
+    assert client.put(path, headers=login(ADMIN), json=booking_update(row, "Завершен")).status_code == 200
+
+
+def test_client_cancels_own_booking(client, login):
+    row = new_session_booking(client, login(CLIENT), "На рассмотрение", "14:00").json()
+    response = client.put(f"/bookings/{row['booking_id']}", headers=login(CLIENT),
+                          json=booking_update(row, "Отменен"))
+    assert response.status_code == 200, response.text
@@ -0,0 +1,17 @@
+from local_replica import LocalReplica
+
+
+def test_rows_between_filters_range_in_sqlite(tmp_path):
+    replica = LocalReplica(str(tmp_path / "replica.db"), {"schedules": "schedule_id"},
+                           range_fields={"schedules": "date"})
+    rows = [{"schedule_id": i, "date": f"2026-01-{i % 10 + 1:02d}", "room_id": i % 3} for i in range(1, 61)]
+    replica.replace("schedules", rows)
+
+    expected = [r for r in rows if "2026-01-03" <= r["date"] <= "2026-01-05" and r["room_id"] == 1]
+    assert replica.rows_between("schedules", "2026-01-03", "2026-01-05", room_id=1) == expected
+    assert len(replica.rows_between("schedules", "2026-01-03", "2026-01-05")) == 18
+
+    plan = replica._connection.execute(
+        "EXPLAIN QUERY PLAN SELECT data FROM replica_row INDEXED BY ix_replica_schedules_range"
+        " WHERE resource = 'schedules' AND json_extract(data, '$.date') BETWEEN ? AND ?", ("a", "b")).fetchall()
+    assert "ix_replica_schedules_range" in plan[0][-1]
@@ -0,0 +1,27 @@
+import sqlite3
+from datetime import date, timedelta
+
+import main
+from conftest import CLIENT
+
+
+def test_new_session_invalidates_occupancy_after_commit(client, login, monkeypatch):
+    # Кеш сбрасывается, когда новый сеанс уже виден другим соединениям
+    day = date.today() + timedelta(days=60)
+    database_path = main.DATABASE_URL[len("sqlite:///"):]
+    seen = []
+    invalidate = main.invalidate_occupancy
+
+    async def checked_invalidate(days):
+        with sqlite3.connect(database_path) as connection:
+            seen.append(connection.execute(
+                "SELECT COUNT(*) FROM schedule WHERE date = ? AND room_id = 2", (day.isoformat(),)).fetchone()[0])
+        await invalidate(days)
+
+    monkeypatch.setattr(main, "invalidate_occupancy", checked_invalidate)
+    response = client.post("/bookings/new-session", headers=login(CLIENT), json={
+        "client_id": 1, "quest_id": 1, "room_id": 2, "date": day.isoformat(),
+        "start_time": "15:00", "participants_count": 1,
+    })
+    assert response.status_code == 200, response.text
+    assert seen == [1]
@@ -0,0 +1,22 @@
+from datetime import date
+
+from entity_store import EntityStore
+from schedule_cache import ScheduleCache
+
+
+def test_apply_removes_only_stale_schedules_of_loaded_days():
+    store = EntityStore({"rooms": "room_id", "schedules": "schedule_id"})
+    store.define_index("schedules", "by_room_date", lambda s: (s.get("room_id"), s.get("date")))
+    store.upsert("rooms", [{"room_id": 1}, {"room_id": 2}])
+    store.upsert("schedules", [
+        {"schedule_id": 1, "room_id": 1, "date": "2026-03-01"},
+        {"schedule_id": 2, "room_id": 2, "date": "2026-03-01"},
+        {"schedule_id": 3, "room_id": 1, "date": "2026-03-03"},
+    ])
+    cache = ScheduleCache(store, fetch=None)
+
+    cache._apply(date(2026, 3, 1), date(2026, 3, 2),
+                 {"schedules": [{"schedule_id": 1, "room_id": 1, "date": "2026-03-01"}]})
+
+    assert sorted(s["schedule_id"] for s in store.all("schedules")) == [1, 3]
+    assert cache.is_loaded(date(2026, 3, 2))
@@ -0,0 +1,19 @@
+from datetime import date, timedelta
+
+from conftest import ADMIN
+
+
+def test_suggestion_joins_session_ending_at_midnight(client, login):
+    day = date.today() + timedelta(days=40)
+    response = client.post("/schedules/", headers=login(ADMIN), json={
+        "quest_id": 1, "room_id": 1, "date": day.isoformat(), "start_time": "23:00", "end_time": "00:00",
+    })
+    assert response.status_code == 200, response.text
+    schedule_id = response.json()["schedule_id"]
+
+    response = client.get("/rooms/suggestions", params={
+        "quest_id": 1, "date": day.isoformat(), "time": "23:00", "participants": 1, "limit": 50,
+    })
+    assert response.status_code == 200, response.text
+    joined = [option for option in response.json() if option["schedule_id"] == schedule_id]
+    assert joined and joined[0]["start_time"] == "23:00:00" and joined[0]["end_time"] == "00:00:00"
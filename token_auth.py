@@ -0,0 +1,99 @@
+"""Токены доступа для запросов клиента к серверу.
+
+POST /token по логину и паролю выдаёт короткоживущий access-токен и
+refresh-токен. TokenAuth подставляется в requests.Session как auth и
+добавляет заголовок Authorization ко всем запросам сессии. Незадолго до
+истечения access-токен обновляется через POST /token/refresh; если сервер
+всё же ответил 401, токен обновляется и запрос повторяется один раз.
+"""
+import threading
+import time
+
+import requests
+
+# За сколько секунд до истечения обновлять access-токен заранее
+REFRESH_MARGIN = 30
+
+
+class TokenAuth(requests.auth.AuthBase):
+    def __init__(self, base_url, timeout=10):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.access_token = None
+        self.refresh_token = None
+        self.expires_at = 0
+        self.user = None
+        self._lock = threading.Lock()
+
+    def login(self, login, password, role=None):
+        # role — "client" или "employee"; без неё сервер проверит обе таблицы.
+        # Отдельный запрос без auth, чтобы не подставлять старый токен
+        data = {"username": login, "password": password}
+        if role:
+            data["scope"] = role
+        response = requests.post(f"{self.base_url}/token", data=data, timeout=self.timeout)
+        response.raise_for_status()
+        self._store(response.json())
+        return self.user
+
+    def clear(self):
+        with self._lock:
+            self.access_token = self.refresh_token = self.user = None
+            self.expires_at = 0
+
+    def _store(self, token):
+        with self._lock:
+            self.access_token = token["access_token"]
+            self.refresh_token = token["refresh_token"]
+            self.expires_at = time.monotonic() + token["expires_in"]
+            self.user = {key: token[key] for key in ("role", "user_id", "access_level")}
+
+    def _refresh(self, rejected_token=None):
+        # Несколько потоков могут упереться в истёкший токен одновременно:
+        # обновляет первый, остальные берут уже новый
+        with self._lock:
+            if self.refresh_token is None:
+                return False
+            if rejected_token is not None and self.access_token != rejected_token:
+                return True
+            if rejected_token is None and time.monotonic() < self.expires_at - REFRESH_MARGIN:
+                return True
+            refresh_token = self.refresh_token
+        try:
+            response = requests.post(f"{self.base_url}/token/refresh",
+                                     json={"refresh_token": refresh_token}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Error refreshing token: {e}")
+            return False
+        if response.status_code != 200:
+            # Refresh-токен истёк или пользователь удалён — нужен повторный вход
+            self.clear()
+            return False
+        self._store(response.json())
+        return True
+
+    def __call__(self, request):
+        if self.refresh_token is not None and time.monotonic() >= self.expires_at - REFRESH_MARGIN:
+            self._refresh()
+        if self.access_token is not None:
+            request.headers["Authorization"] = f"Bearer {self.access_token}"
+            request.register_hook("response", self._retry_unauthorized)
+        return request
+
+    def _retry_unauthorized(self, response, **kwargs):
+        if response.status_code != 401 or getattr(response.request, "_token_retried", False):
+            return response
+        rejected = response.request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not self._refresh(rejected) or self.access_token is None:
+            return response
+
+        # Тело ответа дочитываем, чтобы соединение вернулось в пул
+        response.content
+        response.close()
+        retry = response.request.copy()
+        retry._token_retried = True
+        retry.headers["Authorization"] = f"Bearer {self.access_token}"
+        new_response = response.connection.send(retry, **kwargs)
+        new_response.history.append(response)
+        new_response.request = retry
+        return new_response
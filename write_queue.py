@@ -0,0 +1,209 @@
+"""Фоновая очередь записи с оптимистичным обновлением.
+
+Изменение сразу применяется к общему хранилищу (EntityStore), и окна
+перерисовывают только затронутые строки. Запросы к серверу отправляет
+фоновый поток пачками: правки одной строки, ещё не ушедшие на сервер,
+сливаются в один запрос. Исключение — поля из ordered_fields (например,
+статус брони, который сервер меняет только по допустимым переходам): их
+смена уходит отдельным запросом, по порядку. Если сервер запись не принял,
+строка возвращается к прежнему состоянию, следующие записи этой строки
+отменяются, а через сигнал failed приходят описания неудачных записей.
+"""
+import threading
+import time
+
+import requests
+from PySide6.QtCore import QObject, Signal
+
+# Поля, которые отправляются на сервер, но не попадают в хранилище
+SECRET_FIELDS = ("password",)
+
+# Временные id новых строк до ответа сервера; не пересекаются
+# с временными id локальной реплики (-1, -2, ...)
+TEMP_ID_START = -1_000_000
+
+
+def visible(row):
+    return {key: value for key, value in row.items() if key not in SECRET_FIELDS}
+
+
+def error_message(error):
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return str(response.json().get("detail", error))
+        except ValueError:
+            pass
+    return str(error)
+
+
+class WriteQueue(QObject):
+    failed = Signal(list)
+    _completed = Signal(list)
+
+    def __init__(self, store, send, create_paths=None, ordered_fields=None, batch_delay=0.05):
+        super().__init__()
+        # send(method, path, payload) — строка ответа (True для delete),
+        # при ошибке выбрасывает исключение. create_paths — ресурсы, которые
+        # создаются не через POST /{resource}/ (клиенты — через регистрацию).
+        # ordered_fields — {ресурс: поля}, смены которых не сливаются
+        self.store = store
+        self.send = send
+        self.create_paths = dict(create_paths or {})
+        self.ordered_fields = dict(ordered_fields or {})
+        self.batch_delay = batch_delay
+        self._pending = []
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._next_temp_id = TEMP_ID_START
+        self._real_ids = {}
+        self._thread = None
+        self._completed.connect(self._apply_results)
+
+    # Вызываются из потока интерфейса
+
+    def create(self, resource, payload, description):
+        temp_id = self._next_temp_id
+        self._next_temp_id -= 1
+        self.store.upsert(resource, [{**visible(payload), self.store.primary_key(resource): temp_id}])
+        self._submit(resource, temp_id, "post", payload, None, description)
+        return temp_id
+
+    def update(self, resource, row_id, payload, description):
+        previous = self.store.get(resource, row_id)
+        previous = dict(previous) if previous is not None else None
+        self.store.upsert(resource, [{**visible(payload), self.store.primary_key(resource): row_id}])
+        self._submit(resource, row_id, "put", payload, previous, description)
+
+    def delete(self, resource, row_id, description):
+        previous = self.store.get(resource, row_id)
+        previous = dict(previous) if previous is not None else None
+        self.store.remove(resource, [row_id])
+        self._submit(resource, row_id, "delete", None, previous, description)
+
+    def _submit(self, resource, row_id, method, payload, previous, description):
+        entry = {"resource": resource, "row_id": row_id, "method": method, "payload": payload,
+                 "previous": previous, "description": description}
+        with self._condition:
+            queued = [e for e in self._pending if (e["resource"], e["row_id"]) == (resource, row_id)]
+            if not queued:
+                self._pending.append(entry)
+            elif method == "put":
+                last = queued[-1]
+                if last["method"] != "delete" and not self._reorders(resource, last["payload"], payload):
+                    # Ещё не отправленная запись той же строки: шлём одну, с последними данными
+                    last["payload"] = {**last["payload"], **payload}
+                    last["description"] = description
+                else:
+                    self._pending.append(entry)
+            else:
+                self._pending = [e for e in self._pending if e not in queued]
+                if queued[0]["method"] != "post":
+                    # Откатывать при ошибке — к состоянию до первой неотправленной правки
+                    self._pending.append({**entry, "previous": queued[0]["previous"]})
+                # Иначе строка удалена, так и не попав на сервер
+            self._condition.notify()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _reorders(self, resource, queued_payload, payload):
+        # Новая правка меняет поле, смены которого сервер проверяет по порядку
+        return any(field in payload and payload[field] != queued_payload.get(field)
+                   for field in self.ordered_fields.get(resource, ()))
+
+    @property
+    def busy(self):
+        # Есть записи, ещё не подтверждённые сервером
+        with self._condition:
+            return bool(self._pending) or self._in_flight > 0
+
+    def _has_pending(self, resource, row_id):
+        with self._condition:
+            return any((e["resource"], e["row_id"]) == (resource, row_id) for e in self._pending)
+
+    def _cancel_pending(self, resource, row_id):
+        with self._condition:
+            cancelled = [e for e in self._pending if (e["resource"], e["row_id"]) == (resource, row_id)]
+            self._pending = [e for e in self._pending if e not in cancelled]
+        return cancelled
+
+    def _apply_results(self, results):
+        with self._condition:
+            self._in_flight -= len(results)
+        failures, restored = [], set()
+        for entry in results:
+            resource, row_id, method = entry["resource"], entry["row_id"], entry["method"]
+            # Правка строки, созданной в предыдущей пачке, шла уже по настоящему id
+            real_id = self._real_ids.get((resource, row_id), row_id)
+            if entry["error"] is None:
+                if method == "post":
+                    self.store.remove(resource, [row_id])
+                    self.store.upsert(resource, [visible(entry["result"])])
+                elif method == "put" and not self._has_pending(resource, row_id):
+                    self.store.upsert(resource, [visible(entry["result"])])
+                elif method == "delete":
+                    self.store.remove(resource, [real_id])
+                continue
+
+            # Следующие правки этой строки строились поверх неудачной
+            cancelled = self._cancel_pending(resource, row_id)
+            failures.append(f"{entry['description']}: {entry['error']}")
+            failures.extend(f"{e['description']}: отменено" for e in cancelled)
+            # Строку возвращает первая неудачная запись пачки: у следующих
+            # previous — уже несостоявшееся состояние
+            if (resource, row_id) in restored:
+                continue
+            restored.add((resource, row_id))
+            if method == "post":
+                self.store.remove(resource, [row_id])
+            elif entry["previous"] is not None:
+                self.store.upsert(resource, [{**entry["previous"], self.store.primary_key(resource): real_id}])
+
+        if failures:
+            self.failed.emit(failures)
+
+    # Фоновый поток
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            # Короткая пауза собирает правки, сделанные подряд, в одну пачку
+            time.sleep(self.batch_delay)
+            with self._condition:
+                batch, self._pending = self._pending, []
+                self._in_flight += len(batch)
+            results, failed = [], set()
+            for entry in batch:
+                key = (entry["resource"], entry["row_id"])
+                if key in failed:
+                    # Правка строилась поверх записи, которую сервер не принял
+                    results.append({**entry, "result": None, "error": "отменено"})
+                    continue
+                result = self._send(entry)
+                if result["error"] is not None:
+                    failed.add(key)
+                results.append(result)
+            self._completed.emit(results)
+
+    def _send(self, entry):
+        resource, method = entry["resource"], entry["method"]
+        row_id = self._real_ids.get((resource, entry["row_id"]), entry["row_id"])
+        if method != "post" and row_id <= TEMP_ID_START:
+            return {**entry, "result": None, "error": "строка не была создана на сервере"}
+
+        if method == "post":
+            path = self.create_paths.get(resource, f"/{resource}/")
+        else:
+            path = f"/{resource}/{row_id}"
+        try:
+            result = self.send(method, path, entry["payload"])
+        except requests.exceptions.RequestException as e:
+            return {**entry, "result": None, "error": error_message(e)}
+
+        if method == "post":
+            self._real_ids[(resource, entry["row_id"])] = result[self.store.primary_key(resource)]
+        return {**entry, "result": result, "error": None}